@@ -0,0 +1,100 @@
+import datetime
+import json
+import platform
+import statistics
+import subprocess
+import time
+
+import pytest
+
+_RECORDER_KEY = pytest.StashKey()
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup('benchmark', 'Catalog-scale benchmarks')
+    group.addoption('--benchmark-revisions', type=int, default=500,
+                    help='Number of draft revisions of the synthetic catalog.')
+    group.addoption('--benchmark-releases', type=int, default=5,
+                    help='Number of releases of the synthetic catalog.')
+    group.addoption('--benchmark-extensions', type=int, default=200,
+                    help='Number of extensions of each revision of the synthetic catalog.')
+    group.addoption('--benchmark-rounds', type=int, default=5,
+                    help='Number of timed rounds of each benchmark.')
+    group.addoption('--benchmark-json', metavar='PATH',
+                    help='Write the results as JSON to PATH, to compare them across commits.')
+
+
+class BenchmarkRecorder:
+    """
+    Time the benchmarks and collect their results.
+    """
+
+    def __init__(self, config):
+        self.rounds = config.getoption('benchmark_rounds')
+        self.catalog = {
+            'draftRevisions': config.getoption('benchmark_revisions'),
+            'releases': config.getoption('benchmark_releases'),
+            'extensions': config.getoption('benchmark_extensions'),
+        }
+        self.results = {}
+
+    def measure(self, name, func, rounds=None):
+        """
+        Call ``func(round)`` a number of times and record the statistics of its durations.
+
+        :param name: The name of the benchmark
+        :param func: The timed function, it is passed the index of the round
+        :param rounds: The number of rounds, the ``--benchmark-rounds`` option by default
+        """
+        durations = []
+        for index in range(rounds or self.rounds):
+            start = time.perf_counter()
+            func(index)
+            durations.append(time.perf_counter() - start)
+        self.results[name] = {
+            'rounds': len(durations),
+            'min': min(durations),
+            'median': statistics.median(durations),
+            'mean': statistics.mean(durations),
+            'max': max(durations),
+        }
+
+
+def _gitCommit(rootdir):
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=str(rootdir), capture_output=True, text=True,
+            check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+@pytest.fixture(name='benchmark')
+def fixture_benchmark(request):
+    return request.config.stash.setdefault(_RECORDER_KEY, BenchmarkRecorder(request.config))
+
+
+def pytest_terminal_summary(terminalreporter, config):
+    recorder = config.stash.get(_RECORDER_KEY, None)
+    if recorder is None or not recorder.results:
+        return
+    terminalreporter.write_sep('-', 'benchmarks (seconds)')
+    width = max(len(name) for name in recorder.results)
+    for name, result in recorder.results.items():
+        terminalreporter.write_line('%-*s  median %.4f  min %.4f  max %.4f' % (
+            width, name, result['median'], result['min'], result['max']))
+
+
+def pytest_sessionfinish(session):
+    recorder = session.config.stash.get(_RECORDER_KEY, None)
+    path = session.config.getoption('benchmark_json')
+    if recorder is None or not path:
+        return
+    with open(path, 'w') as f:
+        json.dump({
+            'commit': _gitCommit(session.config.rootpath),
+            'datetime': datetime.datetime.utcnow().isoformat(),
+            'python': platform.python_version(),
+            'catalog': recorder.catalog,
+            'benchmarks': recorder.results,
+        }, f, indent=2, sort_keys=True)
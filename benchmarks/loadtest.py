@@ -0,0 +1,295 @@
+"""
+Load generator replaying the traffic of the Slicer extensions manager against a running Girder
+server with the plugin, for instance populated with ``girder synthetic-catalog``.
+
+Each worker thread sends a weighted mix of operations:
+
+* ``catalog``: list the extensions of an ``app_revision``, ``os`` and ``arch``, the recent
+  revisions being the most requested
+* ``search``: search the extensions of a revision with ``q``
+* ``dependencies``: resolve the dependencies of an extension
+* ``download``: download an extension package, triggering the download statistics update
+* ``upload``: a burst of extension uploads to a new revision, as done by the nightly builds
+
+The throughput and the p50, p95 and p99 latencies of each route are reported once the run is
+over. Run it from the root of the repository::
+
+    $ python -m benchmarks.loadtest --api-url http://localhost:8080/api/v1 --api-key KEY --app-id ID
+"""
+import concurrent.futures
+import json
+import math
+import os
+import random
+import threading
+import time
+
+import click
+import girder_client
+
+OPERATIONS = ('catalog', 'search', 'dependencies', 'download', 'upload')
+
+DEFAULT_MIX = 'catalog=55,search=15,dependencies=10,download=15,upload=5'
+
+SEARCH_TERMS = ('segmentation', 'registration', 'dicom', 'mri', 'python', 'volume', 'surgery', 'tracking')
+
+PLATFORMS = [(os_, arch) for os_ in ('linux', 'macosx', 'win') for arch in ('amd64', 'i386')]
+
+
+def parseMix(value):
+    """
+    Parse the weights of the operations, given as ``operation=weight`` separated by commas.
+
+    :param value: The weights of the operations
+    :return: A dict mapping each operation of :const:`OPERATIONS` to its weight
+    """
+    mix = dict.fromkeys(OPERATIONS, 0)
+    for entry in value.split(','):
+        name, _, weight = entry.partition('=')
+        name = name.strip()
+        if name not in mix:
+            msg = 'Unknown operation "%s", expected one of %s.' % (name, ', '.join(OPERATIONS))
+            raise click.BadParameter(msg)
+        mix[name] = float(weight)
+    return mix
+
+
+def percentile(durations, fraction):
+    """
+    Compute a percentile of durations with the nearest-rank method.
+
+    :param durations: The sorted durations
+    :param fraction: The percentile, between 0 and 1
+    :return: The duration
+    """
+    if not durations:
+        return 0.0
+    return durations[max(0, math.ceil(fraction * len(durations)) - 1)]
+
+
+class Recorder:
+    """
+    Collect the durations and errors of the requests of each route.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.durations = {}
+        self.errors = {}
+
+    def call(self, route, func, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        except girder_client.HttpError:
+            with self._lock:
+                self.errors[route] = self.errors.get(route, 0) + 1
+            return None
+        finally:
+            duration = time.perf_counter() - start
+            with self._lock:
+                self.durations.setdefault(route, []).append(duration)
+
+    def report(self, elapsed):
+        """
+        Summarize the requests of each route.
+
+        :param elapsed: The duration of the run in seconds
+        :return: A dict mapping each route to its ``requests``, ``errors``, ``throughput`` in
+            requests per second and ``p50``, ``p95`` and ``p99`` latencies in seconds
+        """
+        report = {}
+        for route, samples in sorted(self.durations.items()):
+            durations = sorted(samples)
+            report[route] = {
+                'requests': len(durations),
+                'errors': self.errors.get(route, 0),
+                'throughput': len(durations) / elapsed,
+                'p50': percentile(durations, 0.50),
+                'p95': percentile(durations, 0.95),
+                'p99': percentile(durations, 0.99),
+            }
+        return report
+
+
+class Catalog:
+    """
+    The revisions and extensions of the application used to build the requests.
+    """
+
+    def __init__(self, client, appId, uploadRevision, limit=500):
+        self.appId = appId
+        drafts = client.get('app/%s/draft' % appId, parameters={'limit': limit})
+        releases = client.get('app/%s/release' % appId, parameters={'limit': limit})
+        # Most recent first
+        self.revisions = [folder['meta']['revision'] for folder in drafts + releases
+                          if folder.get('meta', {}).get('revision')]
+        if not self.revisions:
+            msg = 'The application %s has no revision.' % appId
+            raise click.ClickException(msg)
+        extensions = client.get('app/%s/extension' % appId, parameters={
+            'app_revision': self.revisions[0], 'limit': limit})
+        self.baseNames = sorted({extension['meta']['baseName'] for extension in extensions})
+        self.downloads = [extension['_id'] for extension in extensions if extension.get('size')]
+        if uploadRevision is None:
+            latest = self.revisions[0]
+            uploadRevision = str(int(latest) + 1) if latest.isdigit() else '%s-loadtest' % latest
+        self.uploadRevision = uploadRevision
+
+    def revision(self, rng):
+        """
+        Pick a revision, the extensions managers of the recent revisions being the most active.
+        """
+        return self.revisions[min(int(rng.expovariate(0.2)), len(self.revisions) - 1)]
+
+
+class Worker:
+    def __init__(self, apiUrl, token, catalog, recorder, seed, burstSize, binarySize):
+        self.client = girder_client.GirderClient(apiUrl=apiUrl)
+        self.client.setToken(token)
+        self.application = catalog
+        self.recorder = recorder
+        self.rng = random.Random(seed)
+        self.burstSize = burstSize
+        self.binarySize = binarySize
+
+    def run(self, mix, deadline):
+        operations = [name for name in OPERATIONS if mix[name] > 0]
+        weights = [mix[name] for name in operations]
+        while time.perf_counter() < deadline:
+            getattr(self, self.rng.choices(operations, weights)[0])()
+
+    def _platform(self):
+        return self.rng.choice(PLATFORMS)
+
+    def catalog(self):
+        os_, arch = self._platform()
+        self.recorder.call(
+            'GET /app/:app_id/extension', self.client.get, 'app/%s/extension' % self.application.appId,
+            parameters={'app_revision': self.application.revision(self.rng), 'os': os_, 'arch': arch, 'limit': 50})
+
+    def search(self):
+        os_, arch = self._platform()
+        self.recorder.call(
+            'GET /app/:app_id/extension?q', self.client.get, 'app/%s/extension' % self.application.appId,
+            parameters={'app_revision': self.application.revision(self.rng), 'os': os_, 'arch': arch,
+                        'q': self.rng.choice(SEARCH_TERMS), 'limit': 50})
+
+    def dependencies(self):
+        if not self.application.baseNames:
+            return
+        os_, arch = self._platform()
+        self.recorder.call(
+            'GET /app/:app_id/extension/dependencies', self.client.get,
+            'app/%s/extension/dependencies' % self.application.appId,
+            parameters={'baseName': self.rng.choice(self.application.baseNames),
+                        'app_revision': self.application.revisions[0], 'os': os_, 'arch': arch})
+
+    def download(self):
+        if not self.application.downloads:
+            return
+        self.recorder.call(
+            'GET /item/:id/download', self._download, self.rng.choice(self.application.downloads))
+
+    def _download(self, itemId):
+        # The download statistics are updated once the whole content is sent
+        return self.client.get('item/%s/download' % itemId, jsonResp=False).content
+
+    def upload(self):
+        os_, arch = self._platform()
+        for _ in range(self.burstSize):
+            baseName = self.rng.choice(self.application.baseNames or ['LoadTestExtension'])
+            extension = self.recorder.call(
+                'POST /app/:app_id/extension', self.client.post, 'app/%s/extension' % self.application.appId,
+                parameters={
+                    'os': os_,
+                    'arch': arch,
+                    'baseName': baseName,
+                    'repository_type': 'git',
+                    'repository_url': 'https://github.com/Slicer/%s.git' % baseName,
+                    'revision': '%040x' % self.rng.getrandbits(160),
+                    'app_revision': self.application.uploadRevision,
+                    'description': 'Extension uploaded by the load test',
+                })
+            if extension is None or not self.binarySize:
+                continue
+            upload = self.recorder.call(
+                'POST /app/:app_id/extension/:ext_id/file', self.client.post,
+                'app/%s/extension/%s/file' % (self.application.appId, extension['_id']),
+                parameters={'name': '%s.tar.gz' % extension['name'], 'size': self.binarySize})
+            if upload is None or upload.get('_modelType') == 'file':
+                continue
+            self.recorder.call(
+                'POST /file/chunk', self.client.post, 'file/chunk',
+                parameters={'uploadId': upload['_id'], 'offset': 0}, data=os.urandom(self.binarySize))
+
+
+def printReport(report):
+    width = max([len(route) for route in report] + [len('route')])
+    click.echo('%-*s  %8s  %6s  %8s  %8s  %8s  %8s' % (
+        width, 'route', 'requests', 'errors', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms'))
+    for route, stats in report.items():
+        click.echo('%-*s  %8d  %6d  %8.1f  %8.1f  %8.1f  %8.1f' % (
+            width, route, stats['requests'], stats['errors'], stats['throughput'],
+            stats['p50'] * 1000, stats['p95'] * 1000, stats['p99'] * 1000))
+
+
+@click.command(help='Replay the traffic of the Slicer extensions manager against a Girder server.')
+@click.option('--api-url', default='http://localhost:8080/api/v1', show_default=True,
+              help='The URL of the Girder API.')
+@click.option('--api-key', envvar='GIRDER_API_KEY', default=None,
+              help='The API key of the user, required by the uploads and the private applications.')
+@click.option('--app-id', required=True, help='The ID of the application.')
+@click.option('-c', '--concurrency', default=8, show_default=True, help='Number of concurrent workers.')
+@click.option('-t', '--duration', default=60.0, show_default=True, help='Duration of the run in seconds.')
+@click.option('--mix', default=DEFAULT_MIX, show_default=True, callback=lambda _ctx, _param, value: parseMix(value),
+              help='Weights of the operations.')
+@click.option('--burst-size', default=20, show_default=True, help='Number of extensions uploaded by a burst.')
+@click.option('--binary-size', default=1024, show_default=True,
+              help='Size in bytes of the uploaded binaries, 0 to only create the extensions.')
+@click.option('--upload-revision', default=None,
+              help='The app_revision of the uploaded extensions, the latest revision plus one by default.')
+@click.option('--seed', default=0, show_default=True, help='Seed of the random generator.')
+@click.option('--json', 'jsonPath', type=click.Path(dir_okay=False, writable=True), default=None,
+              help='Write the report as JSON to this path.')
+def main(api_url, api_key, app_id, concurrency, duration, mix, burst_size, binary_size, upload_revision,
+         seed, jsonPath):
+    if not any(mix.values()):
+        msg = 'At least one operation of --mix must have a positive weight.'
+        raise click.UsageError(msg)
+    client = girder_client.GirderClient(apiUrl=api_url)
+    if api_key:
+        client.authenticate(apiKey=api_key)
+    elif mix['upload']:
+        msg = 'The uploads require --api-key, or set the weight of "upload" to 0 in --mix.'
+        raise click.UsageError(msg)
+    catalog = Catalog(client, app_id, upload_revision)
+    recorder = Recorder()
+
+    start = time.perf_counter()
+    deadline = start + duration
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [
+            executor.submit(
+                Worker(api_url, client.token, catalog, recorder, seed + index, burst_size, binary_size).run,
+                mix, deadline)
+            for index in range(concurrency)]
+        for future in futures:
+            future.result()
+    elapsed = time.perf_counter() - start
+
+    report = recorder.report(elapsed)
+    printReport(report)
+    if jsonPath:
+        with open(jsonPath, 'w') as f:
+            json.dump({
+                'apiUrl': api_url,
+                'concurrency': concurrency,
+                'duration': elapsed,
+                'mix': mix,
+                'routes': report,
+            }, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+import pytest
+
+from girder import events
+from girder.models.folder import Folder
+from girder.models.item import Item
+from girder.models.token import Token
+from girder.models.user import User
+
+from pytest_girder.assertions import assertStatusOk
+
+from slicer_package_manager import constants, synthetic
+
+
+@pytest.fixture(name='admin')
+def fixture_admin():
+    return User().createUser('admin', 'password', 'Admin', 'Admin', 'admin@email.com')
+
+
+@pytest.fixture(name='catalog')
+def fixture_catalog(admin, benchmark):
+    """
+    Seed the synthetic catalog once for all the benchmarks, the database of the server being
+    dropped after each test.
+    """
+    application = synthetic.createApplication(admin, 'Slicer')
+    seeded = {}
+
+    def seed(_):
+        seeded.update(synthetic.seedCatalog(application, admin, **benchmark.catalog))
+    benchmark.measure('seedCatalog', seed, rounds=1)
+    benchmark.catalog['documents'] = seeded['counts']
+    return application, seeded
+
+
+@pytest.mark.plugin('slicer_package_manager')
+def testCatalogBenchmarks(server, admin, catalog, benchmark):
+    application, summary = catalog
+    appId = str(application['_id'])
+    token = Token().createToken(admin)
+    draft = Folder().findOne({'parentId': application['_id'], 'name': constants.DRAFT_RELEASE_NAME})
+    release = Folder().findOne({'parentId': application['_id'], 'name': summary['releases'][-1]})
+    latestRevision = summary['draftRevisions'][-1]
+    extension = Item().findOne({'meta.app_id': appId, 'meta.app_revision': latestRevision})
+    package = Item().findOne({'folderId': release['_id']})
+
+    def get(path, **params):
+        def request(_):
+            resp = server.request(path=path, params=params, token=token)
+            assertStatusOk(resp)
+        return request
+
+    extensionPath = '/app/%s/extension' % appId
+    benchmark.measure('getExtensions.release', get(
+        extensionPath, release_id=str(release['_id']), os='linux', arch='amd64', limit=50))
+    benchmark.measure('getExtensions.draftRevision', get(
+        extensionPath, release_id=str(draft['_id']), app_revision=latestRevision, os='linux', arch='amd64',
+        limit=50))
+    benchmark.measure('getExtensions.acrossDraftRevisions', get(
+        extensionPath, release_id=str(draft['_id']), os='linux', arch='amd64', limit=50))
+    benchmark.measure('getExtensions.baseName', get(
+        extensionPath, baseName=summary['baseNames'][-1], os='linux', arch='amd64', limit=50))
+    benchmark.measure('getExtensions.extensionId', get(
+        extensionPath, extension_id=str(extension['_id'])))
+    benchmark.measure('getExtensions.search', get(
+        extensionPath, app_revision=latestRevision, q='segmentation', limit=50))
+    benchmark.measure('getExtensions.tier', get(
+        extensionPath, app_revision=latestRevision, tier=3, tier_compare='gte', limit=50))
+
+    packagePath = '/app/%s/package' % appId
+    benchmark.measure('getPackages', get(packagePath, os='linux', arch='amd64', limit=50))
+    benchmark.measure('getPackages.release', get(
+        packagePath, release_id_or_name=release['name'], limit=50))
+
+    def createOrUpdateExtension(index):
+        resp = server.request(path=extensionPath, method='POST', token=token, params={
+            'os': 'linux',
+            'arch': 'amd64',
+            'baseName': 'BenchmarkExtension%d' % index,
+            'repository_type': 'git',
+            'repository_url': 'https://github.com/Slicer/BenchmarkExtension.git',
+            'revision': '%040x' % index,
+            'app_revision': latestRevision,
+            'description': 'Extension created by the benchmarks',
+            'dependency': summary['baseNames'][0],
+        })
+        assertStatusOk(resp)
+    benchmark.measure('createOrUpdateExtension', createOrUpdateExtension)
+
+    def downloadComplete(itemId):
+        def trigger(_):
+            events.trigger('model.file.download.complete', {'file': {'itemId': itemId}})
+        return trigger
+    benchmark.measure('downloadComplete.draftExtension', downloadComplete(extension['_id']))
+    benchmark.measure('downloadComplete.releasePackage', downloadComplete(package['_id']))
+
+    benchmark.measure('getDownloadStats', get('/app/%s/downloadstats' % appId))
+
+    def renameRelease(index):
+        resp = server.request(path='/folder/%s' % release['_id'], method='PUT', token=token, params={
+            'name': '%s-%d' % (release['name'], index)})
+        assertStatusOk(resp)
+    benchmark.measure('renameRelease', renameRelease)
@@ -0,0 +1,197 @@
+import asyncio
+import contextlib
+import json
+import os
+import pytest
+
+from girder_client import HttpError
+from slicer_package_manager_client import Constant, SlicerPackageManagerError
+from slicer_package_manager_client.snapshot import ExtensionSnapshot
+
+aio = pytest.importorskip('slicer_package_manager_client.aio')
+
+
+APPS = ['App', 'App1']
+
+RELEASE = {
+    'name': 'Release',
+    'revision': 'r000',
+    'desc': 'random description 1',
+}
+
+PACKAGE = {
+    'pkg_os': 'linux',
+    'arch': 'amd64',
+    'name': 'pkg1',
+    'repo_type': 'git',
+    'repo_url': 'git@github.com:pkg1.git',
+    'revision': 'r002',
+    'version': '3.0',
+}
+
+EXTENSION = {
+    'ext_os': 'linux',
+    'arch': 'amd64',
+    'repo_type': 'git',
+    'repo_url': 'git@github.com:ext.git',
+    'revision': 'r300',
+    'app_revision': 'r002',
+}
+
+
+def _run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def _uploadState(client):
+    """Return the interrupted uploads recorded by the client."""
+    if not os.path.exists(client.uploadStateFile):
+        return {}
+    with open(client.uploadStateFile) as content:
+        return json.load(content)
+
+
+@contextlib.asynccontextmanager
+async def _client(tmp_path, **kwargs):
+    async with aio.AsyncSlicerPackageClient(
+            apiUrl='http://localhost:8080/api/v1', uploadStateFile=str(tmp_path / 'uploads.json'),
+            **kwargs) as client:
+        await client.authenticate('admin', 'password')
+        try:
+            yield client
+        finally:
+            for name in APPS:
+                with contextlib.suppress(SlicerPackageManagerError):
+                    await client.deleteApp(name)
+
+
+@pytest.mark.vcr()
+@pytest.mark.plugin('slicer_package_manager')
+def testAsyncUploadAndDownloadApplicationPackage(server, files, tmp_path):
+    assert server  # Fix warnings related to fixtures not explicitly used.
+
+    async def _test():
+        async with _client(tmp_path) as client:
+            await client.createApp(name=APPS[0])
+            pkg1 = await client.uploadApplicationPackage(files[0], APPS[0], **PACKAGE)
+            assert pkg1['meta']['baseName'] == PACKAGE['name']
+
+            await client.downloadApplicationPackage(APPS[0], pkg1['_id'], dir_path=str(tmp_path))
+            with open(tmp_path / ('%s.txt' % pkg1['name'])) as downloaded, open(files[0]) as content:
+                assert downloaded.read() == content.read()
+
+            # Update the package file without hash negotiation
+            result = await client.uploadApplicationPackage(files[1], APPS[0], hash_negotiation=False, **PACKAGE)
+            assert result == Constant.PACKAGE_NOW_UP_TO_DATE
+            await client.downloadApplicationPackage(APPS[0], pkg1['_id'], dir_path=str(tmp_path))
+            with open(tmp_path / ('%s.txt' % pkg1['name'])) as downloaded, open(files[1]) as content:
+                assert downloaded.read() == content.read()
+
+            with pytest.raises(HttpError):
+                await client.downloadFile('0' * 24, str(tmp_path / 'missing'))
+
+    _run(_test())
+
+
+@pytest.mark.vcr()
+@pytest.mark.plugin('slicer_package_manager')
+def testAsyncIterApplicationPackages(server, files, tmp_path):
+    assert server  # Fix warnings related to fixtures not explicitly used.
+
+    async def _test():
+        async with _client(tmp_path) as client:
+            await client.createApp(name=APPS[0])
+            await client.createRelease(APPS[0], RELEASE['name'], RELEASE['revision'], desc=RELEASE['desc'])
+            packages = [
+                await client.uploadApplicationPackage(files[index], APPS[0], **dict(
+                    PACKAGE, pkg_os=pkg_os, revision=revision))
+                for index, (pkg_os, revision) in enumerate([
+                    ('linux', 'r002'), ('macosx', 'r002'), ('win', 'r003'), ('linux', RELEASE['revision'])])
+            ]
+
+            # Three pages of two, one and zero packages, yielded in the order of their ID
+            iterated = [package async for package in client.iterApplicationPackages(APPS[0], pageSize=2)]
+            assert [package['_id'] for package in iterated] == sorted(package['_id'] for package in packages)
+
+            iterated = [package async for package in client.iterApplicationPackages(
+                APPS[0], pkg_os='linux', limit=1, pageSize=2)]
+            assert [package['_id'] for package in iterated] == [packages[0]['_id']]
+
+            iterated = [package async for package in client.iterApplicationPackages(
+                APPS[0], release=RELEASE['name'])]
+            assert [package['_id'] for package in iterated] == [packages[3]['_id']]
+
+            with pytest.raises(SlicerPackageManagerError, match='The page size must be a positive number.'):
+                _ = [package async for package in client.iterApplicationPackages(APPS[0], pageSize=0)]
+
+    _run(_test())
+
+
+@pytest.mark.vcr()
+@pytest.mark.plugin('slicer_package_manager')
+def testAsyncExtensions(server, files, tmp_path):
+    assert server  # Fix warnings related to fixtures not explicitly used.
+
+    async def _test():
+        async with _client(tmp_path) as client:
+            await client.createApp(name=APPS[0])
+            extensions = [
+                await client.uploadExtension(files[index], APPS[0], name=name, **EXTENSION)
+                for index, name in enumerate(['ext1', 'ext2', 'ext3'])
+            ]
+            # An extension is not uploaded again for the same revision
+            assert await client.uploadExtension(
+                files[0], APPS[0], name='ext1', **EXTENSION) == Constant.EXTENSION_AREADY_UP_TO_DATE
+
+            iterated = [extension async for extension in client.iterExtensions(APPS[0], pageSize=2)]
+            assert [extension['_id'] for extension in iterated] == sorted(extension['_id'] for extension in extensions)
+
+            await client.downloadExtension(APPS[0], extensions[1]['_id'], dir_path=str(tmp_path))
+            with open(tmp_path / ('%s.txt' % extensions[1]['name'])) as downloaded, open(files[1]) as content:
+                assert downloaded.read() == content.read()
+
+            path = await client.downloadExtensionSnapshot(
+                APPS[0], app_revision=EXTENSION['app_revision'], dir_path=str(tmp_path))
+            with ExtensionSnapshot(path) as snapshot:
+                assert sorted(row['baseName'] for row in snapshot) == ['ext1', 'ext2', 'ext3']
+                assert [row['_id'] for row in snapshot.find(baseName='ext2')] == [extensions[1]['_id']]
+
+    _run(_test())
+
+
+@pytest.mark.vcr()
+@pytest.mark.plugin('slicer_package_manager')
+def testAsyncResumeInterruptedUpload(server, files, tmp_path):
+    assert server  # Fix warnings related to fixtures not explicitly used.
+
+    class _UploadInterruptedError(Exception):
+        pass
+
+    def _interrupt(progress):
+        if progress['current'] == 16:
+            raise _UploadInterruptedError
+
+    async def _test():
+        async with _client(tmp_path, chunkSize=8) as client:
+            await client.put('system/setting', parameters={'key': 'core.upload_minimum_chunk_size', 'value': 0})
+            app = await client.createApp(name=APPS[0])
+            item = await client.post('item', parameters={'folderId': app['_id'], 'name': 'resumable'})
+
+            with pytest.raises(_UploadInterruptedError):
+                await client.uploadFileToItemResumable(item['_id'], files[0], progressCallback=_interrupt)
+            (entry,) = _uploadState(client).values()
+            assert entry['offset'] == 16
+
+            # Only the remaining chunks are sent
+            offsets = []
+            file = await client.uploadFileToItemResumable(
+                item['_id'], files[0], progressCallback=lambda progress: offsets.append(progress['current']))
+            assert offsets == [24, 28]
+            assert _uploadState(client) == {}
+            await client.downloadFile(file['_id'], str(tmp_path / 'downloaded.txt'))
+            with open(tmp_path / 'downloaded.txt') as downloaded, open(files[0]) as content:
+                assert downloaded.read() == content.read()
+
+            await client.put('system/setting', parameters={'key': 'core.upload_minimum_chunk_size', 'value': 'null'})
+
+    _run(_test())
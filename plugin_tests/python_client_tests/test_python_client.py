@@ -1,10 +1,16 @@
 import contextlib
+import io
+import json
 import time
 import os
+import sqlite3
 import pytest
 
+from girder import events
 from girder_client import HttpError
 from slicer_package_manager_client import SlicerPackageClient, SlicerPackageManagerError
+from slicer_package_manager_client.mirror import STATE_FILE_NAME, Mirror
+from slicer_package_manager_client.snapshot import ExtensionSnapshot
 
 try:
     # Only available in Python 3.7+
@@ -511,6 +517,52 @@ def testListApplicationPackage(server, spc, apps, releases, packages):
     assert pkg_list[0]['meta']['os'] == 'macosx'
 
 
+def _countPages(spc, monkeypatch):
+    """Record the offset of each page requested by the client."""
+    offsets = []
+    get = spc.get
+
+    def _get(path, parameters=None, **kwargs):
+        if parameters and 'offset' in parameters:
+            offsets.append(parameters['offset'])
+        return get(path, parameters=parameters, **kwargs)
+
+    monkeypatch.setattr(spc, 'get', _get)
+    return offsets
+
+
+@pytest.mark.vcr()
+@pytest.mark.plugin('slicer_package_manager')
+def testIterApplicationPackages(server, spc, apps, releases, packages, monkeypatch):
+    # Fix warnings related to fixtures not explicitly used.
+    assert server
+    assert releases
+
+    offsets = _countPages(spc, monkeypatch)
+    ids = sorted(package['_id'] for package in packages)
+
+    # The packages are yielded in the order of their ID, across the page boundary
+    pkg_list = list(spc.iterApplicationPackages(app_name=apps[0]['name'], release=None, pageSize=2))
+    assert [pkg['_id'] for pkg in pkg_list] == ids
+    assert offsets == [0, 2]
+
+    # A full last page requires an empty page to stop
+    del offsets[:]
+    pkg_list = list(spc.iterApplicationPackages(app_name=apps[0]['name'], release=None, pageSize=3))
+    assert [pkg['_id'] for pkg in pkg_list] == ids
+    assert offsets == [0, 3]
+
+    # No page is requested beyond the limit
+    del offsets[:]
+    pkg_list = list(spc.iterApplicationPackages(
+        app_name=apps[0]['name'], release=None, limit=2, pageSize=1))
+    assert [pkg['_id'] for pkg in pkg_list] == ids[:2]
+    assert offsets == [0, 1]
+
+    with pytest.raises(SlicerPackageManagerError, match='The page size must be a positive number.'):
+        list(spc.iterApplicationPackages(app_name=apps[0]['name'], pageSize=0))
+
+
 @pytest.mark.vcr()
 @pytest.mark.plugin('slicer_package_manager')
 def testDeletePackage(server, spc, apps, packages):
@@ -642,6 +694,54 @@ def testListExtension(server, spc, apps, extensions):
     assert ext_list[0]['meta']['os'] == 'macosx'
 
 
+@pytest.mark.vcr()
+@pytest.mark.plugin('slicer_package_manager')
+def testIterExtensions(server, spc, apps, extensions, monkeypatch):
+    assert server  # Fix warnings related to fixtures not explicitly used.
+
+    offsets = _countPages(spc, monkeypatch)
+
+    # The extensions of all the releases are yielded in the order of their ID
+    ext_list = list(spc.iterExtensions(app_name=apps[0]['name'], all=True, pageSize=2))
+    assert [ext['_id'] for ext in ext_list] == sorted(ext['_id'] for ext in extensions)
+    assert offsets == [0, 2]
+
+    # The extensions of the draft release
+    del offsets[:]
+    ext_list = list(spc.iterExtensions(app_name=apps[0]['name'], pageSize=1))
+    assert [ext['_id'] for ext in ext_list] == sorted(ext['_id'] for ext in extensions[:2])
+    assert offsets == [0, 1, 2]
+
+
+@pytest.mark.vcr()
+@pytest.mark.plugin('slicer_package_manager')
+def testDownloadExtensionSnapshot(server, spc, apps, extensions, tmp_path):
+    assert server  # Fix warnings related to fixtures not explicitly used.
+
+    path = spc.downloadExtensionSnapshot(app_name=apps[0]['name'], dir_path=str(tmp_path))
+    with ExtensionSnapshot(path) as snapshot:
+        assert len(snapshot) == 3
+        assert sorted(snapshot.column('baseName')) == ['ext1', 'ext2', 'ext3']
+
+        # Lookups compare the string indices of the server-generated table
+        (ext,) = snapshot.find(os='macosx', arch='amd64')
+        assert ext['_id'] == extensions[0]['_id']
+        assert ext['baseName'] == EXTENSIONS[0]['baseName']
+        assert ext['app_revision'] == EXTENSIONS[0]['app_revision']
+        assert ext['size'] == str(os.path.getsize(EXTENSIONS[0]['filepath']))
+        assert [row['_id'] for row in snapshot.find(app_revision=RELEASES[0]['revision'])] == [extensions[2]['_id']]
+        assert list(snapshot.find(os='macosx', arch='i386')) == []
+        assert list(snapshot.find(baseName='missing')) == []
+        with pytest.raises(SlicerPackageManagerError, match='Unknown column "missing".'):
+            snapshot.column('missing')
+
+    # Snapshot of a single revision of the application
+    path = spc.downloadExtensionSnapshot(
+        app_name=apps[0]['name'], app_revision=EXTENSIONS[1]['app_revision'], dir_path=str(tmp_path))
+    with ExtensionSnapshot(path) as snapshot:
+        assert [row['_id'] for row in snapshot] == [extensions[1]['_id']]
+
+
 @pytest.mark.vcr()
 @pytest.mark.plugin('slicer_package_manager')
 def testDeleteExtension(server, spc, apps, extensions):
@@ -661,3 +761,227 @@ def testDeleteExtension(server, spc, apps, extensions):
     with pytest.raises(SlicerPackageManagerError, match=expected_msg):
         spc.deleteExtension(
             app_name=apps[0]['name'], id_or_name=extensions[0]['name'])
+
+
+class _UploadInterruptedError(Exception):
+    pass
+
+
+def _interruptAfter(chunks):
+    """Return a progress callback interrupting an upload once ``chunks`` chunks were sent."""
+    sent = []
+
+    def _progress(progress):
+        sent.append(progress['current'])
+        if len(sent) == chunks:
+            raise _UploadInterruptedError
+
+    return _progress
+
+
+def _uploadState(spc):
+    """Return the interrupted uploads recorded by the client."""
+    if not os.path.exists(spc.uploadStateFile):
+        return {}
+    with open(spc.uploadStateFile) as content:
+        return json.load(content)
+
+
+def _download(spc, file):
+    content = io.BytesIO()
+    spc.downloadFile(file['_id'], content)
+    return content.getvalue().decode()
+
+
+@pytest.fixture
+def resumable(spc, apps, tmp_path):
+    """Upload in chunks of 8 bytes to a new item, recording the interrupted uploads in ``tmp_path``."""
+    spc.MAX_CHUNK_SIZE = 8
+    spc.uploadStateFile = str(tmp_path / 'uploads.json')
+    spc.put('system/setting', parameters={'key': 'core.upload_minimum_chunk_size', 'value': 0})
+    yield spc.createItem(apps[0]['_id'], 'resumable')
+    spc.put('system/setting', parameters={'key': 'core.upload_minimum_chunk_size', 'value': 'null'})
+
+
+@pytest.mark.vcr()
+@pytest.mark.plugin('slicer_package_manager')
+def testResumeInterruptedUpload(server, spc, resumable, files):
+    assert server  # Fix warnings related to fixtures not explicitly used.
+
+    with pytest.raises(_UploadInterruptedError):
+        spc.uploadFileToItemResumable(resumable['_id'], files[0], progressCallback=_interruptAfter(2))
+    (entry,) = _uploadState(spc).values()
+    assert entry['offset'] == 16
+
+    # Only the remaining chunks are sent
+    offsets = []
+    file = spc.uploadFileToItemResumable(
+        resumable['_id'], files[0], progressCallback=lambda progress: offsets.append(progress['current']))
+    assert offsets == [24, 28]
+    assert _uploadState(spc) == {}
+    with open(files[0]) as content:
+        assert _download(spc, file) == content.read()
+
+
+@pytest.mark.vcr()
+@pytest.mark.plugin('slicer_package_manager')
+def testResumeUploadWithStaleOffset(server, spc, resumable, files):
+    assert server  # Fix warnings related to fixtures not explicitly used.
+
+    with pytest.raises(_UploadInterruptedError):
+        spc.uploadFileToItemResumable(resumable['_id'], files[0], progressCallback=_interruptAfter(1))
+    (entry,) = _uploadState(spc).values()
+    assert entry['offset'] == 8
+
+    # The server received one more chunk than recorded, the upload resumes from the server offset
+    with open(files[0], 'rb') as content:
+        content.seek(8)
+        spc.post('file/chunk?offset=8&uploadId=%s' % entry['uploadId'], data=content.read(8))
+    offsets = []
+    file = spc.uploadFileToItemResumable(
+        resumable['_id'], files[0], progressCallback=lambda progress: offsets.append(progress['current']))
+    assert offsets == [24, 28]
+    with open(files[0]) as content:
+        assert _download(spc, file) == content.read()
+
+    # The upload was discarded on the server, a new upload is started
+    with pytest.raises(_UploadInterruptedError):
+        spc.uploadFileToItemResumable(resumable['_id'], files[1], progressCallback=_interruptAfter(1))
+    (entry,) = _uploadState(spc).values()
+    spc.delete('system/uploads', parameters={'uploadId': entry['uploadId']})
+    offsets = []
+    file = spc.uploadFileToItemResumable(
+        resumable['_id'], files[1], progressCallback=lambda progress: offsets.append(progress['current']))
+    assert offsets == [8, 16, 24, 28]
+    assert _uploadState(spc) == {}
+    with open(files[1]) as content:
+        assert _download(spc, file) == content.read()
+
+
+@pytest.mark.vcr()
+@pytest.mark.plugin('slicer_package_manager')
+def testResumeCompletedUpload(server, spc, resumable, files):
+    assert server  # Fix warnings related to fixtures not explicitly used.
+
+    def _failFinalize(_event):
+        msg = 'Failed to finalize the upload'
+        raise Exception(msg)
+
+    # The server received the whole file but failed to finalize the upload
+    with events.bound('model.upload.finalize', 'testResumeCompletedUpload', _failFinalize), \
+            pytest.raises(HttpError):
+        spc.uploadFileToItemResumable(resumable['_id'], files[0])
+    assert len(_uploadState(spc)) == 1
+
+    # The upload is finalized without sending the content again
+    offsets = []
+    file = spc.uploadFileToItemResumable(
+        resumable['_id'], files[0], progressCallback=lambda progress: offsets.append(progress['current']))
+    assert offsets == []
+    assert file['_modelType'] == 'file'
+    assert file['size'] == os.path.getsize(files[0])
+    assert _uploadState(spc) == {}
+    assert [itemFile['_id'] for itemFile in spc.listFile(resumable['_id'])] == [file['_id']]
+    with open(files[0]) as content:
+        assert _download(spc, file) == content.read()
+
+
+@pytest.mark.vcr()
+@pytest.mark.plugin('slicer_package_manager')
+def testUploadApplicationPackageHashNegotiation(server, spc, apps, files, monkeypatch):
+    # Fix warnings related to fixtures not explicitly used.
+    assert server
+    assert files
+
+    chunks = []
+    post = spc.post
+
+    def _post(path, *args, **kwargs):
+        if path.startswith('file/chunk'):
+            chunks.append(path)
+        return post(path, *args, **kwargs)
+
+    monkeypatch.setattr(spc, 'post', _post)
+
+    def _upload(revision, **kwargs):
+        return spc.uploadApplicationPackage(
+            filepath='./file1.txt', app_name=apps[0]['name'], pkg_os='linux', arch='amd64', name='pkg',
+            repo_type='git', repo_url='git@github.com:pkg.git', revision=revision, version='1.0', **kwargs)
+
+    # The server doesn't store the content yet, it is uploaded
+    _upload('r010')
+    assert len(chunks) == 1
+
+    # The content is already stored, it is attached without being transferred
+    del chunks[:]
+    pkg = _upload('r011')
+    assert chunks == []
+    (file,) = spc.get('item/%s/files' % pkg['_id'])
+    assert file['name'] == 'file1.txt'
+    with open('./file1.txt') as content:
+        assert _download(spc, file) == content.read()
+
+    # Without negotiation, the content is always transferred
+    _upload('r012', hash_negotiation=False)
+    assert len(chunks) == 1
+
+
+def _mirrored(dirPath):
+    """Return the path of the binaries stored in a mirror directory."""
+    return sorted(
+        os.path.relpath(os.path.join(root, name), dirPath)
+        for root, _, names in os.walk(dirPath)
+        for name in names if not name.startswith('.')
+    )
+
+
+@pytest.mark.vcr()
+@pytest.mark.plugin('slicer_package_manager')
+def testMirrorToDirectory(server, spc, apps, packages, extensions, tmp_path):
+    assert server  # Fix warnings related to fixtures not explicitly used.
+
+    mirror = Mirror(spc, apps[0]['name'], str(tmp_path))
+    expected = [
+        os.path.join('packages', pkg['name'], os.path.basename(package['filepath']))
+        for pkg, package in zip(packages, PACKAGES)
+    ] + [
+        os.path.join('extensions', ext['name'], os.path.basename(extension['filepath']))
+        for ext, extension in zip(extensions, EXTENSIONS)
+    ]
+
+    # The changes are mirrored page by page, one transfer at a time so that the cassette can
+    # be recorded and played back
+    report = mirror.sync(concurrency=1, pageSize=2)
+    assert sorted(report.transferred) == sorted(item['name'] for item in packages + extensions)
+    assert not report.failed
+    assert _mirrored(tmp_path) == sorted(expected)
+
+    # Nothing changed since the last synchronization
+    report = mirror.sync(concurrency=1, pageSize=2)
+    assert (report.transferred, report.skipped, report.pruned) == ([], [], [])
+
+    # The binary of a renamed package is moved, the binary of a deleted package is pruned
+    spc.put('item/%s' % packages[0]['_id'], parameters={'name': 'renamed'})
+    spc.deleteExtension(apps[0]['name'], extensions[1]['_id'])
+    report = mirror.sync(concurrency=1, pageSize=2)
+    assert report.transferred == ['renamed']
+    assert report.pruned == [extensions[1]['name']]
+    expected[0] = os.path.join('packages', 'renamed', os.path.basename(PACKAGES[0]['filepath']))
+    del expected[4]
+    assert _mirrored(tmp_path) == sorted(expected)
+
+    # If the token expired, all the packages are listed again and the packages that are not
+    # listed anymore are pruned
+    stale = tmp_path / 'packages' / 'stale' / 'file.txt'
+    stale.parent.mkdir()
+    stale.write_text('stale')
+    with contextlib.closing(sqlite3.connect(str(tmp_path / STATE_FILE_NAME))) as db:
+        db.execute('UPDATE state SET value = ?', ('2000-01-01T00:00:00',))
+        db.execute(
+            'INSERT INTO items (itemId, name, type, sha512, location) VALUES (?, ?, ?, ?, ?)',
+            ('0' * 24, 'stale', 'package', 'sha512', str(stale)))
+        db.commit()
+    report = mirror.sync(concurrency=1, pageSize=2)
+    assert report.transferred == []
+    assert report.pruned == ['stale']
+    assert _mirrored(tmp_path) == sorted(expected)
@@ -1,6 +1,10 @@
+import hashlib
+import json
+import mimetypes
 import os
+import threading
 
-from girder_client import GirderClient
+from girder_client import GirderClient, HttpError
 
 from ._vendor.bson.objectid import ObjectId
 
@@ -25,6 +29,8 @@ class Constant:
     CURRENT_FOLDER = os.getcwd()
     DRAFT_RELEASE_NAME = 'draft'
     DEFAULT_LIMIT = 50
+    DEFAULT_PAGE_SIZE = 100
+    UPLOAD_STATE_FILE = os.path.join(os.path.expanduser('~'), '.slicer_package_manager_client', 'uploads.json')
 
     # Display
     WIDTH = 25  # Shouldn't be less than 24
@@ -54,10 +60,21 @@ class SlicerPackageClient(GirderClient):
     """
 
     def __init__(self, host=None, port=None, apiRoot=None, scheme=None, apiUrl=None,
-                 progressReporterCls=None):
+                 progressReporterCls=None, chunkSize=None, uploadStateFile=None):
+        """
+        :param chunkSize: Size in bytes of each uploaded chunk. Default to ``GirderClient.MAX_CHUNK_SIZE``.
+        :param uploadStateFile: Path of the JSON file used to record the interrupted uploads
+            (see :const:`Constant.UPLOAD_STATE_FILE`).
+        """
         super().__init__(
             host=host, port=port, apiRoot=apiRoot, scheme=scheme, apiUrl=apiUrl,
             progressReporterCls=progressReporterCls)
+        if chunkSize is not None:
+            if chunkSize <= 0:
+                msg = 'The chunk size must be a positive number of bytes.'
+                raise SlicerPackageManagerError(msg)
+            self.MAX_CHUNK_SIZE = chunkSize
+        self.uploadStateFile = uploadStateFile or Constant.UPLOAD_STATE_FILE
 
     def createApp(self, name, desc=None, coll_id=None, coll_name=None, coll_desc=None,
                   public=None):
@@ -219,7 +236,7 @@ class SlicerPackageClient(GirderClient):
                         revision, app_revision, desc='', icon_url='',
                         category=None, tier=None, homepage='', screenshots=None, contributors=None,
                         dependency=None, recommends=None, dicom_support_rule=None, keywords=None,
-                        coll_id=None, force=False):
+                        coll_id=None, force=False, hash_negotiation=True):
         """
         Upload an extension by providing a path to the file. It can also be used to update an
         existing one, in this case the upload is done only if the extension has a different
@@ -247,6 +264,8 @@ class SlicerPackageClient(GirderClient):
         :param keywords: Space-separated list of keywords to help when searching for extensions.
         :param coll_id: Collection ID
         :param force: To force update the binary file
+        :param hash_negotiation: Send the SHA-512 checksum of the file first, so that a content
+            already stored on the server is attached without being uploaded again
         :return: The uploaded extension
         """
         def _displayProgress(*args, **kwargs):
@@ -284,34 +303,28 @@ class SlicerPackageClient(GirderClient):
             })
 
             # Upload the extension
-            self.uploadFileToItem(
-                extension['_id'],
-                filepath,
-                reference='',
-                mimeType='application/octet-stream',
-                progressCallback=_displayProgress)
-        else:
-            extension = extensions[0]
-            # Revision different or force upload
-            if revision != extension['meta']['revision'] or force:
-                files = list(self.listFile(extension['_id']))
-                if files:
-                    oldFile = files[0]
-                    filename = 'new_file'
-                else:
-                    filename = None
-
-                # Upload the extension
-                newFile = self.uploadFileToItem(
+            if hash_negotiation:
+                self.replacePackageFile(
+                    'extension', app['_id'], extension['_id'], filepath,
+                    progressCallback=_displayProgress, hash_negotiation=True)
+            else:
+                self.uploadFileToItem(
                     extension['_id'],
                     filepath,
                     reference='',
-                    filename=filename,
                     mimeType='application/octet-stream',
                     progressCallback=_displayProgress)
+        else:
+            extension = extensions[0]
+            # Revision different or force upload
+            if revision != extension['meta']['revision'] or force:
+                # Replace the extension binary file
+                self.replacePackageFile(
+                    'extension', app['_id'], extension['_id'], filepath,
+                    progressCallback=_displayProgress, hash_negotiation=hash_negotiation)
 
                 # Update the extension into Girder hierarchy
-                extension = self.post('/app/%s/extension' % app['_id'], parameters={
+                self.post('/app/%s/extension' % app['_id'], parameters={
                     'os': ext_os,
                     'arch': arch,
                     'baseName': name,
@@ -331,16 +344,7 @@ class SlicerPackageClient(GirderClient):
                     'dicom_support_rule': dicom_support_rule,
                     'keywords': keywords,
                 })
-
-                files = list(self.listFile(extension['_id']))
-                if len(files) == 2:
-                    # Remove the oldFIle
-                    self.delete('/file/%s' % oldFile['_id'])
-                    # Change the name
-                    self.put('/file/%s' % newFile['_id'], parameters={
-                        'name': os.path.basename(filepath),
-                    })
-                    return Constant.EXTENSION_NOW_UP_TO_DATE
+                return Constant.EXTENSION_NOW_UP_TO_DATE
             else:
                 return Constant.EXTENSION_AREADY_UP_TO_DATE
 
@@ -414,6 +418,74 @@ class SlicerPackageClient(GirderClient):
         })
         return extensions
 
+    def iterExtensions(self, app_name, coll_id=None, name=None, ext_os=None, arch=None,
+                       app_revision=None, release=Constant.DRAFT_RELEASE_NAME, query=None,
+                       limit=0, all=False, pageSize=Constant.DEFAULT_PAGE_SIZE):
+        """
+        Iterate over the extensions of a specific application ``app_name``.
+
+        Unlike :meth:`listExtension`, the extensions are requested ``pageSize`` at a time and
+        yielded as they arrive, so that only one page is held in memory no matter how many
+        extensions are matching. Extensions are yielded from the oldest to the newest so that
+        extensions uploaded during the iteration do not shift the pages.
+
+        :param app_name: Name of the application
+        :param coll_id: Collection ID
+        :param name: Base name of the extension
+        :param ext_os: The target operating system of the package
+        :param arch: The os chip architecture
+        :param app_revision: Revision of the application
+        :param release: Name of the release
+        :param query: Text expected to be found in the extension name or description
+        :param limit: Maximum number of extensions yielded, `0` means no limit
+        :param all: Boolean that allow to iterate over the extensions from all the releases
+        :param pageSize: Number of extensions requested at a time
+        :return: A generator of extensions filtered by optional parameters
+        """
+        app = self._getApp(app_name=app_name, coll_id=coll_id)
+
+        release_id = None
+        if not all:
+            release_folder = self.listRelease(app_name, release)
+            if not release_folder:
+                raise SlicerPackageManagerError(
+                    'The release "%s" doesn\'t exist.' % release)
+            release_id = release_folder['_id']
+
+        return self._iterPages('/app/%s/extension' % app['_id'], {
+            'os': ext_os,
+            'arch': arch,
+            'baseName': name,
+            'app_revision': app_revision,
+            'release_id': release_id,
+            'q': query,
+        }, limit, pageSize)
+
+    def downloadExtensionSnapshot(self, app_name, app_revision=None, coll_id=None,
+                                  dir_path=Constant.CURRENT_FOLDER, compression='gzip'):
+        """
+        Download the metadata of the extensions of an application, or of one revision of the
+        application, as a columnar snapshot. The snapshot is decompressed while it is downloaded
+        and can then be opened with :class:`slicer_package_manager_client.snapshot.ExtensionSnapshot`.
+
+        :param app_name: Name of the application
+        :param app_revision: Revision of the application, all the revisions if not specified
+        :param coll_id: Collection ID
+        :param dir_path: Path of the directory where the snapshot has to be written
+        :param compression: Compression used for the transfer, either ``gzip`` or ``zstd``
+        :return: The path of the decompressed snapshot
+        """
+        from .snapshot import decompressSnapshot  # noqa: PLC0415 (the snapshot module imports this one)
+
+        app = self._getApp(app_name=app_name, coll_id=coll_id)
+        resp = self.sendRestRequest(
+            'GET', '/app/%s/extension/snapshot' % app['_id'],
+            parameters={'app_revision': app_revision, 'compression': compression},
+            jsonResp=False, stream=True)
+        path = os.path.join(dir_path, '%s_%s_extensions.snapshot' % (app['name'], app_revision or 'all'))
+        decompressSnapshot(resp.iter_content(chunk_size=65536), path)
+        return path
+
     def deleteExtension(self, app_name, id_or_name, coll_id=None):
         """
         Delete an extension within an application.
@@ -427,7 +499,7 @@ class SlicerPackageClient(GirderClient):
 
     def uploadApplicationPackage(self, filepath, app_name, pkg_os, arch, name, repo_type,
                                  repo_url, revision, version, build_date=None, coll_id=None, desc='',
-                                 pre_release=False):
+                                 pre_release=False, hash_negotiation=True):
         """
         Upload an application package by providing a path to the file.
         It can also be used to update an existing one.
@@ -445,6 +517,8 @@ class SlicerPackageClient(GirderClient):
         :param coll_id: Collection ID
         :param desc: The description of the application package
         :param pre_release: Boolean to specify if the package is ready to be distributed
+        :param hash_negotiation: Send the SHA-512 checksum of the file first, so that a content
+            already stored on the server is attached without being uploaded again
         :return: The uploaded application package
         """
         def _displayProgress(*args, **kwargs):
@@ -476,30 +550,22 @@ class SlicerPackageClient(GirderClient):
             package = self.post('/app/%s/package' % app['_id'], parameters=parameters)
 
             # Upload the package
-            self.uploadFileToItem(
-                package['_id'],
-                filepath,
-                reference='',
-                mimeType='application/octet-stream',
-                progressCallback=_displayProgress)
+            if hash_negotiation:
+                self.replacePackageFile(
+                    'package', app['_id'], package['_id'], filepath,
+                    progressCallback=_displayProgress, hash_negotiation=True)
+            else:
+                self.uploadFileToItemResumable(
+                    package['_id'],
+                    filepath,
+                    mimeType='application/octet-stream',
+                    progressCallback=_displayProgress)
         else:
             package = package[0]
-            # Revision different or force upload
-            files = list(self.listFile(package['_id']))
-            if files:
-                oldFile = files[0]
-                filename = 'new_file'
-            else:
-                filename = None
-
-            # Upload the package
-            newFile = self.uploadFileToItem(
-                package['_id'],
-                filepath,
-                reference='',
-                filename=filename,
-                mimeType='application/octet-stream',
-                progressCallback=_displayProgress)
+            # Replace the package binary file
+            self.replacePackageFile(
+                'package', app['_id'], package['_id'], filepath,
+                progressCallback=_displayProgress, hash_negotiation=hash_negotiation)
 
             # Update the package into Girder hierarchy
             parameters = {
@@ -514,17 +580,8 @@ class SlicerPackageClient(GirderClient):
             }
             if build_date is not None:
                 parameters['build_date'] = build_date
-            package = self.post('/app/%s/package' % app['_id'], parameters=parameters)
-
-            files = list(self.listFile(package['_id']))
-            if len(files) == 2:
-                # Remove the oldFIle
-                self.delete('/file/%s' % oldFile['_id'])
-                # Change the name
-                self.put('/file/%s' % newFile['_id'], parameters={
-                    'name': os.path.basename(filepath),
-                })
-                return Constant.PACKAGE_NOW_UP_TO_DATE
+            self.post('/app/%s/package' % app['_id'], parameters=parameters)
+            return Constant.PACKAGE_NOW_UP_TO_DATE
         return package
 
     def downloadApplicationPackage(self, app_name, id_or_name, coll_id=None,
@@ -582,6 +639,43 @@ class SlicerPackageClient(GirderClient):
         })
         return pkg
 
+    def iterApplicationPackages(self, app_name, coll_id=None, name=None, pkg_os=None, arch=None,
+                                revision=None, version=None, release=None, limit=0,
+                                pageSize=Constant.DEFAULT_PAGE_SIZE):
+        """
+        Iterate over the application packages filtered by some optional parameters (os, arch, ...).
+
+        Unlike :meth:`listApplicationPackage`, the packages are requested ``pageSize`` at a time
+        and yielded as they arrive, so that only one page is held in memory no matter how many
+        packages are matching. Packages are yielded from the oldest to the newest so that
+        packages uploaded during the iteration do not shift the pages.
+
+        :param app_name: Name of the application
+        :param coll_id: Collection ID
+        :param name: Base name of the application package
+        :param pkg_os: The target operating system of the package
+        :param arch: The os chip architecture
+        :param revision: Revision of the application
+        :param version: Version of the application
+        :param release: Name or ID of the release
+        :param limit: Maximum number of packages yielded, `0` means no limit
+        :param pageSize: Number of packages requested at a time
+        :return: A generator of application packages filtered by optional parameters
+        """
+        app = self._getApp(app_name=app_name, coll_id=coll_id)
+        if release and not ObjectId.is_valid(release) and not self.listRelease(app_name, release):
+            raise SlicerPackageManagerError(
+                'The release "%s" does not exist.' % release)
+
+        return self._iterPages('/app/%s/package' % app['_id'], {
+            'os': pkg_os,
+            'arch': arch,
+            'baseName': name,
+            'revision': revision,
+            'version': version,
+            'release_id_or_name': release,
+        }, limit, pageSize)
+
     def deleteApplicationPackage(self, app_name, id_or_name, coll_id=None):
         """
         Delete an application package within an application.
@@ -597,8 +691,195 @@ class SlicerPackageClient(GirderClient):
             id_or_name=id_or_name,
             coll_id=coll_id)
 
+    def uploadFileToItemResumable(self, itemId, filepath, filename=None, mimeType=None,
+                                  progressCallback=None):
+        """
+        Upload a file to an item in chunks of ``MAX_CHUNK_SIZE`` bytes, resuming a previously
+        interrupted upload of the same file if any.
+
+        The upload ID and the offset of each started upload are recorded in the
+        ``uploadStateFile``. If an upload of ``filepath`` into ``itemId`` was interrupted and the
+        file did not change since, the transfer restarts from the offset reported by the server
+        using the Girder ``GET /file/offset`` endpoint instead of restarting from zero. If the
+        server already received the whole file, the upload is finalized without sending any
+        content.
+
+        :param itemId: ID of parent item for file.
+        :param filepath: Path to the file on disk.
+        :param filename: Name of the file in Girder. Default to the basename of ``filepath``.
+        :param mimeType: MIME type for the file. Will be guessed if not passed.
+        :param progressCallback: If passed, will be called after each chunk with a dict
+            containing the ``current`` and ``total`` number of bytes.
+        :return: The uploaded file.
+        """
+        def _createUpload(name, size, mimeType):
+            return self.post('file', parameters={
+                'parentType': 'item',
+                'parentId': itemId,
+                'name': name,
+                'size': size,
+                'mimeType': mimeType,
+            })
+
+        return self._uploadResumable(
+            '%s:%s' % (itemId, os.path.abspath(filepath)), filepath, _createUpload,
+            filename=filename, mimeType=mimeType, progressCallback=progressCallback)
+
+    def replacePackageFile(self, package_type, app_id, item_id, filepath, filename=None,
+                           mimeType='application/octet-stream', progressCallback=None, hash_negotiation=False):
+        """
+        Replace the binary file of an application or extension package, resuming a previously
+        interrupted upload of the same file if any (see :meth:`uploadFileToItemResumable`).
+
+        The server swaps the content and the name of the existing file once the upload completes,
+        the package item never contains more than one file.
+
+        :param package_type: Either ``package`` or ``extension``
+        :param app_id: ID of the application
+        :param item_id: ID of the application or extension package item
+        :param filepath: Path to the new file
+        :param filename: Name of the file in Girder. Default to the basename of ``filepath``.
+        :param mimeType: MIME type for the file.
+        :param progressCallback: If passed, will be called after each chunk.
+        :param hash_negotiation: If True, the SHA-512 checksum of the file is sent first and
+            the content is only uploaded if the server doesn't already store it.
+        :return: The uploaded file.
+        """
+        def _createUpload(name, size, mimeType):
+            parameters = {
+                'name': name,
+                'size': size,
+                'mimeType': mimeType,
+            }
+            if hash_negotiation:
+                parameters['sha512'] = self._sha512(filepath)
+            return self.post('/app/%s/%s/%s/file' % (app_id, package_type, item_id), parameters=parameters)
+
+        return self._uploadResumable(
+            '%s:%s:replace' % (item_id, os.path.abspath(filepath)), filepath, _createUpload,
+            filename=filename, mimeType=mimeType, progressCallback=progressCallback)
+
     # ---------------- UTILITIES ---------------- #
 
+    def _uploadResumable(self, key, filepath, createUpload, filename=None, mimeType=None,
+                         progressCallback=None):
+        """
+        Private method uploading a file in chunks, resuming the upload recorded under ``key``
+        in the ``uploadStateFile`` if any.
+
+        :param key: Identifier of the upload in the ``uploadStateFile``.
+        :param filepath: Path to the file on disk.
+        :param createUpload: Callable taking the ``name``, ``size`` and ``mimeType`` of the file
+            and returning the upload document created on the server, or the file document if
+            no content needs to be sent.
+        :param filename: Name of the file in Girder. Default to the basename of ``filepath``.
+        :param mimeType: MIME type for the file. Will be guessed if not passed.
+        :param progressCallback: If passed, will be called after each chunk.
+        :return: The uploaded file.
+        """
+        filepath = os.path.abspath(filepath)
+        filename = os.path.basename(filename or filepath)
+        size = os.path.getsize(filepath)
+        mtime = os.path.getmtime(filepath)
+
+        upload = None
+        offset = 0
+        entry = self._loadUploadState().get(key)
+        if entry and entry['size'] == size and entry['mtime'] == mtime:
+            try:
+                offset = self.get('file/offset', parameters={'uploadId': entry['uploadId']})['offset']
+                upload = {'_id': entry['uploadId'], 'name': filename}
+            except HttpError:
+                # The upload expired or was cancelled on the server, start a new one
+                offset = 0
+
+        if upload is None:
+            upload = createUpload(filename, size, mimeType or mimetypes.guess_type(filepath)[0])
+            if size == 0 or upload.get('_modelType') == 'file':
+                # Empty files, and files whose content is already stored, are finalized right away
+                return upload
+            self._updateUploadState(key, {'uploadId': upload['_id'], 'size': size, 'mtime': mtime, 'offset': 0})
+        elif offset == size:
+            # Every byte was received but the upload was not finalized, for instance because
+            # the server failed while finalizing it
+            obj = self.post('file/completion', parameters={'uploadId': upload['_id']})
+            self._updateUploadState(key, None)
+            return obj
+
+        obj = upload
+        with open(filepath, 'rb') as stream, \
+                self.progressReporterCls(label=filename, length=size) as reporter:
+            stream.seek(offset)
+            reporter.update(offset)
+            while offset < size:
+                chunk = stream.read(min(self.MAX_CHUNK_SIZE, size - offset))
+                if not chunk:
+                    break
+                obj = self.post(
+                    'file/chunk?offset=%d&uploadId=%s' % (offset, upload['_id']),
+                    data=chunk)
+                offset += len(chunk)
+                reporter.update(len(chunk))
+                if offset < size:
+                    self._updateUploadState(
+                        key, {'uploadId': upload['_id'], 'size': size, 'mtime': mtime, 'offset': offset})
+                if callable(progressCallback):
+                    progressCallback({'current': offset, 'total': size})
+
+        if offset != size:
+            msg = 'Expected upload of "%s" to be %d bytes, but only %d were read.' % (filepath, size, offset)
+            raise SlicerPackageManagerError(msg)
+
+        self._updateUploadState(key, None)
+        return obj
+
+    def _sha512(self, filepath):
+        """
+        Private method computing the SHA-512 checksum of a file.
+
+        :param filepath: Path to the file on disk.
+        :return: The hexadecimal checksum.
+        """
+        return _sha512(filepath, self.MAX_CHUNK_SIZE)
+
+    def _loadUploadState(self):
+        """
+        Private method to read the interrupted uploads recorded in ``uploadStateFile``.
+
+        :return: A dictionary mapping ``<itemId>:<filepath>`` to the upload ID, size,
+            modification time and offset of the upload.
+        """
+        return _loadUploadState(self.uploadStateFile)
+
+    def _updateUploadState(self, key, entry):
+        """
+        Private method to record (or remove if ``entry`` is None) an upload in ``uploadStateFile``.
+        """
+        _updateUploadState(self.uploadStateFile, key, entry)
+
+    def _iterPages(self, path, parameters, limit, pageSize):
+        """
+        Private generator requesting the list endpoint ``path`` one page at a time.
+
+        :param path: Path of the list endpoint
+        :param parameters: Filters of the list endpoint
+        :param limit: Maximum number of documents yielded, `0` means no limit
+        :param pageSize: Number of documents requested at a time
+        :return: A generator of documents
+        """
+        if pageSize <= 0:
+            msg = 'The page size must be a positive number.'
+            raise SlicerPackageManagerError(msg)
+        offset = 0
+        while not limit or offset < limit:
+            count = min(pageSize, limit - offset) if limit else pageSize
+            page = self.get(path, parameters=dict(
+                parameters, limit=count, offset=offset, sort='_id', sortdir=1))
+            yield from page
+            offset += len(page)
+            if len(page) < count:
+                return
+
     def _getApp(self, app_name, coll_id=None):
         """
         Private method to get a single application by Name.
@@ -654,3 +935,59 @@ class SlicerPackageClient(GirderClient):
         pkg = pkg[0]
         self.delete('/app/%s/%s/%s' % (app['_id'], package_type, pkg['_id']))
         return pkg
+
+
+#: Serializes the updates of the upload state file by the threads of the process.
+_uploadStateLock = threading.Lock()
+
+
+def _sha512(filepath, chunkSize):
+    """
+    Compute the SHA-512 checksum of a file, reading ``chunkSize`` bytes at a time.
+
+    :param filepath: Path to the file on disk.
+    :param chunkSize: Number of bytes read at a time.
+    :return: The hexadecimal checksum.
+    """
+    checksum = hashlib.sha512()
+    with open(filepath, 'rb') as stream:
+        for chunk in iter(lambda: stream.read(chunkSize), b''):
+            checksum.update(chunk)
+    return checksum.hexdigest()
+
+
+def _loadUploadState(path):
+    """
+    Read the interrupted uploads recorded in the upload state file ``path``.
+
+    :param path: Path of the upload state file.
+    :return: A dictionary mapping the key of each upload to its upload ID, size,
+        modification time and offset.
+    """
+    try:
+        with open(path) as content:
+            return json.load(content)
+    except (OSError, ValueError):
+        return {}
+
+
+def _updateUploadState(path, key, entry):
+    """
+    Record (or remove if ``entry`` is None) an upload in the upload state file ``path``.
+
+    The file is replaced atomically so that an interruption never leaves it truncated, and the
+    updates of concurrent threads are serialized so that none of them is lost.
+    """
+    with _uploadStateLock:
+        state = _loadUploadState(path)
+        if entry is None:
+            if key not in state:
+                return
+            del state[key]
+        else:
+            state[key] = entry
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmp, 'w') as content:
+            json.dump(state, content)
+        os.replace(tmp, path)
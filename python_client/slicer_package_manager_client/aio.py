@@ -0,0 +1,764 @@
+"""
+Asynchronous variant of :class:`slicer_package_manager_client.SlicerPackageClient`.
+
+It requires the ``aiohttp`` package which is installed with the ``async`` extra::
+
+    pip install slicer-package-manager-client[async]
+"""
+import asyncio
+import base64
+import contextlib
+import mimetypes
+import os
+
+import aiohttp
+from girder_client import GirderClient, HttpError
+
+from . import Constant, SlicerPackageManagerError, _loadUploadState, _sha512, _updateUploadState
+from ._vendor.bson.objectid import ObjectId
+from .snapshot import SnapshotWriter
+
+
+class AsyncSlicerPackageClient:
+    """
+    The AsyncSlicerPackageClient exposes the same methods as
+    :class:`slicer_package_manager_client.SlicerPackageClient` as coroutines, allowing to manage
+    many applications concurrently from a single event loop::
+
+        async with AsyncSlicerPackageClient(apiUrl='https://slicer-packages.kitware.com/api/v1') as client:
+            await client.authenticate(apiKey=key)
+            await asyncio.gather(*(client.listApp(name=name) for name in names))
+
+    All the requests share a pool of at most ``maxConnections`` connections and at most
+    ``maxConcurrency`` requests are in flight at the same time. Uploaded files are sent in chunks
+    of ``chunkSize`` bytes and downloaded files are streamed to disk, neither is loaded whole
+    into memory. The disk is read and written in the default executor so that the event loop
+    is never blocked by the files.
+    """
+
+    DOWNLOAD_CHUNK_SIZE = 65536
+
+    def __init__(self, host=None, port=None, apiRoot=None, scheme=None, apiUrl=None,
+                 maxConnections=10, maxConcurrency=None, chunkSize=None, uploadStateFile=None):
+        """
+        :param maxConnections: Maximum number of simultaneous connections to the server.
+        :param maxConcurrency: Maximum number of requests in flight. Default to ``maxConnections``.
+        :param chunkSize: Size in bytes of each uploaded chunk. Default to ``GirderClient.MAX_CHUNK_SIZE``.
+        :param uploadStateFile: Path of the JSON file used to record the interrupted uploads
+            (see :const:`Constant.UPLOAD_STATE_FILE`).
+        """
+        if apiUrl is None:
+            if not apiRoot:
+                apiRoot = '/api/v1'
+            if not scheme:
+                scheme = 'https' if port == 443 else 'http'
+            if not host:
+                host = 'localhost'
+            if not port:
+                port = 443 if scheme == 'https' else 80
+            apiUrl = '%s://%s:%d%s' % (scheme, host, port, apiRoot)
+        self.urlBase = apiUrl.rstrip('/') + '/'
+
+        if maxConnections <= 0 or (maxConcurrency is not None and maxConcurrency <= 0):
+            msg = 'The number of connections and of concurrent requests must be positive.'
+            raise SlicerPackageManagerError(msg)
+        if chunkSize is not None and chunkSize <= 0:
+            msg = 'The chunk size must be a positive number of bytes.'
+            raise SlicerPackageManagerError(msg)
+        self.maxConnections = maxConnections
+        self.maxConcurrency = maxConcurrency or maxConnections
+        self.chunkSize = chunkSize or GirderClient.MAX_CHUNK_SIZE
+        self.uploadStateFile = uploadStateFile or Constant.UPLOAD_STATE_FILE
+
+        self.token = ''
+        self._session = None
+        self._semaphore = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def close(self):
+        """
+        Close the connections of the pool.
+        """
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+            self._semaphore = None
+
+    def setToken(self, token):
+        """
+        Set the Girder token used to authenticate the requests.
+        """
+        self.token = token
+
+    async def authenticate(self, username=None, password=None, apiKey=None):
+        """
+        Authenticate using either a username and password or an API key.
+
+        :param username: Name of the user
+        :param password: Password of the user
+        :param apiKey: API key of the user
+        """
+        if apiKey:
+            resp = await self.post('api_key/token', parameters={'key': apiKey})
+        elif username is not None and password is not None:
+            credentials = base64.b64encode(('%s:%s' % (username, password)).encode('utf8'))
+            resp = await self.get('user/authentication', headers={
+                'Authorization': 'Basic %s' % credentials.decode('ascii'),
+            })
+        else:
+            msg = 'A username and a password or an API key are required to authenticate.'
+            raise SlicerPackageManagerError(msg)
+        self.setToken(resp['authToken']['token'])
+        return resp
+
+    # ---------------- REQUESTS ---------------- #
+
+    async def get(self, path, parameters=None, headers=None):
+        return await self.sendRestRequest('GET', path, parameters, headers=headers)
+
+    async def post(self, path, parameters=None, data=None, headers=None):
+        return await self.sendRestRequest('POST', path, parameters, data=data, headers=headers)
+
+    async def put(self, path, parameters=None, data=None, headers=None):
+        return await self.sendRestRequest('PUT', path, parameters, data=data, headers=headers)
+
+    async def delete(self, path, parameters=None, headers=None):
+        return await self.sendRestRequest('DELETE', path, parameters, headers=headers)
+
+    async def sendRestRequest(self, method, path, parameters=None, data=None, headers=None):
+        """
+        Send a request to the Girder REST API and return the decoded JSON response.
+
+        :raises girder_client.HttpError: If the server answers with an error status.
+        """
+        async with self._request(method, path, parameters, data=data, headers=headers) as resp:
+            body = await resp.read()
+            if not body:
+                return None
+            return await resp.json(content_type=None)
+
+    @contextlib.asynccontextmanager
+    async def _request(self, method, path, parameters=None, data=None, headers=None):
+        """
+        Private async context manager sending a request once a slot of the semaphore is
+        acquired and yielding the unread response. The slot is released once the response is
+        consumed.
+
+        :raises girder_client.HttpError: If the server answers with an error status.
+        """
+        if self._session is None:
+            # Created lazily so that the pool and the semaphore are bound to the running loop
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.maxConnections))
+            self._semaphore = asyncio.Semaphore(self.maxConcurrency)
+        session, semaphore = self._session, self._semaphore
+
+        url = path if path.startswith(self.urlBase) else self.urlBase + path.lstrip('/')
+        # Mimic ``requests``: drop the unset parameters and render the other ones as strings
+        params = {
+            key: str(value)
+            for key, value in (parameters or {}).items()
+            if value is not None
+        }
+        allHeaders = {'Girder-Token': self.token} if self.token else {}
+        allHeaders.update(headers or {})
+
+        async with semaphore, session.request(
+                method, url, params=params, data=data, headers=allHeaders) as resp:
+            if resp.status >= 400:
+                raise HttpError(status=resp.status, text=await resp.text(), url=str(resp.url), method=method)
+            yield resp
+
+    # ---------------- APPLICATIONS ---------------- #
+
+    async def createApp(self, name, desc=None, coll_id=None, coll_name=None, coll_desc=None,
+                        public=None):
+        """
+        Create a new application, see :meth:`SlicerPackageClient.createApp`.
+        """
+        apps = await self.listApp(name=name)
+        if apps:
+            raise SlicerPackageManagerError('The Application "%s" already exist.' % name)
+        return await self.post('/app', parameters={
+            'name': name,
+            'app_description': desc,
+            'collection_id': coll_id,
+            'collection_name': coll_name,
+            'collection_description': coll_desc,
+            'public': public,
+        })
+
+    async def listApp(self, name=None, coll_id=None):
+        """
+        List the applications, see :meth:`SlicerPackageClient.listApp`.
+        """
+        return await self.get('/app', parameters={
+            'collection_id': coll_id,
+            'name': name,
+        })
+
+    async def deleteApp(self, name, coll_id=None):
+        """
+        Delete an application, see :meth:`SlicerPackageClient.deleteApp`.
+        """
+        app = await self._getApp(app_name=name, coll_id=coll_id)
+        await self.delete('/app/%s' % app['_id'])
+        return app
+
+    # ---------------- RELEASES ---------------- #
+
+    async def createRelease(self, app_name, name, revision, coll_id=None, desc=None):
+        """
+        Create a new release, see :meth:`SlicerPackageClient.createRelease`.
+        """
+        app = await self._getApp(app_name=app_name, coll_id=coll_id)
+        releases = await self.listRelease(app_name=app_name, name=name)
+        if releases:
+            raise SlicerPackageManagerError('The release "%s" already exist.' % name)
+        return await self.post('/app/%s/release' % app['_id'], parameters={
+            'name': name,
+            'app_revision': revision,
+            'description': desc,
+        })
+
+    async def listRelease(self, app_name, name=None, coll_id=None):
+        """
+        List the releases of an application, see :meth:`SlicerPackageClient.listRelease`.
+        """
+        app = await self._getApp(app_name=app_name, coll_id=coll_id)
+        if name:
+            return await self.get(
+                '/app/%s/release' % app['_id'],
+                parameters={'release_id_or_name': name})
+        return await self.get('/app/%s/release' % app['_id'])
+
+    async def deleteRelease(self, app_name, name, coll_id=None):
+        """
+        Delete a release, see :meth:`SlicerPackageClient.deleteRelease`.
+        """
+        app = await self._getApp(app_name=app_name, coll_id=coll_id)
+        release = await self.listRelease(app_name, name)
+        if not release:
+            raise SlicerPackageManagerError('The release "%s" doesn\'t exist.' % name)
+        await self.delete('/app/%s/release/%s' % (app['_id'], name))
+        return release
+
+    async def listDraftRelease(self, app_name, coll_id=None, revision=None, limit=Constant.DEFAULT_LIMIT,
+                               offset=0):
+        """
+        List the draft releases, see :meth:`SlicerPackageClient.listDraftRelease`.
+        """
+        app = await self._getApp(app_name=app_name, coll_id=coll_id)
+        return await self.get(
+            '/app/%s/draft' % app['_id'],
+            parameters={'revision': revision, 'limit': limit, 'offset': offset},
+        )
+
+    async def deleteDraftRelease(self, app_name, revision, coll_id=None):
+        """
+        Delete a draft release, see :meth:`SlicerPackageClient.deleteDraftRelease`.
+        """
+        app = await self._getApp(app_name=app_name, coll_id=coll_id)
+        release = await self.listDraftRelease(app_name, revision=revision)
+        if not release:
+            raise SlicerPackageManagerError(
+                'The release with the revision "%s" doesn\'t exist.' % revision)
+        await self.delete('/app/%s/release/%s' % (app['_id'], release[0]['name']))
+        return release[0]
+
+    # ---------------- EXTENSIONS ---------------- #
+
+    async def uploadExtension(self, filepath, app_name, ext_os, arch, name, repo_type, repo_url,
+                              revision, app_revision, desc='', icon_url='',
+                              category=None, tier=None, homepage='', screenshots=None, contributors=None,
+                              dependency=None, recommends=None, dicom_support_rule=None, keywords=None,
+                              coll_id=None, force=False, hash_negotiation=True):
+        """
+        Upload or update an extension, see :meth:`SlicerPackageClient.uploadExtension`.
+        """
+        app = await self._getApp(app_name=app_name, coll_id=coll_id)
+        extensions = await self.listExtension(
+            app_name,
+            name=name,
+            ext_os=ext_os,
+            arch=arch,
+            app_revision=app_revision)
+        parameters = {
+            'os': ext_os,
+            'arch': arch,
+            'baseName': name,
+            'repository_type': repo_type,
+            'repository_url': repo_url,
+            'revision': revision,
+            'app_revision': app_revision,
+            'description': desc,
+            'icon_url': icon_url,
+            'category': category,
+            'tier': tier,
+            'homepage': homepage,
+            'screenshots': screenshots,
+            'contributors': contributors,
+            'dependency': dependency,
+            'recommends': recommends,
+            'dicom_support_rule': dicom_support_rule,
+            'keywords': keywords,
+        }
+        if not extensions:
+            extension = await self.post('/app/%s/extension' % app['_id'], parameters=parameters)
+            if hash_negotiation:
+                await self._replacePackageFile(
+                    'extension', app['_id'], extension['_id'], filepath, hash_negotiation=True)
+            else:
+                await self.uploadFileToItem(extension['_id'], filepath, mimeType='application/octet-stream')
+            return extension
+
+        extension = extensions[0]
+        if revision != extension['meta']['revision'] or force:
+            await self._replacePackageFile(
+                'extension', app['_id'], extension['_id'], filepath, hash_negotiation=hash_negotiation)
+            await self.post('/app/%s/extension' % app['_id'], parameters=parameters)
+            return Constant.EXTENSION_NOW_UP_TO_DATE
+        return Constant.EXTENSION_AREADY_UP_TO_DATE
+
+    async def downloadExtension(self, app_name, id_or_name, coll_id=None,
+                                dir_path=Constant.CURRENT_FOLDER):
+        """
+        Download an extension, see :meth:`SlicerPackageClient.downloadExtension`.
+        """
+        return await self._downloadPackage('extension', app_name=app_name, id_or_name=id_or_name,
+                                           dir_path=dir_path, coll_id=coll_id)
+
+    async def listExtension(self, app_name, coll_id=None, name=None, ext_os=None, arch=None,
+                            app_revision=None, release=Constant.DRAFT_RELEASE_NAME, query=None,
+                            limit=Constant.DEFAULT_LIMIT, all=False):
+        """
+        List the extensions of an application, see :meth:`SlicerPackageClient.listExtension`.
+        """
+        app = await self._getApp(app_name=app_name, coll_id=coll_id)
+
+        if all:
+            release_id = None
+            limit = 0
+        else:
+            release_folder = await self.listRelease(app_name, release)
+            if release_folder:
+                release_id = release_folder['_id']
+            else:
+                raise SlicerPackageManagerError(
+                    'The release "%s" doesn\'t exist.' % release)
+
+        return await self.get('/app/%s/extension' % app['_id'], parameters={
+            'os': ext_os,
+            'arch': arch,
+            'baseName': name,
+            'app_revision': app_revision,
+            'release_id': release_id,
+            'q': query,
+            'limit': limit,
+            'sort': 'created',
+            'sortDir': -1,
+        })
+
+    async def iterExtensions(self, app_name, coll_id=None, name=None, ext_os=None, arch=None,
+                             app_revision=None, release=Constant.DRAFT_RELEASE_NAME, query=None,
+                             limit=0, all=False, pageSize=Constant.DEFAULT_PAGE_SIZE):
+        """
+        Iterate over the extensions of an application one page at a time, see
+        :meth:`SlicerPackageClient.iterExtensions`::
+
+            async for extension in client.iterExtensions(app_name):
+                print(extension['name'])
+        """
+        app = await self._getApp(app_name=app_name, coll_id=coll_id)
+
+        release_id = None
+        if not all:
+            release_folder = await self.listRelease(app_name, release)
+            if not release_folder:
+                raise SlicerPackageManagerError(
+                    'The release "%s" doesn\'t exist.' % release)
+            release_id = release_folder['_id']
+
+        async for extension in self._iterPages('/app/%s/extension' % app['_id'], {
+            'os': ext_os,
+            'arch': arch,
+            'baseName': name,
+            'app_revision': app_revision,
+            'release_id': release_id,
+            'q': query,
+        }, limit, pageSize):
+            yield extension
+
+    async def downloadExtensionSnapshot(self, app_name, app_revision=None, coll_id=None,
+                                        dir_path=Constant.CURRENT_FOLDER, compression='gzip'):
+        """
+        Download the extension snapshot of an application, see
+        :meth:`SlicerPackageClient.downloadExtensionSnapshot`.
+        """
+        app = await self._getApp(app_name=app_name, coll_id=coll_id)
+        path = os.path.join(dir_path, '%s_%s_extensions.snapshot' % (app['name'], app_revision or 'all'))
+        async with self._request(
+                'GET', '/app/%s/extension/snapshot' % app['_id'],
+                parameters={'app_revision': app_revision, 'compression': compression}) as resp:
+            await self._writeStream(resp, path, SnapshotWriter)
+        return path
+
+    async def deleteExtension(self, app_name, id_or_name, coll_id=None):
+        """
+        Delete an extension, see :meth:`SlicerPackageClient.deleteExtension`.
+        """
+        return await self._deletePackage('extension', app_name, id_or_name, coll_id)
+
+    # ---------------- APPLICATION PACKAGES ---------------- #
+
+    async def uploadApplicationPackage(self, filepath, app_name, pkg_os, arch, name, repo_type,
+                                       repo_url, revision, version, build_date=None, coll_id=None, desc='',
+                                       pre_release=False, hash_negotiation=True):
+        """
+        Upload or update an application package, see :meth:`SlicerPackageClient.uploadApplicationPackage`.
+        """
+        app = await self._getApp(app_name=app_name, coll_id=coll_id)
+        package = await self.listApplicationPackage(
+            app_name,
+            name=name,
+            pkg_os=pkg_os,
+            arch=arch,
+            revision=revision)
+        parameters = {
+            'os': pkg_os,
+            'arch': arch,
+            'baseName': name,
+            'repository_type': repo_type,
+            'repository_url': repo_url,
+            'revision': revision,
+            'version': version,
+            'description': desc,
+        }
+        if build_date is not None:
+            parameters['build_date'] = build_date
+        if not package:
+            parameters['pre_release'] = pre_release
+            package = await self.post('/app/%s/package' % app['_id'], parameters=parameters)
+            if hash_negotiation:
+                await self._replacePackageFile(
+                    'package', app['_id'], package['_id'], filepath, hash_negotiation=True)
+            else:
+                await self.uploadFileToItemResumable(
+                    package['_id'], filepath, mimeType='application/octet-stream')
+            return package
+
+        await self._replacePackageFile(
+            'package', app['_id'], package[0]['_id'], filepath, hash_negotiation=hash_negotiation)
+        await self.post('/app/%s/package' % app['_id'], parameters=parameters)
+        return Constant.PACKAGE_NOW_UP_TO_DATE
+
+    async def downloadApplicationPackage(self, app_name, id_or_name, coll_id=None,
+                                         dir_path=Constant.CURRENT_FOLDER):
+        """
+        Download an application package, see :meth:`SlicerPackageClient.downloadApplicationPackage`.
+        """
+        return await self._downloadPackage('package', app_name=app_name, id_or_name=id_or_name,
+                                           dir_path=dir_path, coll_id=coll_id)
+
+    async def listApplicationPackage(self, app_name, coll_id=None, name=None, pkg_os=None, arch=None,
+                                     revision=None, version=None, release=None, limit=Constant.DEFAULT_LIMIT):
+        """
+        List the application packages, see :meth:`SlicerPackageClient.listApplicationPackage`.
+        """
+        app = await self._getApp(app_name=app_name, coll_id=coll_id)
+        if release and not ObjectId.is_valid(release) and not await self.listRelease(app_name, release):
+            raise SlicerPackageManagerError(
+                'The release "%s" does not exist.' % release)
+
+        return await self.get('/app/%s/package' % app['_id'], parameters={
+            'os': pkg_os,
+            'arch': arch,
+            'baseName': name,
+            'revision': revision,
+            'version': version,
+            'release_id_or_name': release,
+            'limit': limit,
+            'sort': 'created',
+            'sortDir': -1,
+        })
+
+    async def iterApplicationPackages(self, app_name, coll_id=None, name=None, pkg_os=None, arch=None,
+                                      revision=None, version=None, release=None, limit=0,
+                                      pageSize=Constant.DEFAULT_PAGE_SIZE):
+        """
+        Iterate over the application packages one page at a time, see
+        :meth:`SlicerPackageClient.iterApplicationPackages`.
+        """
+        app = await self._getApp(app_name=app_name, coll_id=coll_id)
+        if release and not ObjectId.is_valid(release) and not await self.listRelease(app_name, release):
+            raise SlicerPackageManagerError(
+                'The release "%s" does not exist.' % release)
+
+        async for package in self._iterPages('/app/%s/package' % app['_id'], {
+            'os': pkg_os,
+            'arch': arch,
+            'baseName': name,
+            'revision': revision,
+            'version': version,
+            'release_id_or_name': release,
+        }, limit, pageSize):
+            yield package
+
+    async def deleteApplicationPackage(self, app_name, id_or_name, coll_id=None):
+        """
+        Delete an application package, see :meth:`SlicerPackageClient.deleteApplicationPackage`.
+        """
+        return await self._deletePackage('package', app_name, id_or_name, coll_id)
+
+    # ---------------- FILES ---------------- #
+
+    async def uploadFileToItem(self, itemId, filepath, filename=None, mimeType=None,
+                               progressCallback=None):
+        """
+        Upload a file to an item in chunks of ``chunkSize`` bytes.
+
+        :param itemId: ID of parent item for file.
+        :param filepath: Path to the file on disk.
+        :param filename: Name of the file in Girder. Default to the basename of ``filepath``.
+        :param mimeType: MIME type for the file. Will be guessed if not passed.
+        :param progressCallback: If passed, will be called after each chunk with a dict
+            containing the ``current`` and ``total`` number of bytes.
+        :return: The uploaded file.
+        """
+        async def _createUpload(name, size, mimeType):
+            return await self.post('file', parameters={
+                'parentType': 'item',
+                'parentId': itemId,
+                'name': name,
+                'size': size,
+                'mimeType': mimeType,
+            })
+
+        return await self._upload(
+            filepath, _createUpload, filename=filename, mimeType=mimeType,
+            progressCallback=progressCallback)
+
+    async def uploadFileToItemResumable(self, itemId, filepath, filename=None, mimeType=None,
+                                        progressCallback=None):
+        """
+        Upload a file to an item in chunks of ``chunkSize`` bytes, resuming a previously
+        interrupted upload of the same file if any, see
+        :meth:`SlicerPackageClient.uploadFileToItemResumable`.
+
+        The interrupted uploads are recorded in the same ``uploadStateFile`` as the synchronous
+        client, an upload interrupted by one client can be resumed by the other.
+        """
+        async def _createUpload(name, size, mimeType):
+            return await self.post('file', parameters={
+                'parentType': 'item',
+                'parentId': itemId,
+                'name': name,
+                'size': size,
+                'mimeType': mimeType,
+            })
+
+        return await self._upload(
+            filepath, _createUpload, filename=filename, mimeType=mimeType,
+            progressCallback=progressCallback, key='%s:%s' % (itemId, os.path.abspath(filepath)))
+
+    async def downloadFile(self, fileId, path):
+        """
+        Download a file, streaming its content to ``path``.
+
+        :param fileId: ID of the file.
+        :param path: Path where the file is written.
+        """
+        async with self._request('GET', 'file/%s/download' % fileId) as resp:
+            await self._writeStream(resp, path)
+
+    # ---------------- UTILITIES ---------------- #
+
+    async def _upload(self, filepath, createUpload, filename=None, mimeType=None, progressCallback=None,
+                      key=None):
+        """
+        Private method uploading a file in chunks of ``chunkSize`` bytes.
+
+        Only one chunk is held in memory at a time and the file is read in the default executor
+        so that the event loop is not blocked by the disk. If ``key`` is given, the upload is
+        recorded under ``key`` in the ``uploadStateFile`` and resumed from the offset reported
+        by the server if it was interrupted, as done by
+        :meth:`SlicerPackageClient.uploadFileToItemResumable`.
+        """
+        loop = asyncio.get_running_loop()
+        filepath = os.path.abspath(filepath)
+        filename = os.path.basename(filename or filepath)
+        size = os.path.getsize(filepath)
+        mtime = os.path.getmtime(filepath)
+
+        upload = None
+        offset = 0
+        entry = None
+        if key is not None:
+            entry = (await loop.run_in_executor(None, _loadUploadState, self.uploadStateFile)).get(key)
+        if entry and entry['size'] == size and entry['mtime'] == mtime:
+            try:
+                offset = (await self.get('file/offset', parameters={'uploadId': entry['uploadId']}))['offset']
+                upload = {'_id': entry['uploadId'], 'name': filename}
+            except HttpError:
+                # The upload expired or was cancelled on the server, start a new one
+                offset = 0
+
+        if upload is None:
+            upload = await createUpload(filename, size, mimeType or mimetypes.guess_type(filepath)[0])
+            if size == 0 or upload.get('_modelType') == 'file':
+                # Empty files, and files whose content is already stored, are finalized right away
+                return upload
+            await self._updateUploadState(
+                key, {'uploadId': upload['_id'], 'size': size, 'mtime': mtime, 'offset': 0})
+        elif offset == size:
+            # Every byte was received but the upload was not finalized
+            obj = await self.post('file/completion', parameters={'uploadId': upload['_id']})
+            await self._updateUploadState(key, None)
+            return obj
+
+        obj = upload
+        with open(filepath, 'rb') as stream:
+            await loop.run_in_executor(None, stream.seek, offset)
+            while offset < size:
+                chunk = await loop.run_in_executor(None, stream.read, min(self.chunkSize, size - offset))
+                if not chunk:
+                    break
+                obj = await self.post(
+                    'file/chunk', parameters={'offset': offset, 'uploadId': upload['_id']}, data=chunk)
+                offset += len(chunk)
+                if offset < size:
+                    await self._updateUploadState(
+                        key, {'uploadId': upload['_id'], 'size': size, 'mtime': mtime, 'offset': offset})
+                if callable(progressCallback):
+                    progressCallback({'current': offset, 'total': size})
+
+        if offset != size:
+            msg = 'Expected upload of "%s" to be %d bytes, but only %d were read.' % (filepath, size, offset)
+            raise SlicerPackageManagerError(msg)
+
+        await self._updateUploadState(key, None)
+        return obj
+
+    async def _updateUploadState(self, key, entry):
+        """
+        Private method recording (or removing if ``entry`` is None) the upload ``key`` in the
+        ``uploadStateFile``, nothing is recorded if ``key`` is None.
+        """
+        if key is not None:
+            await asyncio.get_running_loop().run_in_executor(
+                None, _updateUploadState, self.uploadStateFile, key, entry)
+
+    async def _writeStream(self, resp, path, writerCls=None):
+        """
+        Private method streaming the content of a response to ``path``, the file being opened
+        and written in the default executor.
+
+        :param resp: The unread response.
+        :param path: Path where the content is written.
+        :param writerCls: If passed, the content is written through ``writerCls(stream)``, which
+            must provide a ``write`` and a ``flush`` method.
+        """
+        loop = asyncio.get_running_loop()
+        stream = await loop.run_in_executor(None, open, path, 'wb')
+        try:
+            writer = writerCls(stream) if writerCls is not None else stream
+            async for chunk in resp.content.iter_chunked(self.DOWNLOAD_CHUNK_SIZE):
+                await loop.run_in_executor(None, writer.write, chunk)
+            await loop.run_in_executor(None, writer.flush)
+        finally:
+            await loop.run_in_executor(None, stream.close)
+
+    async def _replacePackageFile(self, package_type, app_id, item_id, filepath, progressCallback=None,
+                                  hash_negotiation=False):
+        """
+        Private method replacing the binary file of an application or extension package, see
+        :meth:`SlicerPackageClient.replacePackageFile`.
+        """
+        async def _createUpload(name, size, mimeType):
+            parameters = {
+                'name': name,
+                'size': size,
+                'mimeType': mimeType,
+            }
+            if hash_negotiation:
+                parameters['sha512'] = await asyncio.get_running_loop().run_in_executor(
+                    None, _sha512, filepath, self.chunkSize)
+            return await self.post('/app/%s/%s/%s/file' % (app_id, package_type, item_id), parameters=parameters)
+
+        return await self._upload(
+            filepath, _createUpload, mimeType='application/octet-stream', progressCallback=progressCallback,
+            key='%s:%s:replace' % (item_id, os.path.abspath(filepath)))
+
+    async def _iterPages(self, path, parameters, limit, pageSize):
+        """
+        Private async generator requesting the list endpoint ``path`` one page at a time, see
+        :meth:`SlicerPackageClient._iterPages`.
+        """
+        if pageSize <= 0:
+            msg = 'The page size must be a positive number.'
+            raise SlicerPackageManagerError(msg)
+        offset = 0
+        while not limit or offset < limit:
+            count = min(pageSize, limit - offset) if limit else pageSize
+            page = await self.get(path, parameters=dict(
+                parameters, limit=count, offset=offset, sort='_id', sortdir=1))
+            for document in page:
+                yield document
+            offset += len(page)
+            if len(page) < count:
+                return
+
+    async def _getApp(self, app_name, coll_id=None):
+        """
+        Private method to get a single application by Name.
+        """
+        apps = await self.listApp(name=app_name, coll_id=coll_id)
+        if not apps:
+            raise SlicerPackageManagerError(
+                'The Application "%s" doesn\'t exist.' % app_name)
+        return apps[0]
+
+    async def _downloadPackage(self, package_type, app_name, id_or_name, dir_path, coll_id):
+        app = await self._getApp(app_name=app_name, coll_id=coll_id)
+
+        if ObjectId.is_valid(id_or_name):
+            pkg = await self.get('/resource/%s' % id_or_name, parameters={'type': 'item'})
+        else:
+            pkg = await self.get(
+                '/app/%s/%s' % (app['_id'], package_type),
+                parameters={'%s_name' % package_type: id_or_name})
+            if pkg:
+                pkg = pkg[0]
+        if not pkg:
+            raise SlicerPackageManagerError(
+                'The %s "%s" doesn\'t exist.' % (package_type, id_or_name))
+        files = await self.get('/item/%s/files' % pkg['_id'])
+        if not files:
+            raise SlicerPackageManagerError(
+                'The %s "%s" doesn\'t contain any file.' % (package_type, id_or_name))
+        file = files[0]
+        await self.downloadFile(
+            file['_id'],
+            os.path.join(dir_path, '%s.%s' % (pkg['name'], file['name'].split('.')[1])))
+        return pkg
+
+    async def _deletePackage(self, package_type, app_name, id_or_name, coll_id):
+        app = await self._getApp(app_name=app_name, coll_id=coll_id)
+
+        pkg = await self.get(
+            '/app/%s/%s' % (app['_id'], package_type),
+            parameters={
+                ('%s_id' if ObjectId.is_valid(id_or_name) else '%s_name') % package_type: id_or_name,
+            })
+        if not pkg:
+            raise SlicerPackageManagerError(
+                'The %s "%s" doesn\'t exist.' % (package_type, id_or_name))
+        pkg = pkg[0]
+        await self.delete('/app/%s/%s/%s' % (app['_id'], package_type, pkg['_id']))
+        return pkg
+
@@ -4,6 +4,7 @@ from tabulate import tabulate
 
 from girder_client import GirderClient
 from . import SlicerPackageManagerError, SlicerPackageClient, __version__, Constant
+from .mirror import DEFAULT_CONCURRENCY, Mirror
 
 w = Constant.WIDTH
 
@@ -15,6 +16,17 @@ def _getOs():
         }.get(platform.system(), None)
 
 
+def _printRows(headers, rows):
+    """
+    Print each row as soon as it is available, unlike ``tabulate`` which needs all the rows
+    to compute the width of the columns.
+    """
+    print(''.join(header.ljust(w) for header in headers).rstrip())
+    print(''.join(('-' * len(header)).ljust(w) for header in headers).rstrip())
+    for row in rows:
+        print(''.join(str(cell).ljust(w) for cell in row).rstrip(), flush=True)
+
+
 class SlicerPackageCli(SlicerPackageClient):
     """
     A command line Python client for interacting with a Girder instance's
@@ -22,7 +34,7 @@ class SlicerPackageCli(SlicerPackageClient):
     """
 
     def __init__(self, username, password, host=None, port=None, apiRoot=None,
-                 scheme=None, apiUrl=None, apiKey=None):
+                 scheme=None, apiUrl=None, apiKey=None, chunkSize=None):
         """
         Initialization function to create a SlicerPackageCli instance, will attempt
         to authenticate with the designated Girder instance. Aside from username, password,
@@ -32,6 +44,7 @@ class SlicerPackageCli(SlicerPackageClient):
         :param username: username to authenticate to Girder instance.
         :param password: password to authenticate to Girder instance, leave
             this blank to be prompted.
+        :param chunkSize: Size in bytes of each uploaded chunk.
         """
         def _progressBar(*args, **kwargs):
             bar = click.progressbar(*args, **kwargs)
@@ -41,7 +54,7 @@ class SlicerPackageCli(SlicerPackageClient):
             return bar
 
         super().__init__(host=host, port=port, apiRoot=apiRoot, scheme=scheme, apiUrl=apiUrl,
-                         progressReporterCls=_progressBar)
+                         progressReporterCls=_progressBar, chunkSize=chunkSize)
         interactive = password is None
         if apiKey:
             self.authenticate(apiKey=apiKey)
@@ -124,11 +137,15 @@ _CONTEXT_SETTINGS = {'help_option_names': ['-h', '--help']}
               help='Specify path to SSL certificate',
               show_default=True,
               cls=_AdvancedOption)
+@click.option('--chunk-size', default=None, type=click.IntRange(min=1),
+              help='Size in bytes of each uploaded chunk '
+                   '[default: %s]' % GirderClient.MAX_CHUNK_SIZE,
+              cls=_AdvancedOption)
 @click.version_option(version=__version__, prog_name='Girder command line interface')
 @click.pass_context
 def main(ctx, username, password,
          api_key, api_url, scheme, host, port, api_root,
-         no_ssl_verify, certificate):
+         no_ssl_verify, certificate, chunk_size):
     """
     The recommended way to use credentials is to first generate an API key
     and then specify the ``api-key`` argument or set the ``GIRDER_API_KEY``
@@ -152,7 +169,7 @@ def main(ctx, username, password,
 
     ctx.obj = SlicerPackageCli(
         username, password, host=host, port=port, apiRoot=api_root,
-        scheme=scheme, apiUrl=api_url, apiKey=api_key)
+        scheme=scheme, apiUrl=api_url, apiKey=api_key, chunkSize=chunk_size)
 
     if certificate and ctx.obj.scheme != 'https':
         msg = 'A URI scheme of "https" is required for option "--certificate"'
@@ -489,6 +506,34 @@ def _cli_downloadExtension(sc: SlicerPackageClient, *args, **kwargs):
         print(exc_info)
 
 
+@extension.command('snapshot')
+@click.argument('app_name')
+@click.option('--app_revision', default=None,
+              help='The revision of the application [default: all the revisions]',
+              cls=_AdvancedOption)
+@click.option('--coll_id', default=None, envvar='COLLECTION_ID',
+              help='ID of an existing collection',
+              show_default=True,
+              cls=_AdvancedOption)
+@click.option('--dir_path', default=Constant.CURRENT_FOLDER,
+              help='Path to the directory where will be written the snapshot',
+              cls=_AdvancedOption)
+@click.option('--compression', default='gzip', type=click.Choice(['gzip', 'zstd']),
+              help='Compression used for the transfer',
+              show_default=True,
+              cls=_AdvancedOption)
+@click.pass_obj
+def _cli_downloadExtensionSnapshot(sc: SlicerPackageClient, *args, **kwargs):
+    """
+    Download the metadata of all the extensions as a memory-mappable snapshot.
+    """
+    try:
+        path = sc.downloadExtensionSnapshot(*args, **kwargs)
+        print('%s %s' % (path, 'DOWNLOADED'))
+    except SlicerPackageManagerError as exc_info:
+        print(exc_info)
+
+
 @extension.command('list')
 @click.argument('app_name')
 @click.option('--coll_id', default=None, envvar='COLLECTION_ID',
@@ -516,29 +561,45 @@ def _cli_downloadExtension(sc: SlicerPackageClient, *args, **kwargs):
               default=False,
               help='List all the extension of the application',
               cls=_AdvancedOption)
+@click.option('--stream', is_flag=True,
+              default=False,
+              help='Request the extensions page by page and print them as they arrive',
+              cls=_AdvancedOption)
 @click.pass_obj
 def _cli_listExtension(sc: SlicerPackageClient, *args, **kwargs):
     """
     List all the extensions within an application.
     """
     try:
-        extensions = sc.listExtension(*args, **kwargs)
+        stream = kwargs.pop('stream')
+        if stream:
+            if kwargs['all']:
+                kwargs['limit'] = 0
+            extensions = sc.iterExtensions(*args, **kwargs)
+        else:
+            extensions = sc.listExtension(*args, **kwargs)
         rls_list = sc.listRelease(app_name=kwargs['app_name'], coll_id=kwargs['coll_id'])
-        table = []
-        for ext in extensions:
-            release_name = None
-            for rls in rls_list:
-                if rls['meta']['revision'] == ext['meta']['app_revision']:
-                    release_name = rls['name']
-                    break
-            if not release_name:
-                release_name = Constant.DRAFT_RELEASE_NAME
-            table.append([ext['meta']['revision'], ext['name'], release_name,
-                          ext['meta']['app_revision'], ext['_id']])
-        print(tabulate(
-            table,
-            headers=['REVISION', 'NAME', 'RELEASE NAME', 'APP REVISION', 'EXTENSION ID'],
-            tablefmt="simple", numalign="left"))
+
+        def _rows():
+            for ext in extensions:
+                release_name = None
+                for rls in rls_list:
+                    if rls['meta']['revision'] == ext['meta']['app_revision']:
+                        release_name = rls['name']
+                        break
+                if not release_name:
+                    release_name = Constant.DRAFT_RELEASE_NAME
+                yield [ext['meta']['revision'], ext['name'], release_name,
+                       ext['meta']['app_revision'], ext['_id']]
+
+        headers = ['REVISION', 'NAME', 'RELEASE NAME', 'APP REVISION', 'EXTENSION ID']
+        if stream:
+            _printRows(headers, _rows())
+        else:
+            print(tabulate(
+                list(_rows()),
+                headers=headers,
+                tablefmt="simple", numalign="left"))
     except SlicerPackageManagerError as exc_info:
         print(exc_info)
 
@@ -661,28 +722,40 @@ def _cli_downloadApplicationPackage(sc: SlicerPackageClient, *args, **kwargs):
 @click.option('--limit', default=Constant.DEFAULT_LIMIT,
               help='The limit number of listed packages ',
               cls=_AdvancedOption)
+@click.option('--stream', is_flag=True,
+              default=False,
+              help='Request the packages page by page and print them as they arrive',
+              cls=_AdvancedOption)
 @click.pass_obj
 def _cli_listApplicationPackage(sc: SlicerPackageClient, *args, **kwargs):
     """
     List all the application packages within an application.
     """
     try:
-        packages = sc.listApplicationPackage(*args, **kwargs)
+        stream = kwargs.pop('stream')
+        listPackages = sc.iterApplicationPackages if stream else sc.listApplicationPackage
+        packages = listPackages(*args, **kwargs)
         rls_list = sc.listRelease(app_name=kwargs['app_name'], coll_id=kwargs['coll_id'])
-        table = []
-        for pkg in packages:
-            release_name = None
-            for rls in rls_list:
-                if rls['meta']['revision'] == pkg['meta']['revision']:
-                    release_name = rls['name']
-                    break
-            if not release_name:
-                release_name = Constant.DRAFT_RELEASE_NAME
-            table.append([pkg['meta']['revision'], pkg['meta']['version'], pkg['name'], release_name, pkg['_id']])
-        print(tabulate(
-            table,
-            headers=['APP REVISION', 'VERSION', 'NAME', 'RELEASE NAME', 'PACKAGE ID'],
-            tablefmt="simple", numalign="left", floatfmt=".1f"))
+
+        def _rows():
+            for pkg in packages:
+                release_name = None
+                for rls in rls_list:
+                    if rls['meta']['revision'] == pkg['meta']['revision']:
+                        release_name = rls['name']
+                        break
+                if not release_name:
+                    release_name = Constant.DRAFT_RELEASE_NAME
+                yield [pkg['meta']['revision'], pkg['meta']['version'], pkg['name'], release_name, pkg['_id']]
+
+        headers = ['APP REVISION', 'VERSION', 'NAME', 'RELEASE NAME', 'PACKAGE ID']
+        if stream:
+            _printRows(headers, _rows())
+        else:
+            print(tabulate(
+                list(_rows()),
+                headers=headers,
+                tablefmt="simple", numalign="left", floatfmt=".1f"))
     except SlicerPackageManagerError as exc_info:
         print(exc_info)
 
@@ -704,3 +777,59 @@ def _cli_deleteApplicationPackage(sc: SlicerPackageClient, *args, **kwargs):
         print('%s %s (%s) %s' % (pkg['name'], pkg['meta']['revision'], pkg['_id'], 'DELETED'))
     except SlicerPackageManagerError as exc_info:
         print(exc_info)
+
+
+@main.command('mirror', context_settings=_CONTEXT_SETTINGS)
+@click.argument('app_name')
+@click.argument('dir_path')
+@click.option('--coll_id', default=None, envvar='COLLECTION_ID',
+              help='ID of an existing collection',
+              show_default=True,
+              cls=_AdvancedOption)
+@click.option('--concurrency', default=DEFAULT_CONCURRENCY, type=click.IntRange(min=1),
+              help='Number of packages transferred simultaneously',
+              show_default=True,
+              cls=_AdvancedOption)
+@click.option('--dry_run', is_flag=True,
+              default=False,
+              help='Only list the packages that would be transferred or pruned',
+              cls=_AdvancedOption)
+@click.option('--target_api_url', default=None,
+              help='RESTful API URL of a server receiving the packages instead of DIR_PATH',
+              cls=_AdvancedOption)
+@click.option('--target_api_key', envvar='TARGET_GIRDER_API_KEY', default=None,
+              help='API key of the target server [default: TARGET_GIRDER_API_KEY env. variable]',
+              cls=_AdvancedOption)
+@click.option('--target_app', default=None,
+              help='Name of the application on the target server [default: APP_NAME]',
+              cls=_AdvancedOption)
+@click.option('--target_coll_id', default=None,
+              help='ID of the collection of the application on the target server',
+              cls=_AdvancedOption)
+@click.pass_obj
+def _cli_mirror(sc: SlicerPackageClient, app_name, dir_path, coll_id, concurrency, dry_run,
+                target_api_url, target_api_key, target_app, target_coll_id):
+    """
+    Mirror the packages of an application into DIR_PATH, or into another server.
+
+    Only the packages changed since the last mirroring are transferred, the deleted packages
+    are pruned. DIR_PATH stores the state of the mirror.
+    """
+    try:
+        targetClient = None
+        if target_api_url:
+            targetClient = SlicerPackageCli(
+                None, None, apiUrl=target_api_url, apiKey=target_api_key, chunkSize=sc.MAX_CHUNK_SIZE)
+        report = Mirror(
+            sc, app_name, dir_path, collId=coll_id, targetClient=targetClient,
+            targetAppName=target_app, targetCollId=target_coll_id,
+        ).sync(dryRun=dry_run, concurrency=concurrency)
+        for name in report.transferred:
+            print('%s %s' % (name, 'TRANSFERRED'))
+        for name in report.pruned:
+            print('%s %s' % (name, 'PRUNED'))
+        for name, reason in report.failed:
+            print('%s %s %s' % (name, 'FAILED', reason))
+        print(report)
+    except SlicerPackageManagerError as exc_info:
+        print(exc_info)
@@ -0,0 +1,319 @@
+"""
+Keep a local directory, or another Slicer package manager server, in sync with an application.
+
+The mirror reads the ``GET /app/:app_id/changes`` feed from the last synchronization, so
+that only the packages created, updated or deleted since then are transferred. The feed token
+and the mirrored packages are recorded in a SQLite database stored in the mirror directory.
+"""
+import concurrent.futures
+import contextlib
+import hashlib
+import os
+import sqlite3
+import tempfile
+import time
+
+from girder_client import HttpError
+
+from . import SlicerPackageManagerError
+
+STATE_FILE_NAME = '.slicer_package_manager_mirror.sqlite'
+
+DEFAULT_CONCURRENCY = 4
+DEFAULT_PAGE_SIZE = 100
+
+_CHUNK_SIZE = 65536
+
+#: Metadata forwarded when creating the packages on a target server.
+_EXTENSION_PARAMETERS = (
+    'os', 'arch', 'baseName', 'repository_type', 'repository_url', 'revision', 'app_revision',
+    'description', 'icon_url', 'development_status', 'category', 'tier', 'enabled', 'homepage',
+    'screenshots', 'contributors', 'dependency', 'recommends', 'license', 'dicom_support_rule',
+    'keywords',
+)
+_PACKAGE_PARAMETERS = (
+    'os', 'arch', 'baseName', 'repository_type', 'repository_url', 'revision', 'version',
+    'build_date', 'description', 'pre_release',
+)
+
+
+class MirrorReport:
+    """
+    Summary of a synchronization.
+    """
+
+    def __init__(self, dryRun):
+        self.dryRun = dryRun
+        self.transferred = []
+        self.skipped = []
+        self.pruned = []
+        self.failed = []
+        self.bytesTransferred = 0
+        self.elapsed = 0.0
+
+    def __str__(self):
+        return '%s%d transferred (%d bytes), %d up-to-date, %d pruned, %d failed in %.1fs' % (
+            '[dry run] ' if self.dryRun else '',
+            len(self.transferred), self.bytesTransferred, len(self.skipped), len(self.pruned),
+            len(self.failed), self.elapsed)
+
+
+class _DirectoryTarget:
+    """
+    Store the mirrored binaries in ``<dir_path>/<extensions|packages>/<item name>/<file name>``.
+    """
+
+    def __init__(self, dirPath):
+        self.dirPath = dirPath
+
+    def put(self, item, file, tmpPath):
+        path = os.path.join(self.dirPath, '%ss' % _itemType(item), item['name'], file['name'])
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(tmpPath, path)
+        return path
+
+    def remove(self, location):
+        if os.path.exists(location):
+            os.remove(location)
+        directory = os.path.dirname(location)
+        if os.path.isdir(directory) and not os.listdir(directory):
+            os.rmdir(directory)
+
+
+class _GirderTarget:
+    """
+    Upload the mirrored binaries to an application of another server.
+    """
+
+    def __init__(self, client, appName, collId=None):
+        self.client = client
+        self.app = _getApp(client, appName, collId)
+
+    def put(self, item, file, tmpPath):
+        itemType = _itemType(item)
+        keys = _EXTENSION_PARAMETERS if itemType == 'extension' else _PACKAGE_PARAMETERS
+        created = self.client.post('/app/%s/%s' % (self.app['_id'], itemType), parameters={
+            key: item['meta'][key] for key in keys if key in item['meta']
+        })
+        self.client.replacePackageFile(
+            itemType, self.app['_id'], created['_id'], tmpPath, filename=file['name'], mimeType=file.get('mimeType'))
+        return created['_id']
+
+    def remove(self, location):
+        try:
+            self.client.delete('/item/%s' % location)
+        except HttpError as exc_info:
+            # The package was already removed from the target
+            if exc_info.status not in (400, 404):
+                raise
+
+
+class Mirror:
+    """
+    Synchronize the packages of an application into a local directory, or into another server if
+    a ``targetClient`` is passed.
+
+    :param client: :class:`slicer_package_manager_client.SlicerPackageClient` of the source server
+    :param appName: Name of the application to mirror
+    :param dirPath: Directory of the mirror, it contains the state database and the binaries
+        if no ``targetClient`` is passed
+    :param collId: Collection ID of the application
+    :param targetClient: Client of the server receiving the packages
+    :param targetAppName: Name of the application on the target server, default to ``appName``
+    :param targetCollId: Collection ID of the application on the target server
+    """
+
+    def __init__(self, client, appName, dirPath, collId=None, targetClient=None, targetAppName=None,
+                 targetCollId=None):
+        self.client = client
+        self.app = _getApp(client, appName, collId)
+        self.dirPath = dirPath
+        if targetClient is None:
+            self.target = _DirectoryTarget(dirPath)
+        else:
+            self.target = _GirderTarget(targetClient, targetAppName or appName, targetCollId)
+
+    def sync(self, dryRun=False, concurrency=DEFAULT_CONCURRENCY, pageSize=DEFAULT_PAGE_SIZE):
+        """
+        Transfer the packages changed since the last synchronization and prune the deleted ones.
+
+        The changes feed is mirrored one page at a time, and its token is recorded once all the
+        changes of a page are mirrored. The packages already mirrored are recorded with their
+        ``sha512`` so that a failed synchronization can be resumed without transferring them
+        again. If the token expired on the server, all the packages are listed again and the
+        mirrored packages that are not listed are pruned.
+
+        :param dryRun: Only report the changes that would be mirrored
+        :param concurrency: Number of binaries transferred simultaneously
+        :param pageSize: Number of changes requested at a time
+        :return: A :class:`MirrorReport`
+        """
+        report = MirrorReport(dryRun)
+        start = time.time()
+        os.makedirs(self.dirPath, exist_ok=True)
+        with self._openState() as db:
+            since = self._getToken(db)
+            try:
+                page = self._getChanges(since, pageSize)
+            except HttpError as exc_info:
+                # The deletions since the token expired on the server, list all the packages again
+                if exc_info.status != 410 or since is None:
+                    raise
+                since = None
+                page = self._getChanges(since, pageSize)
+
+            listed = set()
+            while True:
+                # Keep the last change of each item of the page
+                changes = {change['_id']: change for change in page['changes']}
+                self._mirrorChanges(db, changes, report, dryRun, concurrency)
+                token = page['token']
+                if since is not None and not dryRun and not report.failed and token is not None:
+                    self._setToken(db, token)
+                if since is None:
+                    listed.update(changes)
+                if not page['hasMore']:
+                    break
+                page = self._getChanges(token, pageSize)
+
+            if since is None:
+                # Prune the mirrored packages that are neither listed nor recorded as deleted
+                changes = {
+                    itemId: {'_id': itemId, 'action': 'deleted', 'item': {'name': name}}
+                    for itemId, name in db.execute('SELECT itemId, name FROM items').fetchall()
+                    if itemId not in listed
+                }
+                self._mirrorChanges(db, changes, report, dryRun, concurrency)
+                if not dryRun and not report.failed and token is not None:
+                    self._setToken(db, token)
+
+        report.elapsed = time.time() - start
+        return report
+
+    def _getChanges(self, token, pageSize):
+        """
+        Read one page of the changes feed from ``token``.
+
+        :return: The page, with the ``changes``, the ``token`` to resume after the last change and
+            ``hasMore``
+        """
+        return self.client.get('/app/%s/changes' % self.app['_id'], parameters={
+            'since': token,
+            'limit': pageSize,
+        })
+
+    def _mirrorChanges(self, db, changes, report, dryRun, concurrency):
+        """
+        Transfer the created or updated packages and prune the deleted ones.
+
+        :param changes: A dictionary mapping each item ID to its last change
+        """
+        transfers = []
+        for itemId, change in changes.items():
+            record = db.execute(
+                'SELECT sha512, location, name FROM items WHERE itemId = ?', (itemId,)).fetchone()
+            item = change['item']
+            if change['action'] == 'deleted':
+                if record is not None:
+                    report.pruned.append(item['name'])
+                    if not dryRun:
+                        self._prune(db, itemId, record[1])
+            elif (record is not None and item['meta'].get('sha512') and record[0] == item['meta']['sha512']
+                  and record[2] == item['name']):
+                report.skipped.append(item['name'])
+            else:
+                transfers.append((item, record[1] if record is not None else None))
+
+        if dryRun:
+            report.transferred.extend(item['name'] for item, _ in transfers)
+            report.bytesTransferred += sum(item.get('size', 0) for item, _ in transfers)
+            return
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = {executor.submit(self._transfer, item): (item, previous) for item, previous in transfers}
+            for future in concurrent.futures.as_completed(futures):
+                item, previous = futures[future]
+                try:
+                    size, location = future.result()
+                except Exception as exc_info:  # noqa: BLE001
+                    report.failed.append((item['name'], str(exc_info)))
+                    continue
+                if previous is not None and previous != str(location):
+                    # The package was renamed, or created again on the target server
+                    self.target.remove(previous)
+                self._record(db, item, location)
+                report.transferred.append(item['name'])
+                report.bytesTransferred += size
+
+    def _transfer(self, item):
+        """
+        Download the binary of a package, verify its checksum and store it in the target.
+
+        :return: The number of bytes transferred and the location of the binary in the target
+        """
+        files = self.client.get('/item/%s/files' % item['_id'], parameters={'limit': 1})
+        if not files:
+            msg = 'The %s "%s" doesn\'t contain any file.' % (_itemType(item), item['name'])
+            raise SlicerPackageManagerError(msg)
+        file = files[0]
+
+        checksum = hashlib.sha512()
+        size = 0
+        fd, tmpPath = tempfile.mkstemp(dir=self.dirPath, prefix='.', suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as stream:
+                for chunk in self.client.downloadFileAsIterator(file['_id'], chunkSize=_CHUNK_SIZE):
+                    checksum.update(chunk)
+                    size += len(chunk)
+                    stream.write(chunk)
+            expected = item['meta'].get('sha512')
+            if expected and checksum.hexdigest() != expected:
+                msg = 'The checksum of the %s "%s" doesn\'t match.' % (_itemType(item), item['name'])
+                raise SlicerPackageManagerError(msg)
+            item['meta']['sha512'] = checksum.hexdigest()
+            location = self.target.put(item, file, tmpPath)
+        finally:
+            if os.path.exists(tmpPath):
+                os.remove(tmpPath)
+        return size, location
+
+    def _prune(self, db, itemId, location):
+        self.target.remove(location)
+        db.execute('DELETE FROM items WHERE itemId = ?', (itemId,))
+        db.commit()
+
+    def _record(self, db, item, location):
+        db.execute(
+            'INSERT OR REPLACE INTO items (itemId, name, type, sha512, location) VALUES (?, ?, ?, ?, ?)',
+            (item['_id'], item['name'], _itemType(item), item['meta']['sha512'], str(location)))
+        db.commit()
+
+    def _openState(self):
+        db = sqlite3.connect(os.path.join(self.dirPath, STATE_FILE_NAME))
+        db.execute('CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT)')
+        db.execute(
+            'CREATE TABLE IF NOT EXISTS items '
+            '(itemId TEXT PRIMARY KEY, name TEXT, type TEXT, sha512 TEXT, location TEXT)')
+        db.commit()
+        return contextlib.closing(db)
+
+    def _getToken(self, db):
+        row = db.execute(
+            'SELECT value FROM state WHERE key = ?', ('token:%s' % self.app['_id'],)).fetchone()
+        return row[0] if row else None
+
+    def _setToken(self, db, token):
+        db.execute(
+            'INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)', ('token:%s' % self.app['_id'], token))
+        db.commit()
+
+
+def _getApp(client, appName, collId):
+    apps = client.listApp(name=appName, coll_id=collId)
+    if not apps:
+        raise SlicerPackageManagerError('The Application "%s" doesn\'t exist.' % appName)
+    return apps[0]
+
+
+def _itemType(item):
+    return 'extension' if 'app_revision' in item['meta'] else 'package'
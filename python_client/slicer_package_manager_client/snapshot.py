@@ -0,0 +1,247 @@
+"""
+Reader of the extension catalog snapshots exported by the ``GET /app/:app_id/extension/snapshot``
+endpoint.
+
+The snapshot is downloaded compressed and decompressed once to disk, it is then memory-mapped
+and filtered without parsing. Each value is the index of a string in a sorted table of unique
+strings, all the integers being unsigned 32 bits little-endian::
+
+    magic       8 bytes, ``SPMSNAP1``
+    rowCount    uint32
+    columnCount uint32
+    columns     columnCount x uint32, index of the name of each column in the string table
+    values      columnCount x rowCount x uint32, column after column, ``0xFFFFFFFF`` if unset
+    stringCount uint32
+    offsets     (stringCount + 1) x uint32, offset of each string relative to the strings
+    strings     UTF-8 encoded strings, sorted
+"""
+import array
+import mmap
+import struct
+import sys
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from . import SlicerPackageManagerError
+
+MAGIC = b'SPMSNAP1'
+NULL = 0xFFFFFFFF
+
+_GZIP_MAGIC = b'\x1f\x8b'
+_ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+
+def decompressSnapshot(chunks, path):
+    """
+    Decompress a gzip or zstd compressed snapshot to ``path``.
+
+    :param chunks: Iterable of the compressed bytes.
+    :param path: Path of the decompressed snapshot.
+    """
+    with open(path, 'wb') as stream:
+        writer = SnapshotWriter(stream)
+        for chunk in chunks:
+            writer.write(chunk)
+        writer.flush()
+
+
+class SnapshotWriter:
+    """
+    Decompress a gzip or zstd compressed snapshot to a binary stream one chunk at a time, the
+    compression being detected from the first chunk.
+    """
+
+    def __init__(self, stream):
+        """
+        :param stream: The binary stream the decompressed snapshot is written to.
+        """
+        self.stream = stream
+        self._decompressor = None
+
+    def write(self, chunk):
+        """
+        Decompress a chunk of the compressed snapshot.
+
+        :param chunk: The next compressed bytes.
+        """
+        if not chunk:
+            return
+        if self._decompressor is None:
+            if chunk.startswith(_ZSTD_MAGIC):
+                if zstandard is None:
+                    msg = 'The zstd compressed snapshots require the "zstandard" package.'
+                    raise SlicerPackageManagerError(msg)
+                self._decompressor = zstandard.ZstdDecompressor().decompressobj()
+            elif chunk.startswith(_GZIP_MAGIC):
+                self._decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+            else:
+                msg = 'Unknown snapshot compression.'
+                raise SlicerPackageManagerError(msg)
+        self.stream.write(self._decompressor.decompress(chunk))
+
+    def flush(self):
+        """
+        Write the end of the decompressed snapshot once all the chunks were written.
+        """
+        if self._decompressor is not None and hasattr(self._decompressor, 'flush'):
+            self.stream.write(self._decompressor.flush())
+
+
+class ExtensionSnapshot:
+    """
+    Memory-mapped view of a decompressed extension snapshot::
+
+        with ExtensionSnapshot(path) as snapshot:
+            for extension in snapshot.find(os='linux', arch='amd64'):
+                print(extension['name'])
+
+    Only the strings of the returned rows are decoded, filtering compares the indices of the
+    strings stored in each column.
+    """
+
+    def __init__(self, path):
+        self._file = open(path, 'rb')  # noqa: SIM115
+        try:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty file
+            self._file.close()
+            msg = 'The file "%s" is not an extension snapshot.' % path
+            raise SlicerPackageManagerError(msg)
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            self.close()
+            msg = 'The file "%s" is not an extension snapshot.' % path
+            raise SlicerPackageManagerError(msg)
+
+        self._rowCount, columnCount = self._uint32(len(MAGIC), 2)
+        position = len(MAGIC) + 8
+        columnNames = self._uint32(position, columnCount)
+        position += 4 * columnCount
+        self._valuesOffset = position
+        position += 4 * columnCount * self._rowCount
+        stringCount = self._uint32(position, 1)[0]
+        self._offsets = self._uint32(position + 4, stringCount + 1)
+        self._stringsOffset = position + 4 * (stringCount + 2)
+        self._strings = {}
+
+        self.columns = tuple(self._string(index) for index in columnNames)
+        self._columnIndex = {name: index for index, name in enumerate(self.columns)}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self._rowCount
+
+    def __iter__(self):
+        return (self.row(index) for index in range(self._rowCount))
+
+    def close(self):
+        """
+        Unmap and close the snapshot file.
+        """
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        self._file.close()
+
+    def column(self, name):
+        """
+        Return the values of a column.
+
+        :param name: Name of the column
+        :return: A list of strings, None for the unset values
+        """
+        return [self._string(index) for index in self._column(name)]
+
+    def row(self, index):
+        """
+        Return one extension of the snapshot.
+
+        :param index: Index of the row
+        :return: A dictionary mapping each column to its value, the unset values are omitted
+        """
+        if not 0 <= index < self._rowCount:
+            msg = 'Row %d out of range.' % index
+            raise IndexError(msg)
+        row = {}
+        for column, name in enumerate(self.columns):
+            value = struct.unpack_from('<I', self._mmap, self._valuesOffset + 4 * (column * self._rowCount + index))[0]
+            if value != NULL:
+                row[name] = self._string(value)
+        return row
+
+    def filter(self, **criteria):
+        """
+        Return the index of the rows whose columns are equal to the given values.
+
+        :param criteria: Column names mapped to the expected value
+        :return: A list of row indices
+        """
+        rows = None
+        for name, value in criteria.items():
+            index = self._lookup(str(value))
+            if index is None:
+                return []
+            column = self._column(name)
+            if rows is None:
+                rows = [row for row, stored in enumerate(column) if stored == index]
+            else:
+                rows = [row for row in rows if column[row] == index]
+            if not rows:
+                return []
+        return list(range(self._rowCount)) if rows is None else rows
+
+    def find(self, **criteria):
+        """
+        Return the extensions whose columns are equal to the given values.
+
+        :param criteria: Column names mapped to the expected value
+        :return: A generator of dictionaries, see :meth:`row`
+        """
+        return (self.row(index) for index in self.filter(**criteria))
+
+    def _uint32(self, offset, count):
+        values = array.array('I', self._mmap[offset:offset + 4 * count])
+        if sys.byteorder == 'big':
+            values.byteswap()
+        return values
+
+    def _column(self, name):
+        if name not in self._columnIndex:
+            msg = 'Unknown column "%s".' % name
+            raise SlicerPackageManagerError(msg)
+        offset = self._valuesOffset + 4 * self._columnIndex[name] * self._rowCount
+        if sys.byteorder == 'big':
+            return self._uint32(offset, self._rowCount)
+        # Scan the column in place, without copying it
+        return memoryview(self._mmap)[offset:offset + 4 * self._rowCount].cast('I')
+
+    def _string(self, index):
+        if index == NULL:
+            return None
+        if index not in self._strings:
+            start = self._stringsOffset + self._offsets[index]
+            end = self._stringsOffset + self._offsets[index + 1]
+            self._strings[index] = self._mmap[start:end].decode('utf8')
+        return self._strings[index]
+
+    def _lookup(self, value):
+        # Binary search of the sorted string table
+        low, high = 0, len(self._offsets) - 1
+        while low < high:
+            middle = (low + high) // 2
+            if self._string(middle) < value:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(self._offsets) - 1 and self._string(low) == value:
+            return low
+        return None
@@ -1,11 +1,21 @@
+import datetime
+import functools
+
 from girder import events, plugin
 from girder.constants import AccessType
 from girder.models.file import File
 from girder.models.item import Item
 from girder.models.folder import Folder
+from girder.models.setting import Setting
+from pymongo import UpdateOne
 from .api.app import App
-from . import constants, utilities
+from . import constants, deduplication, handlerqueue, metrics, utilities
+from .models.dependency import Dependency
+from .models.download_count import TYPE_APPLICATION, TYPE_EXTENSION, DownloadCount
+from .models.extension import Extension as ExtensionModel
+from .models.extension_downloads import ExtensionDownloads
 from .models.package import Package as PackageModel
+from .settings import PluginSettings
 
 from girder_hashsum_download import SUPPORTED_ALGORITHMS
 
@@ -14,23 +24,28 @@ __version__ = get_versions()['version']
 del get_versions
 
 
+@handlerqueue.deferrable
+@metrics.instrumentHandler
 def _onDownloadFileComplete(event):
     """
     Increment download count associated with item revision associated with the event.
 
     Count is stored in the ``downloadStats`` metadata organized as a json document
-    set in the parent release folder.
+    set in the parent release folder, and per day in the ``DownloadCount`` model. The downloads
+    of each extension, all revisions included, are counted in the ``ExtensionDownloads`` model.
+    The time of the last download of each draft revision is stored in the ``lastDownloaded``
+    metadata of the draft release folder.
 
     See :func:`utilities.getReleaseFolder()`.
     """
     item = Item().load(event.info['file']['itemId'], force=True)
 
     if not utilities.isSlicerPackages(item):
-        return
+        return False
 
     release = utilities.getReleaseFolder(item)
     if release is None:
-        return
+        return False
 
     meta = item['meta']
     is_draft_release = release['name'] == constants.DRAFT_RELEASE_NAME
@@ -49,27 +64,39 @@ def _onDownloadFileComplete(event):
         else:
             field_template = 'meta.downloadStats.{folder_name}.{os}.{arch}'
 
-    Folder().increment(
-        query={'_id': release['_id']},
-        field=field_template.format(folder_name=folder_name, **meta),
-        amount=1)
+    now = datetime.datetime.utcnow()
+    update = {'$inc': {field_template.format(folder_name=folder_name, **meta): 1}}
+    if is_draft_release:
+        # Protect recently downloaded draft revisions from the retention policy
+        revision = meta['app_revision'] if is_extension_item else meta['revision']
+        update['$set'] = {'meta.lastDownloaded.%s' % revision: now}
+    # The counters are incremented by separate writes, a retry only repeats the failed ones
+    steps = [
+        functools.partial(Folder().update, query={'_id': release['_id']}, update=update, multi=False),
+        functools.partial(DownloadCount().recordDownload, item, release, now),
+    ]
+    if is_extension_item:
+        steps.append(functools.partial(ExtensionDownloads().incrementDownloads, meta['app_id'], meta['baseName']))
+    handlerqueue.runSteps(event, steps)
 
 
+@metrics.instrumentHandler
 def _onItemSavedOrCopied(event):
     """
     Set or update "release" metadata when an application package item is
-    moved or copied into or out of a release folder.
+    moved or copied into or out of a release folder, and invalidate the cached
+    latest packages of the application.
 
     See :func:`utilities.isSlicerPackages()` and :func:`utilities.getReleaseFolder()`.
     """
     item = Item().load(event.info['_id'], force=True)
 
     if not utilities.isSlicerPackages(item):
-        return
+        return False
 
     release = utilities.getReleaseFolder(item, force=True)
     if release is None:
-        return
+        return False
 
     meta = item['meta']
 
@@ -79,6 +106,9 @@ def _onItemSavedOrCopied(event):
     if is_extension_item:
         return
 
+    if 'app_id' in meta:
+        PackageModel().invalidateLatestPackages(meta['app_id'])
+
     if is_draft_release:
         if 'release' not in meta:
             return
@@ -92,6 +122,7 @@ def _onItemSavedOrCopied(event):
     PackageModel().setMetadata(item, meta)
 
 
+@metrics.instrumentHandler
 def _onFileEvent(event):
     """Update checksum metadata for an application or extension package item when a file is saved, copied
     or about to be removed.
@@ -100,13 +131,13 @@ def _onFileEvent(event):
     """
     file = File().load(event.info['_id'], force=True)
     if not utilities.isChildOfSlicerPackages(file):
-        return
+        return False
 
     item = Item().load(file['itemId'], force=True)
 
     # Both application and extension packages are expected to have these metadata
     if not all(meta in item.get('meta', {}) for meta in ['app_id', 'os', 'arch', 'revision']):
-        return
+        return False
 
     if event.name == "model.file.save.after":
         if Item().childFiles(item).count() > 1:
@@ -141,6 +172,155 @@ def _onFileEvent(event):
     Item().setMetadata(item, meta)
 
 
+@metrics.instrumentHandler
+def _onFileUploadFinalize(event):
+    """
+    Share the stored content of an identical file when an application or extension package
+    file is uploaded, and update the name and MIME type of the file when its content is replaced.
+
+    The new name and MIME type are set on the upload by :func:`api.app.App._initPackageFileUpload`
+    and applied to the file document before it is saved, so that the file is only saved once.
+
+    See :func:`utilities.isChildOfSlicerPackages()` and :func:`deduplication.deduplicateFile()`.
+    """
+    file = event.info['file']
+    upload = event.info['upload']
+    if 'itemId' not in file or not utilities.isChildOfSlicerPackages(file):
+        return False
+
+    deduplication.deduplicateFile(file, upload)
+
+    if 'fileId' in upload:
+        file['name'] = upload['name']
+        file['mimeType'] = upload['mimeType']
+
+
+@metrics.instrumentHandler
+def _onItemRemove(event):
+    """
+    Record a tombstone when an application or extension package item is deleted, so that the
+    deletion is reported by the changes feed of the application. Also remove the dependency
+    edges of a deleted extension, or invalidate the cached latest packages of the application.
+
+    See :func:`utilities.isSlicerPackages()`.
+    """
+    item = event.info
+    if not utilities.isSlicerPackages(item) or 'app_id' not in item['meta']:
+        return False
+
+    utilities.recordRemovedPackages([item])
+
+
+def _isExtension(item):
+    meta = item.get('meta', {})
+    return all(key in meta for key in ('app_id', 'app_revision', 'baseName', 'os', 'arch'))
+
+
+@metrics.instrumentHandler
+def _onExtensionSavedOrCopied(event):
+    """
+    Update the dependency edges of an extension package item when it is saved or copied.
+
+    See :class:`models.dependency.Dependency`.
+    """
+    item = event.info
+    if not _isExtension(item):
+        return False
+
+    Dependency().updateEdges(item)
+
+
+def _backfillDependencies():
+    """
+    Create the dependency edges of the existing extensions the first time the plugin is loaded
+    with the ``Dependency`` model.
+
+    The completion is recorded by the ``slicer_package_manager.dependencies_backfilled``
+    setting, so that the extensions are not scanned again when none of them has dependencies.
+    """
+    if Setting().get(PluginSettings.DEPENDENCIES_BACKFILLED):
+        return
+    extensions = ExtensionModel().find({
+        'meta.app_revision': {'$exists': True},
+        '$or': [{'meta.dependency': {'$exists': True}}, {'meta.recommends': {'$exists': True}}],
+    })
+    for extension in extensions:
+        if _isExtension(extension):
+            Dependency().updateEdges(extension)
+    Setting().set(PluginSettings.DEPENDENCIES_BACKFILLED, True)
+
+
+def _backfillDownloadCounts():
+    """
+    Create the download counts of the downloads recorded in the ``downloadStats`` metadata of
+    the release folders the first time the plugin is loaded with the ``DownloadCount`` model.
+    These counts have no day.
+
+    The completion is recorded by the ``slicer_package_manager.download_counts_backfilled``
+    setting. The counts are upserted, so that a backfill interrupted before its completion can
+    run again.
+    """
+    if Setting().get(PluginSettings.DOWNLOAD_COUNTS_BACKFILLED):
+        return
+    counts = []
+    for release in Folder().find({'meta.downloadStats': {'$exists': True}}):
+        stats = release['meta']['downloadStats']
+        if release['name'] == constants.DRAFT_RELEASE_NAME:
+            revisions = stats.items()
+        else:
+            revisions = [(release['meta'].get('revision'), stats)]
+        for revision, revisionStats in revisions:
+            for os, arches in revisionStats.get('applications', {}).items():
+                counts.extend(
+                    (release, revision, TYPE_APPLICATION, None, os, arch, count)
+                    for arch, count in arches.items())
+            for baseName, platforms in revisionStats.get(constants.EXTENSIONS_FOLDER_NAME, {}).items():
+                for os, arches in platforms.items():
+                    counts.extend(
+                        (release, revision, TYPE_EXTENSION, baseName, os, arch, count)
+                        for arch, count in arches.items())
+    if counts:
+        DownloadCount().collection.bulk_write([
+            UpdateOne({
+                'app_id': str(release['parentId']),
+                'releaseId': release['_id'],
+                'revision': revision,
+                'type': countType,
+                'baseName': baseName,
+                'os': os,
+                'arch': arch,
+                'day': None,
+            }, {'$set': {'count': count}}, upsert=True)
+            for release, revision, countType, baseName, os, arch, count in counts
+        ], ordered=False)
+    Setting().set(PluginSettings.DOWNLOAD_COUNTS_BACKFILLED, True)
+
+
+def _backfillExtensionDownloads():
+    """
+    Create the download counts of the extensions from the ``DownloadCount`` model the first
+    time the plugin is loaded with the ``ExtensionDownloads`` model.
+
+    The completion is recorded by the ``slicer_package_manager.extension_downloads_backfilled``
+    setting, so that the download counts are not aggregated again when no extension was downloaded.
+    """
+    if Setting().get(PluginSettings.EXTENSION_DOWNLOADS_BACKFILLED):
+        return
+    counts = list(DownloadCount().collection.aggregate([
+        {'$match': {'type': TYPE_EXTENSION}},
+        {'$group': {'_id': {'app_id': '$app_id', 'baseName': '$baseName'}, 'count': {'$sum': '$count'}}},
+    ]))
+    if counts:
+        ExtensionDownloads().collection.insert_many([{
+            'app_id': group['_id']['app_id'],
+            'baseName': group['_id']['baseName'],
+            'count': group['count'],
+        } for group in counts])
+    Setting().set(PluginSettings.EXTENSION_DOWNLOADS_BACKFILLED, True)
+
+
+@handlerqueue.deferrable
+@metrics.instrumentHandler
 def _onReleaseFolderNameUpdated(event):
     """
     Update "release" metadata on all application package items in a release folder when its name is changed.
@@ -149,7 +329,7 @@ def _onReleaseFolderNameUpdated(event):
     """
     folder = Folder().load(event.info['_id'], force=True)
     if not utilities.isReleaseFolder(folder):
-        return
+        return False
 
     release = folder
     if release['name'] == constants.DRAFT_RELEASE_NAME:
@@ -181,6 +361,7 @@ class GirderPlugin(plugin.GirderPlugin):
     def load(self, info):
         # add plugin loading logic here
         plugin.getPlugin('hashsum_download').load(info)
+        plugin.getPlugin('jobs').load(info)
 
         info['apiRoot'].app = App()
         info['serverRoot'].updateHtmlVars({'title': 'Slicer package manager'})
@@ -197,10 +378,34 @@ class GirderPlugin(plugin.GirderPlugin):
         events.bind('model.file.save.after', 'slicer_package_manager', _onFileEvent)
         events.bind('model.file.remove', 'slicer_package_manager', _onFileEvent)
 
+        # Record deleted packages for the changes feed and remove their dependency edges
+        events.bind('model.item.remove', 'slicer_package_manager', _onItemRemove)
+
+        # Update the dependency edges of extensions
+        events.bind('model.item.save.after', 'slicer_package_manager_dependency', _onExtensionSavedOrCopied)
+        events.bind('model.item.copy.after', 'slicer_package_manager_dependency', _onExtensionSavedOrCopied)
+
+        # Deduplicate package files and rename them when their content is replaced
+        events.bind('model.file.finalizeUpload.before', 'slicer_package_manager', _onFileUploadFinalize)
+
         # Mongo indexes
         Item().ensureIndex('meta.baseName')
         Item().ensureIndex('meta.os')
         Item().ensureIndex('meta.arch')
         Item().ensureIndex('meta.app_revision')
         Item().ensureIndex('updated')
+        Item().ensureIndex(([('meta.app_id', 1), ('updated', 1), ('_id', 1)], {}))
+        Item().ensureIndex(([('meta.app_id', 1), ('created', -1)], {}))
+        Item().ensureIndex(([
+            ('meta.app_id', 1), ('meta.app_revision', 1), ('meta.os', 1), ('meta.arch', 1), ('meta.baseName', 1),
+        ], {}))
         Folder().ensureIndex('meta.downloadExtensions')
+
+        # Dependency edges of the extensions created before the edges were maintained
+        _backfillDependencies()
+
+        # Download counts of the downloads recorded before the counts were kept per day
+        _backfillDownloadCounts()
+
+        # Download counts of the extensions ranked by downloads
+        _backfillExtensionDownloads()
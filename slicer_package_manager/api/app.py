@@ -4,25 +4,49 @@ create new applications, new releases, and upload or download application and ex
 packages.
 """
 import datetime
+import heapq
+import json
 import re
 
+from bson.errors import InvalidId
 from bson.objectid import ObjectId
+from bson.son import SON
 from html_sanitizer import Sanitizer
 
 from girder.api import access
 from girder.constants import TokenScope, AccessType, SortDir
 from girder.api.describe import Description, autoDescribeRoute
-from girder.api.rest import Resource
+from girder.api.rest import Resource, setResponseHeader
 from girder.exceptions import RestException
+from girder.models.file import File
 from girder.models.folder import Folder
 from girder.models.collection import Collection
-from girder.utility import parseTimestamp
+from girder.models.upload import Upload
+from girder.utility import JsonEncoder, parseTimestamp
+from girder_jobs.models.job import Job
 
+from ..models.dependency import Dependency, KINDS as DEPENDENCY_KINDS
+from ..models.download_count import DownloadCount, TYPE_EXTENSION as DOWNLOAD_TYPE_EXTENSION
 from ..models.extension import Extension as ExtensionModel
+from ..models.extension_downloads import (
+    ExtensionDownloads,
+    COUNT_FIELD as EXTENSION_DOWNLOADS_FIELD,
+    SORT_KEY as EXTENSION_DOWNLOADS_SORT_KEY,
+)
 from ..models.package import Package as PackageModel
+from ..models.tombstone import RETENTION as TOMBSTONE_RETENTION, Tombstone
 from .. import constants
+from .. import deduplication
+from .. import dependencies
+from .. import jobs
+from .. import metrics
+from .. import snapshot
 from .. import utilities
 
+#: Margin before the current time from which the changes feed resumes once all the changes are
+#: returned, covering the packages being saved while the changes are read.
+CHANGES_CLOCK_SKEW = datetime.timedelta(minutes=1)
+
 
 class App(Resource):
     def __init__(self):
@@ -34,17 +58,38 @@ class App(Resource):
         self.route('GET', (), self.listApp)
         self.route('DELETE', (':app_id',), self.deleteApp)
         self.route('GET', (':app_id', 'downloadstats'), self.getDownloadStats)
+        self.route('GET', (':app_id', 'changes'), self.getChanges)
         self.route('POST', (':app_id', 'release'), self.createNewRelease)
         self.route('GET', (':app_id', 'release'), self.getReleases)
         self.route('DELETE', (':app_id', 'release', ':release_id_or_name'),
                    self.deleteReleaseByIdOrName)
         self.route('POST', (':app_id', 'extension'), self.createOrUpdateExtension)
         self.route('GET', (':app_id', 'extension'), self.getExtensions)
+        self.route('GET', (':app_id', 'extension', 'snapshot'), self.getExtensionSnapshot)
+        self.route('GET', (':app_id', 'extension', 'dependencies'), self.getExtensionDependencies)
+        self.route('GET', (':app_id', 'dependency'), self.getDependencyEdges)
+        self.route('DELETE', (':app_id', 'extension'), self.deleteExtensions)
         self.route('DELETE', (':app_id', 'extension', ':ext_id'), self.deleteExtension)
+        self.route('POST', (':app_id', 'extension', ':ext_id', 'file'), self.replaceExtensionFile)
         self.route('POST', (':app_id', 'package'), self.createOrUpdatePackage)
         self.route('GET', (':app_id', 'package'), self.getPackages)
+        self.route('GET', (':app_id', 'package', 'latest'), self.getLatestPackages)
+        self.route('DELETE', (':app_id', 'package'), self.deletePackages)
         self.route('DELETE', (':app_id', 'package', ':pkg_id'), self.deletePackage)
+        self.route('POST', (':app_id', 'package', ':pkg_id', 'file'), self.replacePackageFile)
         self.route('GET', (':app_id', 'draft'), self.getAllDraftReleases)
+        self.route('GET', (':app_id', 'draft', 'retention'), self.getDraftRetention)
+        self.route('PUT', (':app_id', 'draft', 'retention'), self.setDraftRetention)
+        self.route('POST', (':app_id', 'draft', 'prune'), self.pruneDraftRevisions)
+        self.route('GET', ('metrics',), self.getMetrics)
+
+    def route(self, method, route, handler, nodoc=False, resource=None):
+        """
+        Register a route, recording the metrics of its requests (see :mod:`metrics`).
+        """
+        super().route(
+            method, route, metrics.instrumentRoute(method, (self.resourceName, *route), handler),
+            nodoc=nodoc, resource=resource)
 
     @autoDescribeRoute(
         Description('Create a new application.')
@@ -215,16 +260,24 @@ class App(Resource):
         .modelParam('app_id', destName='app_folder', model=Folder, level=AccessType.ADMIN)
         .param('progress', 'Whether to record progress on this task.',
                required=False, dataType='boolean', default=False)
+        .param('background', 'Whether to delete the application in a background job. The job '
+               'is returned immediately and reports its progress through notifications.',
+               required=False, dataType='boolean', default=False)
         .errorResponse('ID was invalid.')
         .errorResponse('Admin access was denied for the application.', 403),
     )
-    def deleteApp(self, app_folder, progress):
+    def deleteApp(self, app_folder, progress, background):
         """
         Delete an application by ID.
 
         :param app_folder: Application folder loaded using ``app_id`` route parameter.
-        :return: Confirmation message with the deleted application name
+        :param progress: Whether to record progress on this task
+        :param background: Whether to delete the application in a background job
+        :return: Confirmation message with the deleted application name, or the deletion job
         """
+        if background:
+            return jobs.scheduleFolderDeletion(
+                app_folder, self.getCurrentUser(), 'Delete application %s' % app_folder['name'])
         utilities.deleteFolder(app_folder, progress, self.getCurrentUser())
         return {'message': 'Deleted application %s.' % app_folder['name']}
 
@@ -363,6 +416,94 @@ class App(Resource):
             offset=offset,
             sort=sort))
 
+    @autoDescribeRoute(
+        Description('Get the retention policy of the draft revisions of an application.')
+        .modelParam('app_id', destName='app_folder', model=Folder, level=AccessType.READ)
+        .errorResponse('ID was invalid.')
+        .errorResponse('Read permission denied on the application.', 403),
+    )
+    @access.public(scope=TokenScope.DATA_READ)
+    def getDraftRetention(self, app_folder):
+        """
+        Get the retention policy of the draft revisions of an application.
+
+        :param app_folder: Application folder loaded using ``app_id`` route parameter.
+        :return: The retention policy, see :func:`jobs.selectPrunedRevisions`
+        """
+        policy = app_folder.get('meta', {}).get('draftRetention') or {}
+        return {field: policy.get(field) for field in jobs.RETENTION_FIELDS}
+
+    @autoDescribeRoute(
+        Description('Set the retention policy of the draft revisions of an application.')
+        .notes('A draft revision is kept if any of the rules matches. The revisions are only '
+               'removed by the "prune" endpoint.')
+        .modelParam('app_id', destName='app_folder', model=Folder, level=AccessType.ADMIN)
+        .param('keep_revisions', 'Number of the most recent revisions to keep.',
+               required=False, dataType='integer')
+        .param('keep_days', 'Keep the revisions created within this number of days.',
+               required=False, dataType='integer')
+        .param('keep_downloaded_days', 'Keep the revisions with a package downloaded within '
+               'this number of days.', required=False, dataType='integer')
+        .errorResponse('ID was invalid.')
+        .errorResponse('Admin access was denied for the application.', 403),
+    )
+    @access.user(scope=TokenScope.DATA_WRITE)
+    def setDraftRetention(self, app_folder, keep_revisions, keep_days, keep_downloaded_days):
+        """
+        Set the retention policy of the draft revisions of an application. The rules not
+        passed are removed from the policy.
+
+        :param app_folder: Application folder loaded using ``app_id`` route parameter.
+        :param keep_revisions: Number of the most recent revisions to keep
+        :param keep_days: Keep the revisions created within this number of days
+        :param keep_downloaded_days: Keep the revisions with a package downloaded within this
+            number of days
+        :return: The retention policy
+        """
+        policy = dict(zip(jobs.RETENTION_FIELDS, (keep_revisions, keep_days, keep_downloaded_days)))
+        for field, value in policy.items():
+            if value is not None and value < 0:
+                msg = f"The retention rule '{field}' must be a positive number."
+                raise RestException(msg)
+        self._model.setMetadata(app_folder, {'draftRetention': policy})
+        return policy
+
+    @autoDescribeRoute(
+        Description('Remove the draft revisions not kept by the retention policy.')
+        .notes('The revisions are removed by a background job, with "dry_run" the job only '
+               'reports the revisions, items and bytes that would be reclaimed.')
+        .modelParam('app_id', destName='app_folder', model=Folder, level=AccessType.ADMIN)
+        .param('dry_run', 'Only report the revisions that would be removed.',
+               required=False, dataType='boolean', default=False)
+        .errorResponse('ID was invalid.')
+        .errorResponse('Admin access was denied for the application.', 403),
+    )
+    @access.user(scope=TokenScope.DATA_WRITE)
+    def pruneDraftRevisions(self, app_folder, dry_run):
+        """
+        Schedule the job removing the draft revisions not kept by the retention policy of the
+        application, see :func:`jobs.pruneDraftRevisions`.
+
+        :param app_folder: Application folder loaded using ``app_id`` route parameter.
+        :param dry_run: Only report the revisions that would be removed
+        :return: The scheduled job
+        """
+        policy = app_folder.get('meta', {}).get('draftRetention') or {}
+        if not any(policy.get(field) is not None for field in jobs.RETENTION_FIELDS):
+            msg = 'The application has no draft retention policy.'
+            raise RestException(msg)
+        user = self.getCurrentUser()
+        job = Job().createLocalJob(
+            module='slicer_package_manager.jobs',
+            function='pruneDraftRevisions',
+            title='Prune the draft revisions of %s' % app_folder['name'],
+            type='slicer_package_manager.prune_drafts',
+            user=user,
+            kwargs={'app_id': str(app_folder['_id']), 'dry_run': dry_run},
+            asynchronous=True)
+        Job().scheduleJob(job)
+        return job
+
     @access.user(scope=TokenScope.DATA_WRITE)
     @autoDescribeRoute(
         Description('Delete a release by ID or name.')
@@ -370,17 +511,21 @@ class App(Resource):
         .param('release_id_or_name', "The release's ID or name.", paramType='path')
         .param('progress', 'Whether to record progress on this task.',
                required=False, dataType='boolean', default=False)
+        .param('background', 'Whether to delete the release in a background job. The job '
+               'is returned immediately and reports its progress through notifications.',
+               required=False, dataType='boolean', default=False)
         .errorResponse('ID was invalid.')
         .errorResponse('Admin access was denied for the release.', 403),
     )
-    def deleteReleaseByIdOrName(self, app_folder, release_id_or_name, progress):
+    def deleteReleaseByIdOrName(self, app_folder, release_id_or_name, progress, background):
         """
         Delete a release by ID or name.
 
         :param app_folder: Application folder loaded using ``app_id`` route parameter.
         :param release_id_or_name: Could be either the release ID or the release name
         :param progress: Whether to record progress on this task
-        :return: Confirmation message with the deleted release name
+        :param background: Whether to delete the release in a background job
+        :return: Confirmation message with the deleted release name, or the deletion job
         """
         user = self.getCurrentUser()
 
@@ -414,6 +559,8 @@ class App(Resource):
             else:
                 release = release_folder[0]
 
+        if background:
+            return jobs.scheduleFolderDeletion(release, user, 'Delete release %s' % release['name'])
         utilities.deleteFolder(release, progress, self.getCurrentUser())
         return {'message': 'Deleted release %s.' % release['name']}
 
@@ -460,13 +607,17 @@ class App(Resource):
                 filters['meta.tier'] = tier_value
         return filters
 
-    def _find_extensions(self, filters, limit, offset, sort):
+    def _find_extensions(self, app_id, filters, limit, offset, sort):
         """Execute extension query with given filters."""
-        return list(ExtensionModel().find(
+        if _isRankedByDownloads(sort):
+            stages, sort = ExtensionDownloads().rankingStages(app_id, sort[0][1])
+            return _aggregate(
+                ExtensionModel(), filters, stages, sort, limit, offset, [EXTENSION_DOWNLOADS_FIELD])
+        return ExtensionModel().find(
             query=filters,
             limit=limit,
             offset=offset,
-            sort=sort))
+            sort=sort)
 
     def _get_release_extensions_folder_id(self, release, user):
         """Get extensions folder ID from a non-draft release."""
@@ -498,35 +649,37 @@ class App(Resource):
         return None
 
     def _find_extensions_across_draft_revisions(
-            self, release, user, filters, limit, offset, sort):
+            self, app_id, release, user, filters, limit, offset, sort):
         """Find extensions across all revisions in a draft release."""
-        revisions = self._model.childFolders(release, 'Folder', user=user, sort=sort)
-        extensions = []
-        limit_tmp = limit
-        offset_tmp = offset
-        for revision in revisions:
-            extensions_folder = list(self._model.childFolders(
-                revision,
-                'Folder',
-                user=user,
-                filters={'name': constants.EXTENSIONS_FOLDER_NAME}))
-            if not extensions_folder:
-                continue
-            filters['folderId'] = ObjectId(extensions_folder[0]['_id'])
-            batch = self._find_extensions(filters, limit_tmp + offset_tmp, 0, sort)
-            skipped = min(offset_tmp, len(batch))
-            offset_tmp -= skipped
-            extensions += batch[skipped:skipped + limit_tmp]
-            limit_tmp = limit - len(extensions)
-            if limit_tmp <= 0:
-                break
-        return extensions
+        ranking = None
+        revision_sort = sort
+        if _isRankedByDownloads(sort):
+            # Rank the extensions of each revision, the most recent revision first
+            ranking = ExtensionDownloads().rankingStages(app_id, sort[0][1])
+            revision_sort = [('created', SortDir.DESCENDING)]
+        revision_ids = [revision['_id'] for revision in self._model.childFolders(
+            release, 'Folder', user=user, sort=revision_sort, fields=['_id'])]
+        # Look up the extensions folders of all the revisions at once
+        extensions_folder_ids = {
+            folder['parentId']: folder['_id']
+            for folder in self._model.findWithPermissions({
+                'parentId': {'$in': revision_ids},
+                'parentCollection': 'folder',
+                'name': constants.EXTENSIONS_FOLDER_NAME,
+            }, fields=['parentId'], user=user, level=AccessType.READ)
+        }
+        return _findInFolders(
+            ExtensionModel(),
+            [extensions_folder_ids[revision_id] for revision_id in revision_ids
+             if revision_id in extensions_folder_ids],
+            filters, limit, offset, sort, ranking)
 
     @autoDescribeRoute(
         Description('List or search available extensions.')
         .notes('If the "release_id" provided correspond to the "draft" release,'
                ' then you must provide the "app_revision" to use this parameters. '
-               'If not, it will just be ignored.')
+               'If not, it will just be ignored. Use "downloads" as "sort" to rank the '
+               'extensions by their number of downloads, all revisions included.')
         .responseClass('Extension')
         .param('app_id', 'The ID of the application.', paramType='path')
         .param('extension_name', 'The name of the extension.', required=False)
@@ -542,12 +695,15 @@ class App(Resource):
         .param('tier', 'Tier of the extension.', required=False, dataType='integer')
         .param('tier_compare', 'Comparison type for the tier.',
                required=False, enum=['exact', 'lte', 'gte'], default='lte')
+        .param('format', 'Format of the response. With "ndjson", the extensions are streamed as '
+               'newline-delimited JSON documents.',
+               required=False, enum=['json', 'ndjson'], default='json')
         .pagingParams(defaultSort='created', defaultSortDir=SortDir.DESCENDING)
         .errorResponse(),
     )
     @access.public(scope=TokenScope.DATA_READ)
     def getExtensions(self, app_id, extension_name, release_id, extension_id, os, arch,
-                      app_revision, baseName, q, tier, tier_compare, limit, sort, offset=0):
+                      app_revision, baseName, q, tier, tier_compare, format, limit, sort, offset=0):
         """
         Get a list of extension which is filtered by some optional parameters. If the ``release_id``
         provided correspond to the draft release, then you must provide the app_revision to use
@@ -564,6 +720,7 @@ class App(Resource):
         :param q: Text expected to be found in the extension name or description
         :param tier: Tier of the extension.
         :param tier_compare: Comparison type for the tier specified as "exact", "lte" (<=), or "gte" (>=).
+        :param format: Either "json" or "ndjson" to stream the extensions as newline-delimited JSON.
         :return: The list of extensions
         """
         user = self.getCurrentUser()
@@ -581,15 +738,173 @@ class App(Resource):
                     if folder_id:
                         filters['folderId'] = folder_id
                 else:
-                    return self._find_extensions_across_draft_revisions(
-                        release, user, filters, limit, offset, sort)
+                    return _formatResponse(self._find_extensions_across_draft_revisions(
+                        app_id, release, user, filters, limit, offset, sort), format)
             else:
                 folder_id = self._get_release_extensions_folder_id(release, user)
                 if not folder_id:
-                    return []
+                    return _formatResponse([], format)
                 filters['folderId'] = folder_id
 
-        return self._find_extensions(filters, limit, offset, sort)
+        return _formatResponse(self._find_extensions(app_id, filters, limit, offset, sort), format)
+
+    @autoDescribeRoute(
+        Description('Export the extensions metadata as a compressed columnar snapshot.')
+        .notes('See the ``slicer_package_manager.snapshot`` module for the layout of the '
+               'snapshot once decompressed.')
+        .param('app_id', 'The ID of the application.', paramType='path')
+        .param('app_revision', 'The revision of the application. If not passed, the extensions '
+               'of all the revisions are exported.', required=False)
+        .param('compression', 'Compression of the snapshot.',
+               required=False, enum=[snapshot.COMPRESSION_GZIP, snapshot.COMPRESSION_ZSTD],
+               default=snapshot.COMPRESSION_GZIP)
+        .produces('application/octet-stream')
+        .errorResponse(),
+    )
+    @access.public(scope=TokenScope.DATA_READ)
+    def getExtensionSnapshot(self, app_id, app_revision, compression):
+        """
+        Export the metadata of the extensions of an application, or of one revision of the
+        application, as a compressed columnar snapshot.
+
+        :param app_id: Application ID
+        :param app_revision: The revision of the application
+        :param compression: Either "gzip" or "zstd"
+        :return: Streamed compressed snapshot
+        """
+        user = self.getCurrentUser()
+        application = self._model.load(app_id, user=user, level=AccessType.READ, exc=True)
+        filters = self._build_extension_filters(
+            app_id, None, None, None, None, app_revision, None, None, None, None)
+        extensions = ExtensionModel().find(
+            query=filters,
+            sort=[('_id', SortDir.ASCENDING)],
+            fields=list(snapshot.ITEM_COLUMNS) + ['meta.%s' % key for key in snapshot.META_COLUMNS])
+        chunks = snapshot.compressSnapshot(snapshot.buildSnapshot(extensions), compression)
+
+        suffix = '.gz' if compression == snapshot.COMPRESSION_GZIP else '.zst'
+        setResponseHeader('Content-Type', 'application/octet-stream')
+        setResponseHeader('Content-Disposition', 'attachment; filename="%s_%s_extensions.snapshot%s"' % (
+            application['name'], app_revision or 'all', suffix))
+
+        def stream():
+            yield from chunks
+        return stream
+
+    @autoDescribeRoute(
+        Description('Resolve the transitive dependencies of extensions.')
+        .notes('The extensions are returned in installation order, each extension after the '
+               'extensions it depends on. The dependencies that cannot be found and the circular '
+               'dependencies are reported in "missing" and "cycles".')
+        .param('app_id', 'The ID of the application.', paramType='path')
+        .param('baseName', 'Space or comma separated list of the baseNames of the extensions.')
+        .param('app_revision', 'The revision of the application.')
+        .param('os', 'The target operating system of the package.',
+               enum=['linux', 'win', 'macosx'])
+        .param('arch', 'The os chip architecture.', enum=['i386', 'amd64'])
+        .errorResponse(),
+    )
+    @access.public(scope=TokenScope.DATA_READ)
+    def getExtensionDependencies(self, app_id, baseName, app_revision, os, arch):
+        """
+        Resolve the transitive dependency closure of extensions built for a revision of the
+        application.
+
+        The closure is expanded one level of dependencies at a time, with one query per level.
+        When several extensions share the same baseName, the most recently created one is used.
+
+        :param app_id: Application ID
+        :param baseName: Space or comma separated list of the baseNames of the extensions
+        :param app_revision: The revision of the application
+        :param os: The operation system used for the extensions.
+        :param arch: The architecture compatible with the extensions.
+        :return: A document with the ordered ``extensions`` to install, the ``missing``
+            dependencies with the extensions requiring them and the dependency ``cycles``
+        """
+        user = self.getCurrentUser()
+        utilities.checkAccess(app_id, user)
+        baseNames = dependencies.parseDependencies(baseName)
+        if not baseNames:
+            msg = 'At least one extension baseName is required.'
+            raise RestException(msg)
+
+        extensions = {}
+
+        def _getDependencies(names):
+            cursor = ExtensionModel().find({
+                'meta.app_id': app_id,
+                'meta.app_revision': app_revision,
+                'meta.os': os,
+                'meta.arch': arch,
+                'meta.baseName': {'$in': names},
+            }, sort=[('created', SortDir.DESCENDING)])
+            found = {}
+            for extension in cursor:
+                name = extension['meta']['baseName']
+                if name not in found:
+                    extensions[name] = extension
+                    found[name] = dependencies.parseDependencies(extension['meta'].get('dependency'))
+            return found
+
+        order, missing, cycles = dependencies.resolveDependencies(baseNames, _getDependencies)
+        return {
+            'extensions': [extensions[name] for name in order],
+            'missing': [{'baseName': name, 'requiredBy': requiredBy} for name, requiredBy in sorted(missing.items())],
+            'cycles': cycles,
+        }
+
+    @autoDescribeRoute(
+        Description('List the dependency edges from or to an extension.')
+        .notes('With the "forward" direction, list the extensions required or recommended by the '
+               'extension. With the "reverse" direction, list the extensions requiring or '
+               'recommending it.')
+        .param('app_id', 'The ID of the application.', paramType='path')
+        .param('baseName', 'The baseName of the extension.')
+        .param('app_revision', 'The revision of the application.')
+        .param('direction', 'Direction of the edges.',
+               required=False, enum=['forward', 'reverse'], default='forward')
+        .param('kind', 'Kind of the edges, both kinds are listed by default.',
+               required=False, enum=list(DEPENDENCY_KINDS))
+        .param('os', 'The target operating system of the package.',
+               required=False, enum=['linux', 'win', 'macosx'])
+        .param('arch', 'The os chip architecture.',
+               required=False, enum=['i386', 'amd64'])
+        .pagingParams(defaultSort='from_baseName')
+        .errorResponse(),
+    )
+    @access.public(scope=TokenScope.DATA_READ)
+    def getDependencyEdges(self, app_id, baseName, app_revision, direction, kind, os, arch,
+                           limit, offset, sort):
+        """
+        List the dependency edges of the extensions built for a revision of the application.
+
+        Each edge has the ``from_baseName`` of the extension listing the ``to_baseName`` extension
+        in its ``dependency`` or ``recommends`` metadata, as given by ``kind``.
+
+        :param app_id: Application ID
+        :param baseName: The baseName of the extension
+        :param app_revision: The revision of the application
+        :param direction: Either "forward" to list the edges from the extension or "reverse"
+            to list the edges to the extension
+        :param kind: Either "dependency" or "recommends"
+        :param os: The operation system used for the extensions.
+        :param arch: The architecture compatible with the extensions.
+        :return: The list of edges
+        """
+        user = self.getCurrentUser()
+        utilities.checkAccess(app_id, user)
+        filters = {
+            'app_id': app_id,
+            'app_revision': app_revision,
+            'from_baseName' if direction == 'forward' else 'to_baseName': baseName,
+        }
+        if kind:
+            filters['kind'] = kind
+        if os:
+            filters['os'] = os
+        if arch:
+            filters['arch'] = arch
+        return list(Dependency().find(filters, limit=limit, offset=offset, sort=sort))
 
     @autoDescribeRoute(
         Description('Create or Update an extension package.')
@@ -789,6 +1104,117 @@ class App(Resource):
         ExtensionModel().remove(ext_model)
         return ext_model
 
+    @autoDescribeRoute(
+        Description('Delete at once the extensions matching a list of IDs or filters.')
+        .notes('At least the "ids" or one filter must be provided. The access to the application '
+               'is checked once, then the extensions and their files are removed with bulk '
+               'operations. The number of removed extensions, files and bytes is returned.')
+        .modelParam('app_id', 'The ID of the App.', destName='app_folder', model=Folder,
+                    level=AccessType.WRITE)
+        .jsonParam('ids', 'JSON list of extension IDs.', required=False, requireArray=True)
+        .param('app_revision', 'The revision of the application.', required=False)
+        .param('os', 'The target operating system of the extensions.',
+               required=False, enum=['linux', 'win', 'macosx'])
+        .param('arch', 'The os chip architecture.', required=False, enum=['i386', 'amd64'])
+        .jsonParam('baseName', 'JSON list of extension baseNames.', required=False, requireArray=True)
+        .errorResponse('ID was invalid.')
+        .errorResponse('Write access was denied for the application.', 403),
+    )
+    @access.user(scope=TokenScope.DATA_WRITE)
+    def deleteExtensions(self, app_folder, ids, app_revision, os, arch, baseName):
+        """
+        Delete the extensions of an application matching a list of IDs or filters.
+
+        :param app_folder: Application folder loaded using ``app_id`` route parameter.
+        :param ids: The list of extension IDs
+        :param app_revision: The revision of the application
+        :param os: The operation system of the extensions.
+        :param arch: The architecture of the extensions.
+        :param baseName: The list of extension baseNames
+        :return: The number of ``items`` and ``files`` removed, and the ``bytes`` of the files
+        """
+        query = _batchDeleteQuery(
+            app_folder, ids, baseName, {'app_revision': app_revision, 'os': os, 'arch': arch})
+        query.setdefault('meta.app_revision', {'$exists': True})
+        return utilities.deletePackages(query)
+
+    @autoDescribeRoute(
+        Description('Initialize the upload of the binary file of an extension.')
+        .notes('If the extension already has a binary file, its content and name are replaced '
+               'at once when the upload completes. Otherwise a new file is created. Send the '
+               'content using the returned upload ID and the Girder "POST /file/chunk" endpoint. '
+               'If the "sha512" of the content is passed and a file with the same content is '
+               'already stored, it is attached to the extension right away and the file is returned '
+               'instead of an upload.')
+        .param('app_id', 'The ID of the App.', paramType='path')
+        .modelParam('ext_id', destName='ext_model', model=ExtensionModel, level=AccessType.WRITE)
+        .param('name', 'Name of the file.')
+        .param('size', 'Size in bytes of the file.', dataType='integer')
+        .param('mimeType', 'The MIME type of the file.', required=False)
+        .param('sha512', 'The SHA-512 checksum of the file, in hexadecimal.', required=False)
+        .errorResponse('ID was invalid.')
+        .errorResponse('Write access was denied for the extension.', 403),
+    )
+    @access.user(scope=TokenScope.DATA_WRITE)
+    def replaceExtensionFile(self, app_id, ext_model, name, size, mimeType, sha512):
+        """
+        Initialize the upload of the binary file of an extension.
+
+        :param app_id: Application ID
+        :param ext_model: Extension model loaded using ``ext_id`` route parameter.
+        :param name: Name of the file
+        :param size: Size in bytes of the file
+        :param mimeType: The MIME type of the file
+        :param sha512: The SHA-512 checksum of the file
+        :return: The upload document, or the file document if its content is already stored
+        """
+        user = self.getCurrentUser()
+        utilities.checkAccess(app_id, user)
+        return self._initPackageFileUpload(ext_model, name, size, mimeType, user, sha512)
+
+    def _initPackageFileUpload(self, item, name, size, mimeType, user, sha512=None):
+        """
+        Create an upload replacing the file of an application or extension package item.
+
+        The existing file document is reused (see ``Upload.createUploadToFile``) so that the
+        item never holds more than one file. Its content is swapped and its name updated when
+        the upload is finalized (see :func:`slicer_package_manager._onFileUploadFinalize`).
+
+        If ``sha512`` is passed and an identical file is stored in the target assetstore, its
+        content is attached to the item without any upload (see
+        :func:`deduplication.attachDuplicate`).
+        """
+        files = list(ExtensionModel().childFiles(item, limit=2))
+        if len(files) > 1:
+            msg = f"Package '{item['name']}' is expected to contain at most one file."
+            raise RestException(msg)
+
+        if sha512:
+            sha512 = sha512.lower()
+            if not deduplication.isSha512(sha512):
+                msg = 'The sha512 must be a hexadecimal SHA-512 checksum.'
+                raise RestException(msg)
+            assetstore = Upload().getTargetAssetstore('item', item)
+            duplicate = deduplication.findDuplicate(assetstore, sha512, size, user)
+            if duplicate is not None:
+                file = deduplication.attachDuplicate(
+                    item, files[0] if files else None, duplicate, name, mimeType, user)
+                return File().filter(file, user)
+
+        if files:
+            upload = Upload().createUploadToFile(files[0], user, size)
+            upload['name'] = name
+            if mimeType:
+                upload['mimeType'] = mimeType
+            upload = Upload().save(upload)
+        else:
+            upload = Upload().createUpload(
+                user=user, name=name, parentType='item', parent=item, size=size, mimeType=mimeType)
+
+        if upload['size'] > 0:
+            return upload
+        return File().filter(Upload().finalizeUpload(upload), user)
+
     @autoDescribeRoute(
         Description('List or search available packages.')
         .notes('If the "release_id" provided correspond to the "draft" release,'
@@ -805,12 +1231,15 @@ class App(Resource):
                required=False, enum=['i386', 'amd64'])
         .param('revision', 'The revision of the application.', required=False)
         .param('baseName', 'The baseName of the package', required=False)
+        .param('format', 'Format of the response. With "ndjson", the packages are streamed as '
+               'newline-delimited JSON documents.',
+               required=False, enum=['json', 'ndjson'], default='json')
         .pagingParams(defaultSort='created', defaultSortDir=SortDir.DESCENDING)
         .errorResponse(),
     )
     @access.public(scope=TokenScope.DATA_READ)
     def getPackages(self, app_id, package_name, release_id_or_name, package_id, os, arch,
-                    revision, baseName, limit, offset, sort):
+                    revision, baseName, format, limit, offset, sort):
         """
         Get a list of package which is filtered by some optional parameters. If the ``release_id``
         provided correspond to the draft release, then you must provide the revision to use
@@ -824,6 +1253,7 @@ class App(Resource):
         :param arch: The architecture compatible with the application package.
         :param revision: The revision of the application
         :param baseName: The baseName of the package
+        :param format: Either "json" or "ndjson" to stream the packages as newline-delimited JSON.
         :return: The list of application packages
         """
         user = self.getCurrentUser()
@@ -873,30 +1303,39 @@ class App(Resource):
                     if revisions:
                         filters['folderId'] = ObjectId(revisions[0]['_id'])
                 else:
-                    revisions = self._model.childFolders(release, 'Folder', user=user)
-                    packages = []
-                    limit_tmp = limit
-                    for rev in revisions:
-                        filters['folderId'] = ObjectId(rev['_id'])
-                        packages += list(PackageModel().find(
-                            query=filters,
-                            limit=limit_tmp,
-                            offset=offset,
-                            sort=sort))
-                        if limit == 0:
-                            continue
-                        limit_tmp = limit - len(packages)
-                        if limit_tmp <= 0:
-                            break
-                    return packages
+                    revisions = self._model.childFolders(release, 'Folder', user=user, fields=['_id'])
+                    return _formatResponse(_findInFolders(
+                        PackageModel(), (rev['_id'] for rev in revisions),
+                        filters, limit, offset, sort), format)
             else:
                 filters['folderId'] = ObjectId(release['_id'])
 
-        return list(PackageModel().find(
+        return _formatResponse(PackageModel().find(
             query=filters,
             limit=limit,
             offset=offset,
-            sort=sort))
+            sort=sort), format)
+
+    @autoDescribeRoute(
+        Description('Get the latest application package of each platform.')
+        .notes('The most recently created package is returned for each combination of "os", '
+               '"arch" and "pre_release".')
+        .param('app_id', 'The ID of the application.', paramType='path')
+        .errorResponse(),
+    )
+    @access.public(scope=TokenScope.DATA_READ)
+    def getLatestPackages(self, app_id):
+        """
+        Get the latest application package of each ``os``, ``arch`` and ``pre_release``
+        combination in one request.
+
+        :param app_id: Application ID
+        :return: A list of documents with the ``os``, ``arch``, ``pre_release`` and ``package``
+            fields
+        """
+        user = self.getCurrentUser()
+        utilities.checkAccess(app_id, user)
+        return PackageModel().getLatestPackages(app_id)
 
     @autoDescribeRoute(
         Description('Create or Update an application package.')
@@ -1024,23 +1463,213 @@ class App(Resource):
         PackageModel().remove(pkg_model)
         return pkg_model
 
+    @autoDescribeRoute(
+        Description('Delete at once the application packages matching a list of IDs or filters.')
+        .notes('At least the "ids" or one filter must be provided. The access to the application '
+               'is checked once, then the packages and their files are removed with bulk '
+               'operations. The number of removed packages, files and bytes is returned.')
+        .modelParam('app_id', 'The ID of the App.', destName='app_folder', model=Folder,
+                    level=AccessType.WRITE)
+        .jsonParam('ids', 'JSON list of package IDs.', required=False, requireArray=True)
+        .param('revision', 'The revision of the packages.', required=False)
+        .param('os', 'The target operating system of the packages.',
+               required=False, enum=['linux', 'win', 'macosx'])
+        .param('arch', 'The os chip architecture.', required=False, enum=['i386', 'amd64'])
+        .jsonParam('baseName', 'JSON list of package baseNames.', required=False, requireArray=True)
+        .errorResponse('ID was invalid.')
+        .errorResponse('Write access was denied for the application.', 403),
+    )
+    @access.user(scope=TokenScope.DATA_WRITE)
+    def deletePackages(self, app_folder, ids, revision, os, arch, baseName):
+        """
+        Delete the application packages matching a list of IDs or filters.
+
+        :param app_folder: Application folder loaded using ``app_id`` route parameter.
+        :param ids: The list of package IDs
+        :param revision: The revision of the packages
+        :param os: The operation system of the packages.
+        :param arch: The architecture of the packages.
+        :param baseName: The list of package baseNames
+        :return: The number of ``items`` and ``files`` removed, and the ``bytes`` of the files
+        """
+        query = _batchDeleteQuery(app_folder, ids, baseName, {'revision': revision, 'os': os, 'arch': arch})
+        query['meta.app_revision'] = {'$exists': False}
+        query.setdefault('meta.revision', {'$exists': True})
+        return utilities.deletePackages(query)
+
+    @autoDescribeRoute(
+        Description('Initialize the upload of the binary file of an application package.')
+        .notes('If the package already has a binary file, its content and name are replaced '
+               'at once when the upload completes. Otherwise a new file is created. Send the '
+               'content using the returned upload ID and the Girder "POST /file/chunk" endpoint. '
+               'If the "sha512" of the content is passed and a file with the same content is '
+               'already stored, it is attached to the package right away and the file is returned '
+               'instead of an upload.')
+        .param('app_id', 'The ID of the App.', paramType='path')
+        .modelParam('pkg_id', destName='pkg_model', model=PackageModel, level=AccessType.WRITE)
+        .param('name', 'Name of the file.')
+        .param('size', 'Size in bytes of the file.', dataType='integer')
+        .param('mimeType', 'The MIME type of the file.', required=False)
+        .param('sha512', 'The SHA-512 checksum of the file, in hexadecimal.', required=False)
+        .errorResponse('ID was invalid.')
+        .errorResponse('Write access was denied for the package.', 403),
+    )
+    @access.user(scope=TokenScope.DATA_WRITE)
+    def replacePackageFile(self, app_id, pkg_model, name, size, mimeType, sha512):
+        """
+        Initialize the upload of the binary file of an application package.
+
+        :param app_id: Application ID
+        :param pkg_model: Package model loaded using ``pkg_id`` route parameter.
+        :param name: Name of the file
+        :param size: Size in bytes of the file
+        :param mimeType: The MIME type of the file
+        :param sha512: The SHA-512 checksum of the file
+        :return: The upload document, or the file document if its content is already stored
+        """
+        user = self.getCurrentUser()
+        utilities.checkAccess(app_id, user)
+        return self._initPackageFileUpload(pkg_model, name, size, mimeType, user, sha512)
+
+    @autoDescribeRoute(
+        Description('List the application and extension packages created, updated or deleted '
+                    'since a watermark.')
+        .notes('Changes are sorted from the oldest to the newest. Pass the returned "token" as '
+               '"since" to get the next changes, "hasMore" tells if other changes are already '
+               'available. Deletions are only kept for %d days, older tokens are rejected with '
+               'a 410 status and the packages have to be listed again. Once all the changes are '
+               'returned, the token resumes shortly before the current time, so that the token of '
+               'an application without changes does not expire.' % TOMBSTONE_RETENTION.days)
+        .param('app_id', 'The ID of the application.', paramType='path')
+        .param('since', 'Token returned by a previous call or ISO 8601 timestamp. If not passed, '
+               'all the packages are listed.', required=False)
+        .param('limit', 'Maximum number of changes.', required=False, dataType='integer', default=100)
+        .errorResponse(),
+    )
+    @access.public(scope=TokenScope.DATA_READ)
+    def getChanges(self, app_id, since, limit):
+        """
+        Get the application and extension packages created, updated or deleted since a watermark.
+
+        Changes are read from the ``updated`` index of the items and from the tombstones recorded
+        when packages are deleted, so that the cost is proportional to the number of changes.
+
+        :param app_id: Application ID
+        :param since: Token returned by a previous call or ISO 8601 timestamp
+        :param limit: Maximum number of changes
+        :return: A document with the ``changes``, the ``token`` to pass as ``since`` to resume
+            and ``hasMore``
+        """
+        user = self.getCurrentUser()
+        utilities.checkAccess(app_id, user)
+        if limit < 1:
+            msg = 'The limit must be a positive number.'
+            raise RestException(msg)
+
+        watermark = _decodeChangesToken(since) if since else None
+        if watermark is not None and watermark[0] < datetime.datetime.utcnow() - TOMBSTONE_RETENTION:
+            msg = 'The "since" token expired, the deletions older than %d days are not recorded.' % (
+                TOMBSTONE_RETENTION.days)
+            raise RestException(msg, code=410)
+        sort = [('updated', SortDir.ASCENDING), ('_id', SortDir.ASCENDING)]
+
+        def _after(query):
+            if watermark is None:
+                return query
+            updated, _id = watermark
+            return {'$and': [query, {'$or': [
+                {'updated': {'$gt': updated}},
+                {'updated': updated, '_id': {'$gt': _id}},
+            ]}]}
+
+        items = list(ExtensionModel().find(_after({
+            'meta.app_id': app_id,
+            'meta.os': {'$exists': True},
+            'meta.arch': {'$exists': True},
+            'meta.revision': {'$exists': True},
+        }), sort=sort, limit=limit + 1))
+        tombstones = list(Tombstone().find(_after({'app_id': app_id}), sort=sort, limit=limit + 1))
+
+        changes = []
+        for doc in heapq.merge(items, tombstones, key=lambda doc: (doc['updated'], doc['_id'])):
+            if len(changes) == limit:
+                break
+            if 'itemId' in doc:
+                change = {'_id': doc['itemId'], 'type': doc['type'], 'action': 'deleted', 'item': doc}
+            else:
+                created = watermark is None or doc['created'] > watermark[0]
+                change = {
+                    '_id': doc['_id'],
+                    'type': 'extension' if 'app_revision' in doc['meta'] else 'package',
+                    'action': 'created' if created else 'updated',
+                    'item': doc,
+                }
+            change['updated'] = doc['updated']
+            changes.append((change, doc))
+
+        hasMore = len(items) + len(tombstones) > len(changes)
+        if changes:
+            last = changes[-1][1]
+            updated, _id = last['updated'], last['_id']
+        else:
+            updated, _id = watermark or (None, None)
+        resumeFrom = datetime.datetime.utcnow() - CHANGES_CLOCK_SKEW
+        if not hasMore and (updated is None or updated < resumeFrom):
+            # Nothing else changed until recently, resume from then so that the token of a quiet
+            # application doesn't expire
+            updated, _id = resumeFrom, ObjectId('0' * 24)
+        return {
+            'changes': [change for change, _ in changes],
+            'token': _encodeChangesToken(updated, _id),
+            'hasMore': hasMore,
+        }
+
     @autoDescribeRoute(
         Description('Get download stats of application and extensions packages '
                     'within an application.')
+        .notes('Without any of the optional parameters, the statistics of all the releases are '
+               'returned as recorded in the releases. Otherwise, the downloads matching the '
+               'parameters are aggregated and returned with their "totals", either as '
+               '"downloadStats" or as the "top" most downloaded packages. The downloads counted '
+               'before the statistics were recorded per day are excluded by "since" and "until".')
         .param('app_id', 'The ID of the application.', paramType='path')
+        .param('release_id_or_name', "The release's ID or name.", required=False)
+        .param('baseName', 'The baseName of the extensions.', required=False)
+        .param('os', 'The target operating system of the packages.',
+               required=False, enum=['linux', 'win', 'macosx'])
+        .param('arch', 'The os chip architecture.',
+               required=False, enum=['i386', 'amd64'])
+        .param('since', 'Only count the downloads from this day.', required=False, dataType='date')
+        .param('until', 'Only count the downloads until this day, included.', required=False,
+               dataType='date')
+        .param('top', 'Return the N most downloaded packages instead of the statistics.',
+               required=False, dataType='integer')
         .errorResponse(),
     )
     @access.public(scope=TokenScope.DATA_READ)
-    def getDownloadStats(self, app_id):
+    def getDownloadStats(self, app_id, release_id_or_name, baseName, os, arch, since, until, top):
         """
         Get all the download count of all the application and extension packages
         from an application.
 
         :param app_id: Application ID
-        :return: The JSON document of all the download statistics
+        :param release_id_or_name: The release ID or name
+        :param baseName: The baseName of the extensions
+        :param os: The operation system of the packages
+        :param arch: The architecture of the packages
+        :param since: The first day of the counted downloads
+        :param until: The last day of the counted downloads
+        :param top: The number of most downloaded packages to return
+        :return: The JSON document of all the download statistics, or of the matching downloads
         """
         user = self.getCurrentUser()
         application = self._model.load(app_id, user=user, level=AccessType.READ)
+        filtered = any(param is not None for param in (
+            release_id_or_name, baseName, os, arch, since, until, top))
+        if filtered:
+            return self._aggregateDownloadStats(
+                application, user, release_id_or_name, baseName, os, arch, since, until, top)
+
         releases = self._model.childFolders(application, 'Folder', user=user)
 
         downloadStats = {}
@@ -1058,3 +1687,164 @@ class App(Resource):
                             release['meta']['revision']] = release['meta']['downloadStats']
 
         return downloadStats
+
+    def _aggregateDownloadStats(self, application, user, release_id_or_name, baseName, os, arch,
+                                since, until, top):
+        """Aggregate the download counts of the readable releases of an application."""
+        if top is not None and top < 1:
+            msg = 'The top must be a positive number.'
+            raise RestException(msg)
+        releases = self._model.childFolders(application, 'Folder', user=user, fields=['_id', 'name'])
+        if ObjectId.is_valid(release_id_or_name):
+            releaseIds = [release['_id'] for release in releases
+                          if str(release['_id']) == release_id_or_name]
+        elif release_id_or_name:
+            releaseIds = [release['_id'] for release in releases
+                          if release['name'].lower() == release_id_or_name.lower()]
+        else:
+            releaseIds = [release['_id'] for release in releases]
+
+        query = {'app_id': str(application['_id']), 'releaseId': {'$in': releaseIds}}
+        if baseName:
+            query['type'] = DOWNLOAD_TYPE_EXTENSION
+            query['baseName'] = baseName
+        if os:
+            query['os'] = os
+        if arch:
+            query['arch'] = arch
+        if since is not None or until is not None:
+            query['day'] = {'$ne': None}
+            if since is not None:
+                query['day']['$gte'] = datetime.datetime(since.year, since.month, since.day)
+            if until is not None:
+                query['day']['$lte'] = datetime.datetime(until.year, until.month, until.day)
+        return DownloadCount().getStatistics(query, top)
+
+    @autoDescribeRoute(
+        Description('Get the request metrics of the application routes and of the plugin '
+                    'event handlers.')
+        .notes('The wall time, the number and duration of the MongoDB operations, the '
+               'serialization time and the response size of the requests are returned per route, '
+               'and the invocations, early exits and latency of the event handlers per event, '
+               'with the backlog of the event handlers run in the background, in the Prometheus '
+               'text exposition format.')
+        .produces('text/plain')
+        .errorResponse('Admin access was denied.', 403),
+    )
+    @access.admin
+    def getMetrics(self):
+        """
+        Get the request metrics of the routes of this resource and the metrics of the event
+        handlers of the plugin.
+
+        :return: Streamed Prometheus text exposition
+        """
+        text = metrics.renderMetrics()
+        setResponseHeader('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+
+        def stream():
+            yield text.encode('utf8')
+        return stream
+
+
+def _findInFolders(model, folder_ids, filters, limit, offset, sort, ranking=None):
+    """
+    Find the documents of ``model`` matching ``filters`` in each of the folders, as if they
+    were in a single folder: ordered by folder, then by ``sort`` within each folder. The
+    ``offset`` and ``limit`` apply to the whole sequence.
+
+    A single aggregation is run whatever the number of folders. If ``ranking`` is given, as
+    returned by :meth:`ExtensionDownloads.rankingStages`, the documents of each folder are
+    ranked by downloads instead of ``sort``.
+    """
+    folder_ids = [ObjectId(folder_id) for folder_id in folder_ids]
+    if not folder_ids:
+        return iter(())
+    stages = [{'$addFields': {'_folderIndex': {'$indexOfArray': [folder_ids, '$folderId']}}}]
+    hidden = ['_folderIndex']
+    if ranking is not None:
+        rankingStages, sort = ranking
+        stages.extend(rankingStages)
+        hidden.append(EXTENSION_DOWNLOADS_FIELD)
+    return _aggregate(
+        model, dict(filters, folderId={'$in': folder_ids}), stages,
+        [('_folderIndex', SortDir.ASCENDING), *(sort or [])], limit, offset, hidden)
+
+
+def _aggregate(model, filters, stages, sort, limit, offset, hidden):
+    """
+    Find the documents of ``model`` matching ``filters`` with an aggregation, sorting them on
+    the fields added by ``stages``. The ``hidden`` fields are removed from the documents.
+    """
+    pipeline = [{'$match': filters}, *stages, {'$sort': SON(sort)}]
+    if offset:
+        pipeline.append({'$skip': offset})
+    if limit:
+        pipeline.append({'$limit': limit})
+    pipeline.append({'$project': dict.fromkeys(hidden, False)})
+    return model.collection.aggregate(pipeline, allowDiskUse=True)
+
+
+def _batchDeleteQuery(app_folder, ids, baseNames, filters):
+    """
+    Build the query selecting the packages of an application removed by a batch deletion.
+
+    :param app_folder: The application folder
+    :param ids: The list of package IDs, or None
+    :param baseNames: The list of package baseNames, or None
+    :param filters: The metadata the packages must match, the None values are ignored
+    :return: The query
+    """
+    query = {'meta.%s' % key: value for key, value in filters.items() if value is not None}
+    if ids is not None:
+        if not all(isinstance(itemId, str) and ObjectId.is_valid(itemId) for itemId in ids):
+            msg = 'Invalid ObjectId in "ids".'
+            raise RestException(msg)
+        query['_id'] = {'$in': [ObjectId(itemId) for itemId in ids]}
+    if baseNames is not None:
+        query['meta.baseName'] = {'$in': baseNames}
+    if not query:
+        msg = 'At least "ids" or one filter must be provided.'
+        raise RestException(msg)
+    query['meta.app_id'] = str(app_folder['_id'])
+    return query
+
+
+def _isRankedByDownloads(sort):
+    """Tell if the extensions are sorted by number of downloads."""
+    return bool(sort) and sort[0][0] == EXTENSION_DOWNLOADS_SORT_KEY
+
+
+def _formatResponse(documents, responseFormat):
+    """
+    Return the ``documents`` as a list, or as a streamed newline-delimited JSON response
+    if ``responseFormat`` is "ndjson". The documents are then serialized one at a time as they
+    are read from the cursor.
+    """
+    if responseFormat != 'ndjson':
+        return list(documents)
+
+    setResponseHeader('Content-Type', 'application/x-ndjson')
+
+    def stream():
+        for doc in documents:
+            yield (json.dumps(doc, allow_nan=False, cls=JsonEncoder) + '\n').encode('utf8')
+    return stream
+
+
+def _encodeChangesToken(updated, _id):
+    """Return the token of the changes feed resuming after the document ``_id`` updated at ``updated``."""
+    return '%s_%s' % (updated.isoformat(), _id)
+
+
+def _decodeChangesToken(token):
+    """
+    Return the ``updated`` timestamp and the ID of the last document of the changes feed from
+    a token, or the timestamp and the lowest ID if the token is a plain ISO 8601 timestamp.
+    """
+    timestamp, _, _id = token.partition('_')
+    try:
+        return parseTimestamp(timestamp), ObjectId(_id) if _id else ObjectId('0' * 24)
+    except (ValueError, OverflowError, InvalidId):
+        msg = 'Invalid "since" token: %s' % token
+        raise RestException(msg)
@@ -0,0 +1,187 @@
+"""
+Content-addressed deduplication of the application and extension package binaries.
+
+The filesystem assetstores of Girder already store the binaries by ``sha512`` and only delete
+them once the last file referencing them is removed. The GridFS assetstores store the chunks of
+each upload under a new ``chunkUuid``; Girder also only deletes the chunks once the last file
+referencing the ``chunkUuid`` is removed, so sharing the chunks of an identical file is enough
+to deduplicate them.
+
+When the client declares the ``sha512`` of a file before uploading it, an identical file can be
+attached right away without transferring its content, see :func:`attachDuplicate`.
+"""
+import datetime
+import re
+
+from girder.constants import AccessType, AssetstoreType
+from girder.models.assetstore import Assetstore
+from girder.models.file import File
+from girder.models.item import Item
+from girder.utility import assetstore_utilities
+from girder_hashsum_download import SUPPORTED_ALGORITHMS
+
+#: Fields locating the stored content of a file, for the assetstores where it can be shared.
+_STORAGE_FIELDS = {
+    AssetstoreType.FILESYSTEM: ('path',),
+    AssetstoreType.GRIDFS: ('chunkUuid', 'chunkSize'),
+}
+
+_SHA512 = re.compile(r'^[0-9a-f]{128}$')
+
+
+def isSha512(value):
+    """
+    Tell if a value is a hexadecimal ``sha512`` digest.
+
+    :param value: The lowercase digest
+    :return: True if the value is valid
+    """
+    return bool(_SHA512.match(value))
+
+
+def deduplicateFile(file, upload):
+    """
+    Link a file being uploaded to the stored content of an identical file of the same
+    assetstore, and remove the newly stored copy.
+
+    This is called once the assetstore computed the ``sha512`` of the file, before the file
+    is saved.
+
+    :param file: The file document
+    :param upload: The upload document
+    :return: True if the file now shares the content of an existing file
+    """
+    if not file.get('sha512') or not file.get('size'):
+        return False
+
+    assetstore = Assetstore().load(file['assetstoreId'])
+    if assetstore['type'] != AssetstoreType.GRIDFS or 'chunkUuid' not in file:
+        # Filesystem assetstores are already content-addressed
+        return False
+
+    query = {
+        'assetstoreId': file['assetstoreId'],
+        'sha512': file['sha512'],
+        'size': file['size'],
+        'chunkUuid': {'$exists': True, '$ne': file['chunkUuid']},
+    }
+    if '_id' in file:
+        # When the content of a file is replaced, its previous chunks were already deleted
+        query['_id'] = {'$ne': file['_id']}
+    existing = File().findOne(query, fields=['chunkUuid', 'chunkSize'])
+    if existing is None:
+        return False
+
+    adapter = assetstore_utilities.getAssetstoreAdapter(assetstore)
+    adapter.chunkColl.delete_many({'uuid': upload['chunkUuid']})
+    file['chunkUuid'] = existing['chunkUuid']
+    file['chunkSize'] = existing['chunkSize']
+    return True
+
+
+def findDuplicate(assetstore, sha512, size, user):
+    """
+    Find a file of an assetstore with the given content, readable by the user.
+
+    Only the files whose stored content can be shared are considered, the imported files and
+    the files of the other assetstore types are ignored.
+
+    :param assetstore: The assetstore where the file would be uploaded
+    :param sha512: The ``sha512`` of the content
+    :param size: The size in bytes of the content
+    :param user: The user uploading the file
+    :return: The file document, or None if there is no such file
+    """
+    fields = _STORAGE_FIELDS.get(assetstore['type'])
+    if fields is None:
+        return None
+    query = {
+        'assetstoreId': assetstore['_id'],
+        'sha512': sha512,
+        'size': size,
+        'imported': {'$ne': True},
+        'itemId': {'$ne': None},
+    }
+    query.update({field: {'$exists': True} for field in fields})
+    for file in File().find(query, limit=10):
+        # Knowing the checksum of a file is not enough to read it
+        if Item().load(file['itemId'], level=AccessType.READ, user=user, exc=False) is not None:
+            return file
+    return None
+
+
+def removeFiles(files):
+    """
+    Remove files and their stored content with bulk writes, calling the assetstores once per
+    stored content.
+
+    The assetstores only delete a stored content once the last file referencing it is removed,
+    so the files sharing the content of another removed file are removed first. The content of
+    the remaining files is then deleted unless files not being removed still share it.
+
+    :param files: The file documents
+    """
+    adapters = {}
+    contents = {}
+    for file in files:
+        key = file['_id']
+        if file.get('assetstoreId'):
+            if file['assetstoreId'] not in adapters:
+                adapters[file['assetstoreId']] = assetstore_utilities.getAssetstoreAdapter(
+                    Assetstore().load(file['assetstoreId']))
+            fields = _STORAGE_FIELDS.get(adapters[file['assetstoreId']].assetstore['type'])
+            if fields is not None and all(field in file for field in fields):
+                key = (file['assetstoreId'], *(file[field] for field in fields))
+        contents.setdefault(key, file)
+
+    remaining = {file['_id'] for file in contents.values()}
+    shared = [file['_id'] for file in files if file['_id'] not in remaining]
+    if shared:
+        File().collection.delete_many({'_id': {'$in': shared}})
+    for file in contents.values():
+        if file.get('assetstoreId'):
+            adapters[file['assetstoreId']].deleteFile(file)
+    if remaining:
+        File().collection.delete_many({'_id': {'$in': list(remaining)}})
+
+
+def attachDuplicate(item, existing, duplicate, name, mimeType, user):
+    """
+    Set the file of an application or extension package item to the stored content of an
+    identical file, without uploading it.
+
+    :param item: The application or extension package item
+    :param existing: The current file of the item whose content is replaced, or None
+    :param duplicate: The file sharing its content, see :func:`findDuplicate`
+    :param name: The name of the file
+    :param mimeType: The MIME type of the file
+    :param user: The user uploading the file
+    :return: The saved file document
+    """
+    assetstore = Assetstore().load(duplicate['assetstoreId'])
+    storageFields = ('assetstoreId', *_STORAGE_FIELDS[assetstore['type']])
+    if existing is None:
+        file = File().createFile(
+            creator=user, item=item, name=name, size=duplicate['size'], assetstore=assetstore,
+            mimeType=mimeType, saveFile=False)
+    else:
+        file = existing
+        if any(file.get(field) != duplicate[field] for field in storageFields):
+            # The previous content is not the shared one
+            File().propagateSizeChange(item, duplicate['size'] - file['size'])
+            assetstore_utilities.getAssetstoreAdapter(
+                Assetstore().load(file['assetstoreId'])).deleteFile(file)
+        for field in (*SUPPORTED_ALGORITHMS, 'path', 'chunkUuid', 'chunkSize', 'imported'):
+            file.pop(field, None)
+        file.update({
+            'creatorId': user['_id'],
+            'created': datetime.datetime.utcnow(),
+            'assetstoreId': assetstore['_id'],
+            'size': duplicate['size'],
+            'name': name,
+            'mimeType': mimeType or file.get('mimeType'),
+        })
+    for field in (*SUPPORTED_ALGORITHMS, *storageFields):
+        if field in duplicate:
+            file[field] = duplicate[field]
+    return File().save(file)
@@ -0,0 +1,96 @@
+"""
+Resolution of the transitive dependencies of extensions.
+
+The ``dependency`` metadata of an extension lists the baseNames of the extensions it requires,
+separated by spaces, commas or semicolons. ``NA`` is used by Slicer when an extension has no
+dependency.
+"""
+import re
+
+_SEPARATORS = re.compile(r'[\s,;]+')
+_NO_DEPENDENCY = 'NA'
+
+
+def parseDependencies(value):
+    """
+    Split the ``dependency`` or ``recommends`` metadata of an extension.
+
+    :param value: The delimited list of baseNames, or None
+    :return: The list of baseNames, in order and without duplicates
+    """
+    if not value:
+        return []
+    names = []
+    for name in _SEPARATORS.split(value):
+        if name and name != _NO_DEPENDENCY and name not in names:
+            names.append(name)
+    return names
+
+
+def resolveDependencies(baseNames, getDependencies):
+    """
+    Resolve the transitive dependency closure of extensions.
+
+    The graph is expanded one level at a time so that ``getDependencies`` is called once per
+    level of dependencies instead of once per extension.
+
+    :param baseNames: The baseNames of the requested extensions
+    :param getDependencies: Callable taking a list of baseNames and returning a dictionary mapping
+        each baseName found to the list of baseNames it depends on
+    :return: A tuple ``(order, missing, cycles)``. ``order`` lists the resolved baseNames, each one
+        after its dependencies. ``missing`` maps the baseNames not found to the sorted list of
+        baseNames requiring them, empty for a requested extension. ``cycles`` lists the circular
+        dependencies, each one as the list of baseNames starting and ending with the same one.
+    """
+    requested = sorted(set(baseNames))
+    graph = {}
+    missing = {}
+    pending = requested
+    while pending:
+        found = getDependencies(pending)
+        for name in pending:
+            if name not in found:
+                missing[name] = []
+        graph.update(found)
+        pending = sorted({
+            dependency
+            for dependencies in found.values()
+            for dependency in dependencies
+        } - graph.keys() - missing.keys())
+
+    for name, dependencies in graph.items():
+        for dependency in dependencies:
+            if dependency in missing:
+                missing[dependency].append(name)
+    for requiredBy in missing.values():
+        requiredBy.sort()
+
+    # Depth-first post-order traversal, a dependency reached again while it is still being
+    # visited closes a cycle
+    order = []
+    cycles = []
+    visited = set()
+    path = []
+    for root in requested:
+        if root not in graph or root in visited:
+            continue
+        stack = [(root, iter(graph[root]))]
+        visited.add(root)
+        path.append(root)
+        while stack:
+            name, dependencies = stack[-1]
+            for dependency in dependencies:
+                if dependency not in graph:
+                    continue
+                if dependency in path:
+                    cycles.append([*path[path.index(dependency):], dependency])
+                elif dependency not in visited:
+                    visited.add(dependency)
+                    path.append(dependency)
+                    stack.append((dependency, iter(graph[dependency])))
+                    break
+            else:
+                stack.pop()
+                path.pop()
+                order.append(name)
+    return order, missing, cycles
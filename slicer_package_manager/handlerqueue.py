@@ -0,0 +1,184 @@
+"""
+Background execution of the event handlers of the plugin that are not needed to answer the
+request that triggered the event, such as the download statistics.
+
+When the ``slicer_package_manager.async_event_handlers`` setting is enabled, the events of the
+handlers decorated with :func:`deferrable` are put on a bounded queue and handled by a worker
+thread, so that the requests return as soon as their own work is done. A failing handler is
+retried up to :const:`MAX_ATTEMPTS` times, the handlers doing several writes that are not
+idempotent run them with :func:`runSteps` so that a retry doesn't repeat the completed writes.
+If the queue is full, the event is handled by the request, as when the setting is disabled.
+
+The number of pending events and the outcome of the handled events are exposed by the
+``GET /app/metrics`` endpoint, see :func:`metrics.renderMetrics`.
+"""
+import functools
+import queue
+import threading
+import time
+
+import cherrypy
+from girder import events, logger
+from girder.models.setting import Setting
+
+from .settings import PluginSettings
+
+#: Maximum number of events waiting to be handled.
+QUEUE_SIZE = 10000
+
+#: Number of times a handler is called before its event is dropped.
+MAX_ATTEMPTS = 3
+
+#: Delay in seconds before the first retry, doubled at each retry.
+RETRY_DELAY = 0.5
+
+#: Maximum time in seconds spent handling the queued events when the server stops.
+SHUTDOWN_TIMEOUT = 30
+
+
+class _QueuedEvent(events.Event):
+    """
+    A queued event, recording the steps of its handler completed by the failed attempts, see
+    :func:`runSteps`.
+    """
+
+    __slots__ = ('completedSteps',)
+
+    def __init__(self, name, info):
+        super().__init__(name, info)
+        self.completedSteps = set()
+
+
+class HandlerQueue:
+    """
+    A bounded queue of events handled in order by a worker thread started on first use.
+    """
+
+    def __init__(self, maxsize=QUEUE_SIZE, maxAttempts=MAX_ATTEMPTS, retryDelay=RETRY_DELAY):
+        self.maxAttempts = maxAttempts
+        self.retryDelay = retryDelay
+        self._queue = queue.Queue(maxsize)
+        self._lock = threading.Lock()
+        self._thread = None
+        self.counts = {'handled': 0, 'retried': 0, 'failed': 0, 'overflowed': 0}
+
+    @property
+    def capacity(self):
+        return self._queue.maxsize
+
+    @property
+    def pending(self):
+        """The number of events queued or being handled."""
+        return self._queue.unfinished_tasks
+
+    def put(self, handler, event):
+        """
+        Queue an event, or handle it in the calling thread if the queue is full.
+
+        :param handler: The event handler
+        :param event: The event
+        """
+        # The event info may be modified by the next handlers once the event is queued
+        event = _QueuedEvent(event.name, dict(event.info) if isinstance(event.info, dict) else event.info)
+        self._start()
+        try:
+            self._queue.put_nowait((handler, event))
+        except queue.Full:
+            self._count('overflowed')
+            handler(event)
+
+    def join(self, timeout=None):
+        """
+        Wait for the queued events to be handled.
+
+        :param timeout: The maximum time to wait in seconds, no limit if None
+        :return: Whether all the events were handled
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+
+    def _start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(
+                target=self._run, name='slicer_package_manager.handlerqueue', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            handler, event = self._queue.get()
+            try:
+                self._handle(handler, event)
+            finally:
+                self._queue.task_done()
+
+    def _handle(self, handler, event):
+        for attempt in range(self.maxAttempts):
+            try:
+                handler(event)
+            except Exception:
+                if attempt + 1 < self.maxAttempts:
+                    self._count('retried')
+                    time.sleep(self.retryDelay * 2 ** attempt)
+                    continue
+                self._count('failed')
+                logger.exception(
+                    'Event handler %s failed %d times on %s, the event is dropped',
+                    handler.__name__, self.maxAttempts, event.name)
+            else:
+                self._count('handled')
+            return
+
+    def _count(self, name):
+        with self._lock:
+            self.counts[name] += 1
+
+
+#: The queue of the deferred event handlers of the plugin.
+handlerQueue = HandlerQueue()
+
+# Handle the queued events before the server exits
+cherrypy.engine.subscribe('stop', functools.partial(handlerQueue.join, SHUTDOWN_TIMEOUT))
+
+
+def runSteps(event, steps):
+    """
+    Run the steps of an event handler, skipping the steps completed by the previous attempts of
+    :data:`handlerQueue` to handle the event.
+
+    :param event: The event being handled
+    :param steps: The callables doing the writes of the handler, in the same order at each attempt
+    """
+    completedSteps = getattr(event, 'completedSteps', None)
+    for index, step in enumerate(steps):
+        if completedSteps is not None and index in completedSteps:
+            continue
+        step()
+        if completedSteps is not None:
+            completedSteps.add(index)
+
+
+def deferrable(handler):
+    """
+    Decorate an event handler so that its events are handled by :data:`handlerQueue` when the
+    ``slicer_package_manager.async_event_handlers`` setting is enabled.
+
+    :param handler: The event handler
+    :return: The decorated handler
+    """
+
+    @functools.wraps(handler)
+    def wrapped(event):
+        if Setting().get(PluginSettings.ASYNC_EVENT_HANDLERS):
+            handlerQueue.put(handler, event)
+        else:
+            handler(event)
+
+    return wrapped
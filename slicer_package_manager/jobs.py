@@ -0,0 +1,243 @@
+"""
+Background jobs of the plugin, run by the ``jobs`` plugin on the Girder server.
+"""
+import datetime
+import time
+import traceback
+
+from girder.constants import SortDir
+from girder.models.folder import Folder
+from girder.models.item import Item
+from girder_jobs.constants import JobStatus
+from girder_jobs.models.job import Job
+
+from . import constants
+
+#: Number of items removed between two progress updates of a folder deletion or a draft pruning.
+DELETE_BATCH_SIZE = 100
+
+#: Pause in seconds between two batches of removed items, leaving room to the other requests.
+DELETE_THROTTLE = 0.05
+
+#: Fields of the draft retention policy stored in the ``draftRetention`` metadata of an application.
+RETENTION_FIELDS = ('keepRevisions', 'keepDays', 'keepDownloadedDays')
+
+
+def selectPrunedRevisions(revisions, policy, now):
+    """
+    Select the draft revisions removed by a retention policy.
+
+    A revision is kept if any rule of the policy matches, the rules being:
+
+    * ``keepRevisions``: keep the N most recently created revisions
+    * ``keepDays``: keep the revisions created within the last D days
+    * ``keepDownloadedDays``: keep the revisions with a package downloaded within the last R days
+
+    :param revisions: The revision folders of the draft release, most recent first, with the
+        ``lastDownloaded`` datetime of each revision if any
+    :param policy: The retention policy
+    :param now: The current datetime
+    :return: The list of the revision folders to remove
+    """
+    keepRevisions = policy.get('keepRevisions')
+    keepDays = policy.get('keepDays')
+    keepDownloadedDays = policy.get('keepDownloadedDays')
+
+    pruned = []
+    for index, revision in enumerate(revisions):
+        if keepRevisions is not None and index < keepRevisions:
+            continue
+        if keepDays is not None and revision['created'] > now - datetime.timedelta(days=keepDays):
+            continue
+        lastDownloaded = revision.get('lastDownloaded')
+        if keepDownloadedDays is not None and lastDownloaded is not None and \
+                lastDownloaded > now - datetime.timedelta(days=keepDownloadedDays):
+            continue
+        pruned.append(revision)
+    return pruned
+
+
+def _listDraftRevisions(application):
+    draft = Folder().findOne({
+        'parentId': application['_id'],
+        'parentCollection': 'folder',
+        'name': constants.DRAFT_RELEASE_NAME,
+    })
+    if draft is None:
+        return []
+    lastDownloaded = draft.get('meta', {}).get('lastDownloaded', {})
+    revisions = []
+    for revision in Folder().find(
+            {'parentId': draft['_id'], 'parentCollection': 'folder'},
+            sort=[('created', SortDir.DESCENDING)]):
+        revision['lastDownloaded'] = lastDownloaded.get(revision.get('meta', {}).get('revision'))
+        revisions.append(revision)
+    return revisions
+
+
+def pruneDraftRevisions(job):
+    """
+    Remove the draft revisions of an application not kept by its retention policy.
+
+    The job kwargs are the ``app_id`` of the application and ``dry_run``. With ``dry_run``, the
+    revisions are only reported with the number of items and bytes that would be reclaimed.
+    The items of the revisions are removed as by :func:`deleteFolder`, the job stops between
+    two batches if it is canceled.
+
+    :param job: The job document
+    """
+    kwargs = job['kwargs']
+    dryRun = kwargs.get('dry_run', False)
+    job = Job().updateJob(job, status=JobStatus.RUNNING, log='Started draft revisions pruning\n')
+    try:
+        application = Folder().load(kwargs['app_id'], force=True)
+        policy = application.get('meta', {}).get('draftRetention') or {}
+        if not any(policy.get(field) is not None for field in RETENTION_FIELDS):
+            # Without any rule, every revision would be removed
+            Job().updateJob(job, status=JobStatus.SUCCESS, log='No draft retention policy\n')
+            return
+        pruned = selectPrunedRevisions(
+            _listDraftRevisions(application), policy, datetime.datetime.utcnow())
+
+        report = {'dryRun': dryRun, 'revisions': [], 'items': 0, 'bytes': 0}
+        job = Job().updateJob(job, progressTotal=len(pruned), progressCurrent=0)
+        for index, revision in enumerate(pruned):
+            query = {'folderId': {'$in': _subtreeFolderIds(revision)}}
+            items, size = _countItems(query)
+            if not dryRun:
+                for removed in _removeItems(query):
+                    job = Job().updateJob(job, progressMessage='Removed %d of %d items of revision %s' % (
+                        removed, items, revision['name']))
+                    if _isCanceled(job):
+                        Job().updateJob(job, log='Canceled after %d revisions\n' % index)
+                        return
+                Folder().remove(revision)
+                if revision.get('meta', {}).get('revision'):
+                    # Forget the last download of the removed revision
+                    Folder().update(
+                        {'_id': revision['parentId']},
+                        {'$unset': {'meta.lastDownloaded.%s' % revision['meta']['revision']: ''}}, multi=False)
+            report['revisions'].append(revision['name'])
+            report['items'] += items
+            report['bytes'] += size
+            job = Job().updateJob(
+                job, progressCurrent=index + 1,
+                log='%s revision %s (%d items, %d bytes)\n' % (
+                    'Would remove' if dryRun else 'Removed', revision['name'], items, size))
+
+        Job().updateJob(
+            job, status=JobStatus.SUCCESS, otherFields={'report': report},
+            log='%s %d revisions, %d items, %d bytes\n' % (
+                'Would reclaim' if dryRun else 'Reclaimed',
+                len(report['revisions']), report['items'], report['bytes']))
+    except Exception:
+        Job().updateJob(job, status=JobStatus.ERROR, log=traceback.format_exc())
+        raise
+
+
+def scheduleFolderDeletion(folder, user, title):
+    """
+    Schedule the job removing a folder and all its content, see :func:`deleteFolder`.
+
+    :param folder: The folder to remove
+    :param user: The user removing the folder, notified of the progress of the job
+    :param title: The title of the job
+    :return: The scheduled job
+    """
+    job = Job().createLocalJob(
+        module='slicer_package_manager.jobs',
+        function='deleteFolder',
+        title=title,
+        type='slicer_package_manager.delete_folder',
+        user=user,
+        kwargs={'folder_id': str(folder['_id'])},
+        asynchronous=True)
+    Job().scheduleJob(job)
+    return job
+
+
+def _subtreeFolderIds(folder):
+    folderIds = [folder['_id']]
+    parentIds = folderIds
+    while parentIds:
+        parentIds = [child['_id'] for child in Folder().find(
+            {'parentId': {'$in': parentIds}, 'parentCollection': 'folder'}, fields=['_id'])]
+        folderIds.extend(parentIds)
+    return folderIds
+
+
+def _countItems(query):
+    """
+    Count the items matching a query and sum their size with a single aggregation.
+
+    :return: The number of items and their total size in bytes
+    """
+    totals = list(Item().collection.aggregate([
+        {'$match': query},
+        {'$group': {'_id': None, 'items': {'$sum': 1}, 'bytes': {'$sum': '$size'}}},
+    ]))
+    if not totals:
+        return 0, 0
+    return totals[0]['items'], totals[0]['bytes']
+
+
+def _removeItems(query):
+    """
+    Remove the items matching a query by batches of :const:`DELETE_BATCH_SIZE`, pausing
+    :const:`DELETE_THROTTLE` seconds between two batches.
+
+    :return: A generator of the number of items removed so far, yielded after each batch
+    """
+    removed = 0
+    while True:
+        items = list(Item().find(query, limit=DELETE_BATCH_SIZE, sort=[('_id', SortDir.ASCENDING)]))
+        if not items:
+            return
+        for item in items:
+            Item().remove(item)
+        removed += len(items)
+        yield removed
+        time.sleep(DELETE_THROTTLE)
+
+
+def _isCanceled(job):
+    return Job().load(job['_id'], force=True)['status'] == JobStatus.CANCELED
+
+
+def deleteFolder(job):
+    """
+    Remove a folder and all its content.
+
+    The items of the folder and its sub-folders are removed by batches of
+    :const:`DELETE_BATCH_SIZE`, pausing :const:`DELETE_THROTTLE` seconds between two batches.
+    The progress is sent to the user through the notifications of the job, and the job stops
+    between two batches if it is canceled. The emptied folders are removed at last.
+
+    :param job: The job document, its kwargs contain the ``folder_id`` of the folder to remove
+    """
+    job = Job().updateJob(job, status=JobStatus.RUNNING, log='Started folder deletion\n')
+    try:
+        folder = Folder().load(job['kwargs']['folder_id'], force=True)
+        if folder is None:
+            Job().updateJob(job, status=JobStatus.SUCCESS, log='The folder was already removed\n')
+            return
+        query = {'folderId': {'$in': _subtreeFolderIds(folder)}}
+        total = Item().collection.count_documents(query)
+        job = Job().updateJob(job, progressTotal=total, progressCurrent=0)
+
+        removed = 0
+        for removed in _removeItems(query):
+            job = Job().updateJob(
+                job, progressCurrent=removed,
+                progressMessage='Removed %d of %d items' % (removed, total))
+            if _isCanceled(job):
+                Job().updateJob(job, log='Canceled after %d items\n' % removed)
+                return
+
+        Folder().remove(folder)
+        Job().updateJob(
+            job, status=JobStatus.SUCCESS,
+            log='Removed folder %s and %d items\n' % (folder['name'], removed))
+    except Exception:
+        Job().updateJob(job, status=JobStatus.ERROR, log=traceback.format_exc())
+        raise
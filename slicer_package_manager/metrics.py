@@ -0,0 +1,284 @@
+"""
+Request-level instrumentation of the routes of the ``App`` resource, and of the event handlers
+of the plugin.
+
+For each route, the wall time of the requests, the number and duration of the MongoDB commands
+issued while handling them, the time spent serializing the responses and the size of the
+responses are recorded. The metrics are exposed in the Prometheus text format by the
+``GET /app/metrics`` endpoint, see :func:`renderMetrics`.
+
+The MongoDB commands are observed by a ``pymongo`` command listener and attributed to the
+request handled by the calling thread. The listener is registered when this module is imported
+and only observes the MongoDB clients created afterwards. The ``girder`` command line imports
+the plugin along with its ``synthetic-catalog`` command before ``girder serve`` connects to the
+database; a server started otherwise must import the plugin before Girder connects to the
+database, or the MongoDB commands are not counted. The requests slower than the
+``slicer_package_manager.slow_request_threshold`` setting are logged.
+
+The event handlers run synchronously on every matching Girder model event, most of them
+unrelated to the packages. Their invocations, early exits and latency are also exposed, see
+:func:`instrumentHandler`, as well as the backlog of the handlers run in the background, see
+:mod:`handlerqueue`.
+"""
+import functools
+import threading
+import time
+
+import cherrypy
+from girder import logger
+from girder.models.setting import Setting
+from pymongo import monitoring
+
+from .handlerqueue import handlerQueue
+from .settings import PluginSettings
+
+#: Upper bounds in seconds of the buckets of the request duration histogram.
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+#: Upper bounds in seconds of the buckets of the event handler duration histogram.
+HANDLER_DURATION_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+_PREFIX = 'slicer_package_manager'
+
+_lock = threading.Lock()
+_routes = {}
+_handlers = {}
+_local = threading.local()
+
+
+class _RouteMetrics:
+    def __init__(self):
+        self.buckets = [0] * len(DURATION_BUCKETS)
+        self.count = 0
+        self.duration = 0.0
+        self.mongoOperations = 0
+        self.mongoDuration = 0.0
+        self.serializationDuration = 0.0
+        self.responseBytes = 0
+
+
+class _HandlerMetrics:
+    def __init__(self):
+        self.buckets = [0] * len(HANDLER_DURATION_BUCKETS)
+        self.count = 0
+        self.duration = 0.0
+        self.skipped = 0
+
+
+class _Request:
+    def __init__(self, method, route):
+        self.method = method
+        self.route = route
+        self.start = time.perf_counter()
+        self.handled = None
+        self.streamed = False
+        self.finished = False
+        self.mongoOperations = 0
+        self.mongoDuration = 0.0
+        self.responseBytes = 0
+
+
+class _CommandListener(monitoring.CommandListener):
+    """
+    Count the MongoDB commands issued by the request handled by the calling thread.
+    """
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self._record(event)
+
+    def failed(self, event):
+        self._record(event)
+
+    def _record(self, event):
+        request = getattr(_local, 'request', None)
+        if request is not None:
+            request.mongoOperations += 1
+            request.mongoDuration += event.duration_micros / 1e6
+
+
+_listener = _CommandListener()
+monitoring.register(_listener)
+
+
+def instrumentRoute(method, route, handler):
+    """
+    Wrap a route handler so that the metrics of its requests are recorded.
+
+    :param method: The HTTP method of the route
+    :param route: The path of the route, as a tuple of tokens starting with the resource name
+    :param handler: The route handler
+    :return: The wrapped handler
+    """
+    path = '/' + '/'.join(route)
+
+    @functools.wraps(handler)
+    def wrapped(*args, **kwargs):
+        request = _Request(method, path)
+        _local.request = request
+        # Girder serializes the response once the handler returned, the request is recorded
+        # right before the response is finalized
+        cherrypy.request.hooks.attach('before_finalize', functools.partial(_onBeforeFinalize, request))
+        cherrypy.request.hooks.attach('on_end_request', functools.partial(_onEndRequest, request))
+        try:
+            result = handler(*args, **kwargs)
+        finally:
+            request.handled = time.perf_counter()
+        if callable(result):
+            request.streamed = True
+            return _recordStream(request, result)
+        return result
+
+    return wrapped
+
+
+def instrumentHandler(handler):
+    """
+    Decorate an event handler so that its invocations are recorded per event.
+
+    The handler returns False when it exits early because the event is not related to the
+    plugin, these invocations are also counted apart.
+
+    :param handler: The event handler
+    :return: The decorated handler
+    """
+    name = handler.__name__
+
+    @functools.wraps(handler)
+    def wrapped(event):
+        start = time.perf_counter()
+        skipped = False
+        try:
+            skipped = handler(event) is False
+        finally:
+            duration = time.perf_counter() - start
+            with _lock:
+                metrics = _handlers.setdefault((name, event.name), _HandlerMetrics())
+                _observe(metrics, HANDLER_DURATION_BUCKETS, duration)
+                metrics.skipped += skipped
+
+    return wrapped
+
+
+def _observe(metrics, buckets, duration):
+    for index, bound in enumerate(buckets):
+        if duration <= bound:
+            metrics.buckets[index] += 1
+    metrics.count += 1
+    metrics.duration += duration
+
+
+def _recordStream(request, stream):
+    def wrapped():
+        try:
+            for chunk in stream():
+                request.responseBytes += len(chunk.encode('utf8') if isinstance(chunk, str) else chunk)
+                yield chunk
+        finally:
+            _finish(request)
+
+    return wrapped
+
+
+def _onBeforeFinalize(request):
+    if request.streamed:
+        # Recorded once the response is streamed
+        return
+    body = cherrypy.response.body
+    if isinstance(body, list):
+        request.responseBytes = sum(len(chunk) for chunk in body)
+    _finish(request)
+
+
+def _onEndRequest(request):
+    # A streamed response abandoned by the client is never recorded, the next requests of the
+    # thread must not be attributed to it
+    if getattr(_local, 'request', None) is request:
+        _local.request = None
+
+
+def _finish(request):
+    if request.finished:
+        return
+    request.finished = True
+    if getattr(_local, 'request', None) is request:
+        _local.request = None
+
+    end = time.perf_counter()
+    duration = end - request.start
+    serialization = end - request.handled if request.handled is not None else 0.0
+    with _lock:
+        metrics = _routes.setdefault((request.route, request.method), _RouteMetrics())
+        _observe(metrics, DURATION_BUCKETS, duration)
+        metrics.mongoOperations += request.mongoOperations
+        metrics.mongoDuration += request.mongoDuration
+        metrics.serializationDuration += serialization
+        metrics.responseBytes += request.responseBytes
+
+    threshold = Setting().get(PluginSettings.SLOW_REQUEST_THRESHOLD)
+    if threshold and duration >= threshold:
+        logger.warning(
+            'Slow request %s %s: %.3fs, %d MongoDB operations (%.3fs), serialization %.3fs, %d bytes',
+            request.method, request.route, duration, request.mongoOperations, request.mongoDuration,
+            serialization, request.responseBytes)
+
+
+def renderMetrics():
+    """
+    Render the metrics of the routes and of the event handlers in the Prometheus text
+    exposition format.
+
+    :return: The metrics as text
+    """
+    with _lock:
+        routes = sorted(
+            ('method="%s",route="%s"' % (method, route), vars(metrics).copy())
+            for (route, method), metrics in _routes.items())
+        handlers = sorted(
+            ('handler="%s",event="%s"' % key, vars(metrics).copy()) for key, metrics in _handlers.items())
+
+    lines = []
+
+    def _histogram(name, description, buckets, samples):
+        name = '%s_%s' % (_PREFIX, name)
+        lines.append('# HELP %s %s' % (name, description))
+        lines.append('# TYPE %s histogram' % name)
+        for labels, metrics in samples:
+            for bound, count in zip(buckets, metrics['buckets']):
+                lines.append('%s_bucket{%s,le="%s"} %d' % (name, labels, bound, count))
+            lines.append('%s_bucket{%s,le="+Inf"} %d' % (name, labels, metrics['count']))
+            lines.append('%s_sum{%s} %s' % (name, labels, metrics['duration']))
+            lines.append('%s_count{%s} %d' % (name, labels, metrics['count']))
+
+    def _counter(name, description, field, samples):
+        name = '%s_%s' % (_PREFIX, name)
+        lines.append('# HELP %s %s' % (name, description))
+        lines.append('# TYPE %s counter' % name)
+        for labels, metrics in samples:
+            lines.append('%s{%s} %s' % (name, labels, metrics[field]))
+
+    _histogram('request_duration_seconds', 'Wall time of the requests.', DURATION_BUCKETS, routes)
+    _counter('mongo_operations_total', 'MongoDB commands issued by the requests.', 'mongoOperations', routes)
+    _counter('mongo_duration_seconds_total', 'Time spent in the MongoDB commands.', 'mongoDuration', routes)
+    _counter('serialization_duration_seconds_total', 'Time spent serializing or streaming the responses.',
+             'serializationDuration', routes)
+    _counter('response_bytes_total', 'Size of the response bodies.', 'responseBytes', routes)
+    _histogram('event_handler_duration_seconds', 'Time spent in the event handlers.',
+               HANDLER_DURATION_BUCKETS, handlers)
+    _counter('event_handler_skipped_total', 'Events ignored by the handlers as not related to the plugin.',
+             'skipped', handlers)
+
+    queueName = '%s_event_queue' % _PREFIX
+    lines.append('# HELP %s_pending Events waiting to be handled in the background.' % queueName)
+    lines.append('# TYPE %s_pending gauge' % queueName)
+    lines.append('%s_pending %d' % (queueName, handlerQueue.pending))
+    lines.append('# HELP %s_capacity Maximum number of events waiting to be handled.' % queueName)
+    lines.append('# TYPE %s_capacity gauge' % queueName)
+    lines.append('%s_capacity %d' % (queueName, handlerQueue.capacity))
+    lines.append('# HELP %s_events_total Events handled in the background, per outcome.' % queueName)
+    lines.append('# TYPE %s_events_total counter' % queueName)
+    for outcome, count in sorted(handlerQueue.counts.items()):
+        lines.append('%s_events_total{outcome="%s"} %d' % (queueName, outcome, count))
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,92 @@
+from girder.models.model_base import Model, ValidationException
+
+from ..dependencies import parseDependencies
+
+KIND_DEPENDENCY = 'dependency'
+KIND_RECOMMENDS = 'recommends'
+KINDS = (KIND_DEPENDENCY, KIND_RECOMMENDS)
+
+
+class Dependency(Model):
+    """
+    The ``Dependency`` model stores one edge per extension listed in the ``dependency`` or
+    ``recommends`` metadata of an extension, so that both the extensions required by an extension
+    and the extensions requiring it are indexed lookups.
+
+    The edges are kept in sync with the extension items by the ``model.item`` event handlers
+    of the plugin.
+    """
+
+    def initialize(self):
+        self.name = 'slicer_package_manager_dependency'
+        self.ensureIndices([
+            'itemId',
+            ([('app_id', 1), ('app_revision', 1), ('from_baseName', 1), ('kind', 1)], {}),
+            ([('app_id', 1), ('app_revision', 1), ('to_baseName', 1), ('kind', 1)], {}),
+        ])
+
+    def updateEdges(self, extension):
+        """
+        Synchronize the edges of an extension with its ``dependency`` and ``recommends``
+        metadata. Only the edges that changed are written.
+
+        :param extension: The extension item
+        """
+        meta = extension['meta']
+        expected = {
+            (kind, name)
+            for kind in KINDS
+            for name in parseDependencies(meta.get(kind))
+        }
+        stale = []
+        for edge in self.find({'itemId': extension['_id']}, fields=['kind', 'to_baseName', 'from_baseName']):
+            key = (edge['kind'], edge['to_baseName'])
+            if key in expected and edge['from_baseName'] == meta['baseName']:
+                expected.discard(key)
+            else:
+                stale.append(edge['_id'])
+        if stale:
+            self.removeWithQuery({'_id': {'$in': stale}})
+        for kind, name in sorted(expected):
+            self.save({
+                'itemId': extension['_id'],
+                'app_id': meta['app_id'],
+                'app_revision': meta['app_revision'],
+                'os': meta['os'],
+                'arch': meta['arch'],
+                'from_baseName': meta['baseName'],
+                'to_baseName': name,
+                'kind': kind,
+            })
+
+    def removeEdges(self, extension):
+        """
+        Remove the edges of an extension.
+
+        :param extension: The extension item
+        """
+        self.removeWithQuery({'itemId': extension['_id']})
+
+    def removeManyEdges(self, extensions):
+        """
+        Remove the edges of several extensions at once.
+
+        :param extensions: The extension items
+        """
+        self.removeWithQuery({'itemId': {'$in': [extension['_id'] for extension in extensions]}})
+
+    def validate(self, doc):
+        """
+        Validate the dependency instance.
+
+        :param doc: The dependency instance
+        :return: The dependency instance once validated
+        """
+        if doc.get('kind') not in KINDS:
+            msg = 'Dependency field "kind" must be one of %s.' % ', '.join(KINDS)
+            raise ValidationException(msg)
+        for field in ('from_baseName', 'to_baseName'):
+            if not isinstance(doc.get(field), str) or not doc[field]:
+                msg = f'Dependency field "{field}" must be a non-empty string.'
+                raise ValidationException(msg)
+        return doc
@@ -0,0 +1,113 @@
+import datetime
+
+from girder.models.model_base import Model, ValidationException
+
+TYPE_APPLICATION = 'application'
+TYPE_EXTENSION = 'extension'
+TYPES = (TYPE_APPLICATION, TYPE_EXTENSION)
+
+
+class DownloadCount(Model):
+    """
+    The ``DownloadCount`` model stores the number of downloads of the application and extension
+    packages per release, revision, platform and day, so that the download statistics can be
+    filtered and aggregated by MongoDB.
+
+    The counts of the downloads that happened before the counts were recorded per day have no
+    ``day``.
+    """
+
+    def initialize(self):
+        self.name = 'slicer_package_manager_download_count'
+        self.ensureIndices([
+            ([('app_id', 1), ('releaseId', 1), ('revision', 1), ('type', 1), ('baseName', 1),
+              ('os', 1), ('arch', 1), ('day', 1)], {'unique': True}),
+            ([('app_id', 1), ('day', 1)], {}),
+            ([('app_id', 1), ('baseName', 1)], {}),
+        ])
+
+    def recordDownload(self, item, release, when):
+        """
+        Increment the download count of a package for the day of a download.
+
+        :param item: The application or extension package item
+        :param release: The release folder containing the package
+        :param when: The datetime of the download
+        """
+        meta = item['meta']
+        isExtension = 'app_revision' in meta
+        key = {
+            'app_id': meta['app_id'],
+            'releaseId': release['_id'],
+            'revision': meta['app_revision'] if isExtension else meta['revision'],
+            'type': TYPE_EXTENSION if isExtension else TYPE_APPLICATION,
+            'baseName': meta['baseName'] if isExtension else None,
+            'os': meta['os'],
+            'arch': meta['arch'],
+            'day': datetime.datetime(when.year, when.month, when.day),
+        }
+        self.collection.update_one(key, {'$inc': {'count': 1}}, upsert=True)
+
+    def getStatistics(self, query, top=None):
+        """
+        Aggregate the download counts matching a query.
+
+        :param query: The query selecting the download counts
+        :param top: If set, the number of most downloaded packages to return instead of the
+            statistics per revision and platform
+        :return: A document with the ``totals`` of downloads of the ``applications``, of the
+            ``extensions`` and of both as ``downloads``. It also contains either the
+            ``downloadStats`` organized as the ``downloadStats`` metadata of the draft release,
+            or the ``top`` list of ``type``, ``baseName`` and ``downloads`` of the most
+            downloaded packages.
+        """
+        facets = {'totals': [{'$group': {'_id': '$type', 'downloads': {'$sum': '$count'}}}]}
+        if top is not None:
+            facets['top'] = [
+                {'$group': {'_id': {'type': '$type', 'baseName': '$baseName'}, 'downloads': {'$sum': '$count'}}},
+                {'$sort': {'downloads': -1, '_id.type': 1, '_id.baseName': 1}},
+                {'$limit': top},
+            ]
+        else:
+            facets['stats'] = [{'$group': {
+                '_id': {'revision': '$revision', 'type': '$type', 'baseName': '$baseName', 'os': '$os',
+                        'arch': '$arch'},
+                'downloads': {'$sum': '$count'},
+            }}]
+        result = next(self.collection.aggregate([{'$match': query}, {'$facet': facets}]))
+
+        totals = {'applications': 0, 'extensions': 0}
+        for group in result['totals']:
+            totals['applications' if group['_id'] == TYPE_APPLICATION else 'extensions'] = group['downloads']
+        totals['downloads'] = totals['applications'] + totals['extensions']
+        if top is not None:
+            return {'totals': totals, 'top': [
+                {'type': group['_id']['type'], 'baseName': group['_id'].get('baseName'),
+                 'downloads': group['downloads']}
+                for group in result['top']]}
+
+        stats = {}
+        for group in result['stats']:
+            key = group['_id']
+            revisionStats = stats.setdefault(key['revision'], {})
+            if key['type'] == TYPE_APPLICATION:
+                platforms = revisionStats.setdefault('applications', {})
+            else:
+                platforms = revisionStats.setdefault('extensions', {}).setdefault(key['baseName'], {})
+            platforms.setdefault(key['os'], {})[key['arch']] = group['downloads']
+        return {'totals': totals, 'downloadStats': stats}
+
+    def validate(self, doc):
+        """
+        Validate the download count instance.
+
+        :param doc: The download count instance
+        :return: The download count instance once validated
+        """
+        if doc.get('type') not in TYPES:
+            msg = 'Download count field "type" must be one of %s.' % ', '.join(TYPES)
+            raise ValidationException(msg)
+        if not isinstance(doc.get('count'), int) or doc['count'] < 0:
+            msg = 'Download count field "count" must be a non-negative integer.'
+            raise ValidationException(msg)
+        return doc
@@ -0,0 +1,69 @@
+from girder.models.model_base import Model, ValidationException
+
+#: Value of the ``sort`` parameter ranking the extensions by number of downloads.
+SORT_KEY = 'downloads'
+
+#: Field holding the number of downloads of an extension while it is ranked.
+COUNT_FIELD = '_downloads'
+
+
+class ExtensionDownloads(Model):
+    """
+    The ``ExtensionDownloads`` model stores the number of downloads of the packages of each
+    extension of an application, all revisions and platforms included, so that the extensions
+    can be ranked by popularity.
+    """
+
+    def initialize(self):
+        self.name = 'slicer_package_manager_extension_downloads'
+        self.ensureIndices([
+            ([('baseName', 1), ('app_id', 1)], {'unique': True}),
+        ])
+
+    def incrementDownloads(self, app_id, baseName, amount=1):
+        """
+        Increment the number of downloads of an extension.
+
+        :param app_id: The ID of the application
+        :param baseName: The baseName of the extension
+        :param amount: The number of downloads to add
+        """
+        self.collection.update_one(
+            {'app_id': app_id, 'baseName': baseName}, {'$inc': {'count': amount}}, upsert=True)
+
+    def rankingStages(self, app_id, sortDir):
+        """
+        Build the aggregation stages adding the number of downloads of the extension items of an
+        application, and the sort ranking them.
+
+        :param app_id: The ID of the application
+        :param sortDir: The direction of the ranking
+        :return: The list of stages to insert in a pipeline matching the extension items, and
+            the sort of the ranking
+        """
+        # Only the count of the application is looked up, using the unique index
+        stages = [
+            {'$lookup': {
+                'from': self.name,
+                'let': {'baseName': '$meta.baseName'},
+                'pipeline': [
+                    {'$match': {'app_id': app_id, '$expr': {'$eq': ['$baseName', '$$baseName']}}},
+                    {'$project': {'_id': 0, 'count': 1}},
+                ],
+                'as': COUNT_FIELD,
+            }},
+            {'$addFields': {COUNT_FIELD: {'$sum': '$%s.count' % COUNT_FIELD}}},
+        ]
+        return stages, [(COUNT_FIELD, sortDir), ('_id', 1)]
+
+    def validate(self, doc):
+        """
+        Validate the extension downloads instance.
+
+        :param doc: The extension downloads instance
+        :return: The extension downloads instance once validated
+        """
+        if not isinstance(doc.get('baseName'), str) or not doc['baseName']:
+            msg = 'Extension downloads field "baseName" must be a non-empty string.'
+            raise ValidationException(msg)
+        return doc
@@ -3,6 +3,7 @@ import datetime
 from girder.models.folder import Folder
 from girder.models.item import Item
 from girder.models.model_base import ValidationException
+from girder.utility._cache import cache
 
 
 class Package(Item):
@@ -50,6 +51,55 @@ class Package(Item):
         )
         return self.setMetadata(item, params)
 
+    def getLatestPackages(self, app_id):
+        """
+        Get the most recently created application package of each ``os``, ``arch`` and
+        ``pre_release`` combination.
+
+        The result of the aggregation is stored in the Girder cache until an application package
+        of the application is saved or removed, see :meth:`invalidateLatestPackages`.
+
+        :param app_id: The ID of the application
+        :return: A list of documents with the ``os``, ``arch``, ``pre_release`` and ``package``
+            fields, sorted by ``os``, ``arch`` and ``pre_release``
+        """
+        return cache.get_or_create(
+            _latestPackagesCacheKey(app_id), lambda: self._aggregateLatestPackages(app_id))
+
+    def invalidateLatestPackages(self, app_id):
+        """
+        Remove from the Girder cache the latest application packages of an application.
+
+        :param app_id: The ID of the application
+        """
+        cache.delete(_latestPackagesCacheKey(app_id))
+
+    def _aggregateLatestPackages(self, app_id):
+        pipeline = [
+            {'$match': {
+                'meta.app_id': app_id,
+                'meta.os': {'$exists': True},
+                'meta.arch': {'$exists': True},
+                'meta.revision': {'$exists': True},
+                'meta.app_revision': {'$exists': False},
+            }},
+            {'$sort': {'created': -1, '_id': -1}},
+            {'$group': {
+                '_id': {
+                    'os': '$meta.os',
+                    'arch': '$meta.arch',
+                    # Packages uploaded without "pre_release" are not pre-releases
+                    'pre_release': {'$ifNull': ['$meta.pre_release', False]},
+                },
+                'package': {'$first': '$$ROOT'},
+            }},
+            {'$sort': {'_id.os': 1, '_id.arch': 1, '_id.pre_release': 1}},
+        ]
+        return [
+            dict(latest['_id'], package=latest['package'])
+            for latest in self.collection.aggregate(pipeline)
+        ]
+
     def validate(self, doc):
         """
         Validate the package instance.
@@ -105,3 +155,7 @@ class Package(Item):
                 msg = 'A Package with this name and characteristics already exists.'
                 raise ValidationException(msg)
         return doc
+
+
+def _latestPackagesCacheKey(app_id):
+    return 'slicer_package_manager.latest_packages.%s' % app_id
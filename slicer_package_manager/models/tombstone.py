@@ -0,0 +1,70 @@
+import datetime
+
+from girder.models.model_base import Model, ValidationException
+
+#: Time during which the tombstones are kept. The changes feed rejects the older tokens since
+#: the deletions that happened after them may have expired.
+RETENTION = datetime.timedelta(days=90)
+
+
+class Tombstone(Model):
+    """
+    The ``Tombstone`` model records the application and extension packages that were deleted,
+    so that the changes feed of an application can report the deletions. Tombstones are
+    removed by MongoDB once they are older than :const:`RETENTION`.
+    """
+
+    def initialize(self):
+        self.name = 'slicer_package_manager_tombstone'
+        self.ensureIndices([
+            ([('app_id', 1), ('updated', 1), ('_id', 1)], {}),
+            ([('updated', 1)], {'expireAfterSeconds': int(RETENTION.total_seconds())}),
+        ])
+
+    def createTombstone(self, item):
+        """
+        Create and save in the DB the tombstone of a deleted package.
+
+        :param item: The application or extension package item being deleted
+        :return: The new tombstone
+        """
+        return self.save(_tombstone(item, datetime.datetime.utcnow()))
+
+    def createTombstones(self, items):
+        """
+        Create and save in the DB the tombstones of deleted packages at once, without validation.
+
+        :param items: The application or extension package items being deleted
+        """
+        now = datetime.datetime.utcnow()
+        if items:
+            self.collection.insert_many([_tombstone(item, now) for item in items])
+
+    def validate(self, doc):
+        """
+        Validate the tombstone instance.
+
+        :param doc: The tombstone instance
+        :return: The tombstone instance once validated
+        """
+        if not isinstance(doc.get('updated'), datetime.datetime):
+            msg = 'Tombstone field "updated" must be a datetime.'
+            raise ValidationException(msg)
+        return doc
+
+
+def _tombstone(item, updated):
+    meta = item['meta']
+    return {
+        'itemId': item['_id'],
+        'app_id': meta['app_id'],
+        'type': 'extension' if 'app_revision' in meta else 'package',
+        'name': item['name'],
+        'folderId': item['folderId'],
+        'meta': {
+            key: meta[key]
+            for key in ('baseName', 'os', 'arch', 'revision', 'app_revision')
+            if key in meta
+        },
+        'updated': updated,
+    }
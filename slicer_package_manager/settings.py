@@ -0,0 +1,58 @@
+from girder.exceptions import ValidationException
+from girder.utility import setting_utilities
+
+
+class PluginSettings:
+    SLOW_REQUEST_THRESHOLD = 'slicer_package_manager.slow_request_threshold'
+    ASYNC_EVENT_HANDLERS = 'slicer_package_manager.async_event_handlers'
+    DEPENDENCIES_BACKFILLED = 'slicer_package_manager.dependencies_backfilled'
+    DOWNLOAD_COUNTS_BACKFILLED = 'slicer_package_manager.download_counts_backfilled'
+    EXTENSION_DOWNLOADS_BACKFILLED = 'slicer_package_manager.extension_downloads_backfilled'
+
+
+@setting_utilities.default(PluginSettings.SLOW_REQUEST_THRESHOLD)
+def _defaultSlowRequestThreshold():
+    return 0
+
+
+@setting_utilities.validator(PluginSettings.SLOW_REQUEST_THRESHOLD)
+def _validateSlowRequestThreshold(doc):
+    try:
+        doc['value'] = float(doc['value'])
+    except (TypeError, ValueError):
+        doc['value'] = -1
+    if doc['value'] < 0:
+        msg = 'Slow request threshold must be a number of seconds, 0 to disable the slow request log.'
+        raise ValidationException(msg, 'value')
+
+
+@setting_utilities.default(PluginSettings.ASYNC_EVENT_HANDLERS)
+def _defaultAsyncEventHandlers():
+    return False
+
+
+@setting_utilities.validator(PluginSettings.ASYNC_EVENT_HANDLERS)
+def _validateAsyncEventHandlers(doc):
+    if not isinstance(doc['value'], bool):
+        msg = 'Asynchronous event handlers setting must be a boolean.'
+        raise ValidationException(msg, 'value')
+
+
+@setting_utilities.default({
+    PluginSettings.DEPENDENCIES_BACKFILLED,
+    PluginSettings.DOWNLOAD_COUNTS_BACKFILLED,
+    PluginSettings.EXTENSION_DOWNLOADS_BACKFILLED,
+})
+def _defaultBackfilled():
+    return False
+
+
+@setting_utilities.validator({
+    PluginSettings.DEPENDENCIES_BACKFILLED,
+    PluginSettings.DOWNLOAD_COUNTS_BACKFILLED,
+    PluginSettings.EXTENSION_DOWNLOADS_BACKFILLED,
+})
+def _validateBackfilled(doc):
+    if not isinstance(doc['value'], bool):
+        msg = 'Backfill completion setting must be a boolean.'
+        raise ValidationException(msg, 'value')
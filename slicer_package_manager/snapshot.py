@@ -0,0 +1,154 @@
+"""
+Compact columnar snapshot of the extension catalog.
+
+A snapshot stores one row per extension and one column per metadata field. Every value is
+stored as the index of a string in a sorted table of unique strings, so that repeated values
+such as ``os``, ``arch`` or ``category`` are stored once. The uncompressed layout can be
+memory-mapped and filtered without any parsing, all the integers being unsigned 32 bits
+little-endian::
+
+    magic       8 bytes, ``SPMSNAP1``
+    rowCount    uint32
+    columnCount uint32
+    columns     columnCount x uint32, index of the name of each column in the string table
+    values      columnCount x rowCount x uint32, column after column, ``0xFFFFFFFF`` if unset
+    stringCount uint32
+    offsets     (stringCount + 1) x uint32, offset of each string relative to the strings
+    strings     UTF-8 encoded strings, sorted
+
+The snapshot is sent compressed with either gzip or zstd.
+"""
+import array
+import sys
+import zlib
+
+from girder.exceptions import RestException
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+MAGIC = b'SPMSNAP1'
+NULL = 0xFFFFFFFF
+
+COMPRESSION_GZIP = 'gzip'
+COMPRESSION_ZSTD = 'zstd'
+
+#: Columns of the snapshot, top-level item fields followed by the extension metadata.
+ITEM_COLUMNS = ('_id', 'name', 'created', 'size')
+META_COLUMNS = (
+    'baseName',
+    'os',
+    'arch',
+    'revision',
+    'app_revision',
+    'repository_type',
+    'repository_url',
+    'description',
+    'icon_url',
+    'development_status',
+    'category',
+    'tier',
+    'enabled',
+    'homepage',
+    'screenshots',
+    'contributors',
+    'dependency',
+    'recommends',
+    'license',
+    'dicom_support_rule',
+    'keywords',
+    'sha512',
+)
+COLUMNS = ITEM_COLUMNS + META_COLUMNS
+
+_CHUNK_SIZE = 65536
+
+
+def _uint32Array(values):
+    values = array.array('I', values)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values.tobytes()
+
+
+def _toString(value):
+    if value is None:
+        return None
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return str(value)
+
+
+def buildSnapshot(extensions):
+    """
+    Build the uncompressed snapshot of the extensions.
+
+    :param extensions: Iterable of extension documents.
+    :return: The snapshot as bytes.
+    """
+    strings = {}
+    columns = [[] for _ in COLUMNS]
+    rowCount = 0
+    for extension in extensions:
+        meta = extension.get('meta', {})
+        values = [extension.get(key) for key in ITEM_COLUMNS] + [meta.get(key) for key in META_COLUMNS]
+        for column, value in zip(columns, map(_toString, values)):
+            if value is not None:
+                strings.setdefault(value, None)
+            column.append(value)
+        rowCount += 1
+    for name in COLUMNS:
+        strings.setdefault(name, None)
+
+    # Sort the string table so that readers can look a value up with a binary search
+    table = sorted(strings)
+    indices = {value: index for index, value in enumerate(table)}
+    encoded = [value.encode('utf8') for value in table]
+    offsets = [0]
+    for value in encoded:
+        offsets.append(offsets[-1] + len(value))
+
+    parts = [
+        MAGIC,
+        _uint32Array([rowCount, len(COLUMNS)]),
+        _uint32Array([indices[name] for name in COLUMNS]),
+    ]
+    parts.extend(
+        _uint32Array([NULL if value is None else indices[value] for value in column])
+        for column in columns)
+    parts.extend([
+        _uint32Array([len(table)]),
+        _uint32Array(offsets),
+        b''.join(encoded),
+    ])
+    return b''.join(parts)
+
+
+def compressSnapshot(snapshot, compression=COMPRESSION_GZIP):
+    """
+    Compress the snapshot.
+
+    :param snapshot: The uncompressed snapshot.
+    :param compression: Either ``gzip`` or ``zstd``, the latter requires the ``zstandard`` package.
+    :return: Generator of the compressed chunks.
+    """
+    if compression == COMPRESSION_ZSTD:
+        if zstandard is None:
+            msg = 'The zstd compression requires the "zstandard" package on the server.'
+            raise RestException(msg)
+        compressor = zstandard.ZstdCompressor().compressobj()
+    else:
+        compressor = zlib.compressobj(9, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+
+    return _compressChunks(compressor, snapshot)
+
+
+def _compressChunks(compressor, snapshot):
+    view = memoryview(snapshot)
+    for start in range(0, len(view), _CHUNK_SIZE):
+        chunk = compressor.compress(view[start:start + _CHUNK_SIZE])
+        if chunk:
+            yield chunk
+    yield compressor.flush()
@@ -0,0 +1,377 @@
+"""
+Synthetic catalogs shaped like the catalog of a Slicer package server, used to benchmark and
+load-test the plugin.
+
+The release and revision folders, and the application and extension package items, are inserted
+in bulk through the collections of the Girder models. The validation and the events of the
+models are bypassed, so the ``release`` metadata of the packages and the dependency edges of
+the extensions are inserted along with them.
+
+The packages can be given a dummy binary: a single file is uploaded to the assetstore, and the
+files of the packages share its stored content as the deduplicated files do, see
+:mod:`slicer_package_manager.deduplication`. The ``girder synthetic-catalog`` command populates
+a Girder instance, see :func:`main`.
+"""
+import datetime
+import io
+import random
+import time
+
+import cherrypy
+import click
+from bson.objectid import ObjectId
+from girder.constants import AccessType
+from girder.models.collection import Collection
+from girder.models.file import File
+from girder.models.folder import Folder
+from girder.models.item import Item
+from girder.models.upload import Upload
+from girder.models.user import User
+from girder.utility.model_importer import ModelImporter
+
+from . import constants
+from .dependencies import parseDependencies
+from .models.dependency import KIND_DEPENDENCY, KIND_RECOMMENDS, Dependency
+
+OPERATING_SYSTEMS = ('linux', 'macosx', 'win')
+ARCHITECTURES = ('amd64', 'i386')
+
+CATEGORIES = (
+    'Segmentation', 'Registration', 'Quantification', 'Diffusion', 'IGT', 'Informatics', 'Utilities',
+    'Examples', 'Developer Tools', 'Filtering', 'Radiotherapy', 'Cardiac', 'Microscopy',
+)
+KEYWORDS = (
+    'mri', 'ct', 'ultrasound', 'dicom', 'segmentation', 'registration', 'ai', 'deep learning',
+    'surgery', 'planning', 'python', 'visualization', 'rendering', 'tracking', 'volume',
+)
+
+#: Number of documents inserted at once.
+BATCH_SIZE = 10000
+
+#: First revision of the synthetic application, the revisions are consecutive numbers.
+FIRST_REVISION = 30000
+
+#: Name of the item holding the dummy binary shared by the packages of an application.
+BINARY_ITEM_NAME = 'synthetic-binary'
+
+
+def createApplication(user, name, collectionName='Applications', public=True):
+    """
+    Create an application folder with its draft release, as done by ``POST /app``.
+
+    :param user: The creator of the application
+    :param name: The name of the application
+    :param collectionName: The name of the collection containing the application
+    :param public: Whether the application is public
+    :return: The application folder
+    """
+    collection = Collection().createCollection(
+        collectionName, creator=user, public=public, reuseExisting=True)
+    packagesFolder = Folder().createFolder(
+        collection, constants.TOP_LEVEL_FOLDER_NAME, parentType='collection', public=public,
+        creator=user, reuseExisting=True)
+    application = Folder().createFolder(
+        packagesFolder, name, parentType='folder', public=public, creator=user)
+    Folder().createFolder(
+        application, constants.DRAFT_RELEASE_NAME, description='Uploaded each night, always up-to-date',
+        parentType='folder', public=public, creator=user)
+    return Folder().setMetadata(application, {
+        'applicationPackageNameTemplate': constants.APPLICATION_PACKAGE_TEMPLATE_NAME,
+        'extensionPackageNameTemplate': constants.EXTENSION_PACKAGE_TEMPLATE_NAME,
+    })
+
+
+def extensionMetadata(rng, index, count):
+    """
+    Build the metadata shared by all the packages of a synthetic extension.
+
+    The tiers, categories and keywords follow skewed distributions, and each extension depends
+    on a few extensions of lower index so that the dependency graph is acyclic.
+
+    :param rng: The ``random.Random`` generator
+    :param index: The index of the extension
+    :param count: The number of extensions of the catalog
+    :return: The metadata, without the revision and platform fields
+    """
+    baseName = 'SyntheticExtension%04d' % index
+    dependencies = sorted({
+        'SyntheticExtension%04d' % rng.randrange(index)
+        for _ in range(min(index, int(rng.paretovariate(2)) - 1))
+    })
+    meta = {
+        'baseName': baseName,
+        'repository_type': 'git',
+        'repository_url': 'https://github.com/Slicer/%s.git' % baseName,
+        'description': 'Synthetic extension %d of %d. %s' % (
+            index, count, ' '.join(rng.choice(KEYWORDS) for _ in range(rng.randint(5, 40)))),
+        'category': rng.choice(CATEGORIES),
+        'tier': rng.choices((1, 3, 5), weights=(5, 3, 2))[0],
+        'homepage': 'https://www.slicer.org/wiki/Documentation/Nightly/Extensions/%s' % baseName,
+        'icon_url': 'https://raw.githubusercontent.com/Slicer/%s/main/icon.png' % baseName,
+        'contributors': 'Synthetic Contributor (Kitware)',
+        'keywords': ' '.join(rng.sample(KEYWORDS, rng.randint(1, 4))),
+        'dependency': ' '.join(dependencies) if dependencies else 'NA',
+    }
+    if rng.random() < 0.1 and index > 0:
+        meta['recommends'] = 'SyntheticExtension%04d' % rng.randrange(index)
+    return meta
+
+
+def createDummyBinary(application, user, size, seed=0, assetstore=None):
+    """
+    Upload the random content shared by the packages of a synthetic catalog.
+
+    The file is uploaded to an item of the application folder, outside of any release.
+
+    :param application: The application folder
+    :param user: The creator of the file
+    :param size: The size in bytes of the content
+    :param seed: The seed of the random content
+    :param assetstore: The assetstore of the file, the current assetstore by default
+    :return: The file document
+    """
+    content = (random.Random(seed).getrandbits(size * 8) if size else 0).to_bytes(size, 'little')
+    item = Item().createItem(BINARY_ITEM_NAME, creator=user, folder=application, reuseExisting=True)
+    return Upload().uploadFromFile(
+        io.BytesIO(content), size, BINARY_ITEM_NAME, parentType='item', parent=item, user=user,
+        mimeType='application/octet-stream', assetstore=assetstore)
+
+
+class _BulkWriter:
+    """
+    Buffer the documents of several collections and insert them by batches.
+    """
+
+    def __init__(self, batchSize):
+        self.batchSize = batchSize
+        self.pending = {}
+        self.counts = {}
+
+    def add(self, model, doc):
+        docs = self.pending.setdefault(model, [])
+        docs.append(doc)
+        if len(docs) >= self.batchSize:
+            self.flush(model)
+
+    def flush(self, model=None):
+        for current in [model] if model is not None else list(self.pending):
+            docs = self.pending.pop(current, [])
+            if docs:
+                current.collection.insert_many(docs, ordered=False)
+                self.counts[current.name] = self.counts.get(current.name, 0) + len(docs)
+
+
+def seedCatalog(application, user, draftRevisions=500, releases=5, extensions=200,
+                operatingSystems=OPERATING_SYSTEMS, architectures=ARCHITECTURES, seed=0,
+                binary=None, batchSize=BATCH_SIZE, progress=None):
+    """
+    Populate an application with a synthetic catalog.
+
+    Each revision, either released or draft, holds one application package and one package of
+    each extension per operating system and architecture. The releases use the oldest revisions,
+    one revision is created per day until today.
+
+    :param application: The application folder, see :func:`createApplication`
+    :param user: The creator of the folders and items
+    :param draftRevisions: The number of draft revisions
+    :param releases: The number of releases
+    :param extensions: The number of extensions of each revision
+    :param operatingSystems: The operating systems of the packages
+    :param architectures: The architectures of the packages
+    :param seed: The seed of the random generator, a catalog is reproducible from its parameters
+    :param binary: The file whose content is shared by the packages, see :func:`createDummyBinary`.
+        Without it, the packages have no file.
+    :param batchSize: The number of documents inserted at once
+    :param progress: Called with the number of generated revisions and the total number of
+        revisions, once each revision is generated
+    :return: A summary with the ``releases`` and ``draftRevisions`` names, the ``baseNames`` of
+        the extensions and the number of documents inserted per collection
+    """
+    rng = random.Random(seed)
+    appId = str(application['_id'])
+    draft = Folder().findOne({'parentId': application['_id'], 'name': constants.DRAFT_RELEASE_NAME})
+    extensionMetas = [extensionMetadata(rng, index, extensions) for index in range(extensions)]
+    platforms = [(os, arch) for os in operatingSystems for arch in architectures]
+    writer = _BulkWriter(batchSize)
+    fileSize = binary['size'] if binary is not None else 0
+
+    revisionCount = releases + draftRevisions
+    now = datetime.datetime.utcnow()
+    summary = {'releases': [], 'draftRevisions': [], 'baseNames': [meta['baseName'] for meta in extensionMetas]}
+    for index in range(revisionCount):
+        revision = str(FIRST_REVISION + index)
+        created = now - datetime.timedelta(days=revisionCount - index)
+        if index < releases:
+            name = '5.%d.0' % index
+            parent = application
+            summary['releases'].append(name)
+        else:
+            name = revision
+            parent = draft
+            summary['draftRevisions'].append(revision)
+        releaseFolder = _folder(
+            writer, user, parent, name, created, len(platforms) * fileSize, {'revision': revision})
+        extensionsFolder = _folder(
+            writer, user, releaseFolder, constants.EXTENSIONS_FOLDER_NAME, created,
+            len(platforms) * len(extensionMetas) * fileSize)
+
+        for os, arch in platforms:
+            meta = {
+                'app_id': appId,
+                'baseName': 'Slicer',
+                'os': os,
+                'arch': arch,
+                'repository_type': 'git',
+                'repository_url': 'https://github.com/Slicer/Slicer.git',
+                'revision': revision,
+                'version': '5.%d.0' % (index // 30),
+                'pre_release': False,
+                'build_date': created,
+            }
+            if index < releases:
+                meta['release'] = name
+            _item(writer, user, releaseFolder, constants.APPLICATION_PACKAGE_TEMPLATE_NAME.format(**meta),
+                  created, meta, binary)
+
+            for extensionMeta in extensionMetas:
+                meta = dict(
+                    extensionMeta, app_id=appId, os=os, arch=arch, app_revision=revision,
+                    revision='%040x' % rng.getrandbits(160))
+                item = _item(writer, user, extensionsFolder, constants.EXTENSION_PACKAGE_TEMPLATE_NAME.format(**meta),
+                             created, meta, binary)
+                _dependencyEdges(writer, item)
+
+        if progress is not None:
+            progress(index + 1, revisionCount)
+
+    writer.flush()
+    if fileSize:
+        itemCount = revisionCount * len(platforms) * (1 + len(extensionMetas))
+        ModelImporter.model(application['baseParentType']).increment(
+            query={'_id': application['baseParentId']}, field='size', amount=itemCount * fileSize)
+    summary['counts'] = writer.counts
+    return summary
+
+
+def _folder(writer, user, parent, name, created, size, meta=None):
+    folder = {
+        '_id': ObjectId(),
+        'name': name,
+        'lowerName': name.lower(),
+        'description': '',
+        'parentId': parent['_id'],
+        'parentCollection': 'folder',
+        'baseParentType': parent['baseParentType'],
+        'baseParentId': parent['baseParentId'],
+        'creatorId': user['_id'],
+        'created': created,
+        'updated': created,
+        'size': size,
+        'public': parent['public'],
+        'meta': meta or {},
+    }
+    Folder().setUserAccess(folder, user, AccessType.ADMIN, save=False)
+    writer.add(Folder(), folder)
+    return folder
+
+
+def _item(writer, user, folder, name, created, meta, binary):
+    item = {
+        '_id': ObjectId(),
+        'name': name,
+        'lowerName': name.lower(),
+        'description': meta.get('description', ''),
+        'folderId': folder['_id'],
+        'baseParentType': folder['baseParentType'],
+        'baseParentId': folder['baseParentId'],
+        'creatorId': user['_id'],
+        'created': created,
+        'updated': created,
+        'size': binary['size'] if binary is not None else 0,
+        'meta': meta,
+    }
+    writer.add(Item(), item)
+    if binary is not None:
+        file = {key: value for key, value in binary.items() if key not in ('_id', 'itemId')}
+        file.update({
+            '_id': ObjectId(),
+            'itemId': item['_id'],
+            'name': name,
+            'creatorId': user['_id'],
+            'created': created,
+        })
+        writer.add(File(), file)
+    return item
+
+
+def _dependencyEdges(writer, extension):
+    meta = extension['meta']
+    for kind in (KIND_DEPENDENCY, KIND_RECOMMENDS):
+        for name in parseDependencies(meta.get(kind)):
+            writer.add(Dependency(), {
+                '_id': ObjectId(),
+                'itemId': extension['_id'],
+                'app_id': meta['app_id'],
+                'app_revision': meta['app_revision'],
+                'os': meta['os'],
+                'arch': meta['arch'],
+                'from_baseName': meta['baseName'],
+                'to_baseName': name,
+                'kind': kind,
+            })
+
+
+@click.command(
+    'synthetic-catalog', short_help='Populate Girder with a synthetic package catalog.',
+    help='Create applications populated with synthetic releases, draft revisions, application '
+         'packages and extension packages. The documents are inserted in bulk in the database, '
+         'bypassing the validation and the events of the models.')
+@click.option(
+    '-d', '--database', default=cherrypy.config['database']['uri'], show_default=True,
+    help='The database URI to connect to.')
+@click.option('--user', 'login', default=None,
+              help='Login of the creator of the catalog, the first administrator by default.')
+@click.option('--collection', default='Applications', show_default=True,
+              help='Name of the collection containing the applications.')
+@click.option('--name', default='Slicer', show_default=True,
+              help='Name of the application, suffixed by its index if there are several applications.')
+@click.option('--applications', default=1, show_default=True, help='Number of applications.')
+@click.option('--draft-revisions', default=500, show_default=True, help='Number of draft revisions.')
+@click.option('--releases', default=5, show_default=True, help='Number of releases.')
+@click.option('--extensions', default=200, show_default=True, help='Number of extensions of each revision.')
+@click.option('--os', 'operatingSystems', multiple=True, default=OPERATING_SYSTEMS, show_default=True,
+              type=click.Choice(OPERATING_SYSTEMS), help='Operating systems of the packages.')
+@click.option('--arch', 'architectures', multiple=True, default=ARCHITECTURES, show_default=True,
+              type=click.Choice(ARCHITECTURES), help='Architectures of the packages.')
+@click.option('--binary-size', default=1024, show_default=True,
+              help='Size in bytes of the dummy binary shared by the packages, 0 for packages without file.')
+@click.option('--seed', default=0, show_default=True, help='Seed of the random generator.')
+@click.option('--private', is_flag=True, default=False, help='Create private applications.')
+def main(database, login, collection, name, applications, draft_revisions, releases, extensions,
+         operatingSystems, architectures, binary_size, seed, private):
+    """
+    Populate a Girder instance with synthetic applications, see :func:`seedCatalog`.
+    """
+    cherrypy.config['database']['uri'] = database
+    if login is not None:
+        user = User().findOne({'login': login.lower()})
+    else:
+        user = User().findOne({'admin': True}, sort=[('created', 1)])
+    if user is None:
+        msg = 'No user found to create the catalog, create an administrator or use --user.'
+        raise click.ClickException(msg)
+
+    start = time.perf_counter()
+    for index in range(applications):
+        appName = name if applications == 1 else '%s%d' % (name, index + 1)
+        application = createApplication(user, appName, collectionName=collection, public=not private)
+        binary = createDummyBinary(application, user, binary_size, seed + index) if binary_size else None
+        with click.progressbar(length=releases + draft_revisions, label=appName) as bar:
+            summary = seedCatalog(
+                application, user, draftRevisions=draft_revisions, releases=releases,
+                extensions=extensions, operatingSystems=operatingSystems, architectures=architectures,
+                seed=seed + index, binary=binary,
+                progress=lambda done, _total: bar.update(done - bar.pos))
+        click.echo('%s: %s' % (appName, ', '.join(
+            '%d %s' % (count, collectionName) for collectionName, count in sorted(summary['counts'].items()))))
+    click.echo('Done in %.1fs' % (time.perf_counter() - start))
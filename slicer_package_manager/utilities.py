@@ -1,9 +1,17 @@
+import collections
+
 from girder.constants import AccessType
+from girder.models.file import File
 from girder.models.folder import Folder
 from girder.models.item import Item
+from girder.models.upload import Upload
+from girder.utility.model_importer import ModelImporter
 from girder.utility.progress import ProgressContext
 
-from . import constants
+from . import constants, deduplication
+from .models.dependency import Dependency
+from .models.package import Package
+from .models.tombstone import Tombstone
 
 
 def isSlicerPackages(item):
@@ -195,6 +203,63 @@ def deleteFolder(folder, progress, user):
         Folder().remove(folder, progress=ctx)
 
 
+def deletePackages(query):
+    """
+    Delete at once the application and extension package items matching a query.
+
+    Unlike ``Item().remove``, the items and their files are removed with bulk operations and no
+    ``model.item.remove`` nor ``model.file.remove`` event is triggered. The stored content of
+    the files is deleted with :func:`deduplication.removeFiles`, and the documents maintained by
+    the event handlers of the plugin are updated with :func:`recordRemovedPackages`.
+
+    :param query: The query selecting the package items
+    :return: The number of ``items`` and ``files`` removed, and the ``bytes`` of the files
+    """
+    items = list(Item().find(query))
+    report = {'items': len(items), 'files': 0, 'bytes': 0}
+    if not items:
+        return report
+    itemsById = {item['_id']: item for item in items}
+
+    files = list(File().find({'itemId': {'$in': list(itemsById)}}))
+    sizes = collections.Counter()
+    for file in files:
+        item = itemsById[file['itemId']]
+        size = file.get('size') or 0
+        sizes['folder', item['folderId']] += size
+        sizes[item['baseParentType'], item['baseParentId']] += size
+        report['bytes'] += size
+    report['files'] = len(files)
+    deduplication.removeFiles(files)
+
+    for upload in list(Upload().find({'parentId': {'$in': list(itemsById)}, 'parentType': 'item'})):
+        Upload().remove(upload)
+
+    for (modelType, docId), size in sizes.items():
+        if size:
+            ModelImporter.model(modelType).increment(query={'_id': docId}, field='size', amount=-size)
+
+    recordRemovedPackages(items)
+    Item().collection.delete_many({'_id': {'$in': list(itemsById)}})
+    return report
+
+
+def recordRemovedPackages(items):
+    """
+    Update the documents maintained along the removed application and extension package items:
+    record their tombstones for the changes feed, remove the dependency edges of the extensions
+    and invalidate the cached latest packages of the applications.
+
+    :param items: The removed package items
+    """
+    Tombstone().createTombstones(items)
+    extensions = [item for item in items if 'app_revision' in item['meta']]
+    if extensions:
+        Dependency().removeManyEdges(extensions)
+    for app_id in {item['meta']['app_id'] for item in items if 'app_revision' not in item['meta']}:
+        Package().invalidateLatestPackages(app_id)
+
+
 def checkAccess(app_id, user):
     """
     Check user has access to the application.
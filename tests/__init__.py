@@ -1,7 +1,11 @@
+import contextlib
 import os
+import threading
 
 from shutil import copyfile
 
+from pymongo import monitoring
+
 from slicer_package_manager.constants import (
     APPLICATION_PACKAGE_TEMPLATE_NAME,
     EXTENSION_PACKAGE_TEMPLATE_NAME,
@@ -211,6 +215,47 @@ expectedDownloadStats = {
 }
 
 
+class _MongoCommandListener(monitoring.CommandListener):
+    """Record the names of the MongoDB commands started by the counting threads."""
+
+    def __init__(self):
+        self.counters = {}
+
+    def started(self, event):
+        commands = self.counters.get(threading.get_ident())
+        if commands is not None:
+            commands.append(event.command_name)
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+# Registered before the database clients of the tests are created
+_mongoCommandListener = _MongoCommandListener()
+monitoring.register(_mongoCommandListener)
+
+
+@contextlib.contextmanager
+def countMongoCommands():
+    """Record the MongoDB commands issued by the current thread within the context.
+
+    The REST requests of the tests are handled by the calling thread, so that their commands
+    are recorded. ``getMore`` commands are included, a query whose results do not fit in the
+    first batch counts more than once.
+
+    :return: The list of the names of the commands, filled in as they are issued.
+    """
+    commands = []
+    _mongoCommandListener.counters[threading.get_ident()] = commands
+    try:
+        yield commands
+    finally:
+        del _mongoCommandListener.counters[threading.get_ident()]
+
+
 def computeContentChecksum(algo, content):
     """Compute digest of ``content`` using ``algo``.
 
@@ -0,0 +1,207 @@
+import pytest
+
+from girder import events
+from girder.models.folder import Folder
+from girder.models.item import Item
+from girder.models.token import Token
+from girder.models.user import User
+
+from pytest_girder.assertions import assertStatusOk
+
+from slicer_package_manager import constants, synthetic
+from slicer_package_manager.models.extension_downloads import ExtensionDownloads
+
+from . import countMongoCommands
+
+#: Catalogs of increasing size, the query count of each case must not grow with the size.
+CATALOG_SIZES = [
+    {'draftRevisions': 2, 'releases': 1, 'extensions': 3},
+    {'draftRevisions': 12, 'releases': 4, 'extensions': 15},
+]
+
+#: Maximum number of MongoDB commands of a read request, and of a write request or event.
+READ_CEILING = 30
+WRITE_CEILING = 100
+
+
+def _get(path, isJson=True, **params):
+    def case(server, token, _index):
+        assertStatusOk(server.request(path=path, params=params, token=token, isJson=isJson))
+    return case
+
+
+def _buildCases(catalog):
+    """
+    Build the counted cases of a catalog, each case is called with the server, a token and the
+    index of the call: each case is called once before being counted, so that the counts do
+    not include the cache warm up.
+    """
+    app_id = catalog['app_id']
+    draft_id = catalog['draft_id']
+    release = catalog['release']
+    revision = catalog['latestRevision']
+    extension = catalog['extension']
+    baseName = extension['meta']['baseName']
+    extensionPath = '/app/%s/extension' % app_id
+    packagePath = '/app/%s/package' % app_id
+
+    def createExtension(server, token, index):
+        assertStatusOk(server.request(path=extensionPath, method='POST', token=token, params={
+            'os': 'linux', 'arch': 'amd64', 'baseName': 'CountedExtension%d' % index,
+            'repository_type': 'git', 'repository_url': 'https://github.com/Slicer/Counted.git',
+            'revision': '%040x' % index, 'app_revision': revision, 'description': 'Counted',
+            'dependency': baseName,
+        }))
+
+    def updateExtension(server, token, index):
+        assertStatusOk(server.request(path=extensionPath, method='POST', token=token, params={
+            'os': extension['meta']['os'], 'arch': extension['meta']['arch'], 'baseName': baseName,
+            'repository_type': 'git', 'repository_url': extension['meta']['repository_url'],
+            'revision': '%040x' % (index + 1), 'app_revision': revision, 'description': 'Updated',
+        }))
+
+    def createPackage(server, token, index):
+        assertStatusOk(server.request(path=packagePath, method='POST', token=token, params={
+            'os': 'linux', 'arch': 'amd64', 'baseName': 'Slicer', 'repository_type': 'git',
+            'repository_url': 'https://github.com/Slicer/Slicer.git', 'revision': '9%04d' % index,
+            'version': '5.9.%d' % index,
+        }))
+
+    def deleteExtension(server, token, index):
+        assertStatusOk(server.request(
+            path='%s/%s' % (extensionPath, catalog['deleted'][index]['_id']), method='DELETE', token=token))
+
+    def downloadComplete(item):
+        def case(_server, _token, _index):
+            events.trigger('model.file.download.complete', {'file': {'itemId': item['_id']}})
+        return case
+
+    def renameRelease(server, token, index):
+        assertStatusOk(server.request(
+            path='/folder/%s' % release['_id'], method='PUT', token=token,
+            params={'name': '%s-%d' % (release['name'], index)}))
+
+    return {
+        'listApp': (READ_CEILING, _get('/app', name=catalog['name'])),
+        'getReleases': (READ_CEILING, _get('/app/%s/release' % app_id)),
+        'getAllDraftReleases': (READ_CEILING, _get('/app/%s/draft' % app_id, limit=20)),
+        'getDraftRetention': (READ_CEILING, _get('/app/%s/draft/retention' % app_id)),
+        'getDownloadStats': (READ_CEILING, _get('/app/%s/downloadstats' % app_id)),
+        'getChanges': (READ_CEILING, _get('/app/%s/changes' % app_id, limit=20)),
+        'getExtensions': (READ_CEILING, _get(extensionPath, os='linux', arch='amd64', limit=20)),
+        'getExtensions.release': (READ_CEILING, _get(extensionPath, release_id=str(release['_id']), limit=20)),
+        'getExtensions.draftRevision': (READ_CEILING, _get(
+            extensionPath, release_id=draft_id, app_revision=revision, limit=20)),
+        'getExtensions.acrossDraftRevisions': (READ_CEILING, _get(
+            extensionPath, release_id=draft_id, baseName=baseName, limit=50)),
+        'getExtensions.acrossDraftRevisionsOffset': (READ_CEILING, _get(
+            extensionPath, release_id=draft_id, baseName=baseName, offset=1, limit=50)),
+        'getExtensions.search': (READ_CEILING, _get(extensionPath, app_revision=revision, q='mri', limit=20)),
+        'getExtensions.tier': (READ_CEILING, _get(
+            extensionPath, app_revision=revision, tier=3, tier_compare='gte', limit=20)),
+        'getExtensionSnapshot': (READ_CEILING, _get(
+            '/app/%s/extension/snapshot' % app_id, isJson=False, app_revision=revision)),
+        'getExtensionDependencies': (READ_CEILING, _get(
+            '/app/%s/extension/dependencies' % app_id, baseName=baseName, app_revision=revision,
+            os='linux', arch='amd64')),
+        'getDependencyEdges': (READ_CEILING, _get(
+            '/app/%s/dependency' % app_id, baseName=baseName, app_revision=revision)),
+        'getPackages': (READ_CEILING, _get(packagePath, os='linux', arch='amd64', limit=20)),
+        'getPackages.release': (READ_CEILING, _get(packagePath, release_id_or_name=release['name'])),
+        'getPackages.acrossDraftRevisions': (READ_CEILING, _get(
+            packagePath, release_id_or_name=constants.DRAFT_RELEASE_NAME, os='linux', arch='amd64', limit=50)),
+        'getLatestPackages': (READ_CEILING, _get('/app/%s/package/latest' % app_id)),
+        'createOrUpdateExtension.create': (WRITE_CEILING, createExtension),
+        'createOrUpdateExtension.update': (WRITE_CEILING, updateExtension),
+        'createOrUpdatePackage': (WRITE_CEILING, createPackage),
+        'deleteExtension': (WRITE_CEILING, deleteExtension),
+        '_onDownloadFileComplete.draftExtension': (WRITE_CEILING, downloadComplete(extension)),
+        '_onDownloadFileComplete.releasePackage': (WRITE_CEILING, downloadComplete(catalog['package'])),
+        '_onReleaseFolderNameUpdated': (WRITE_CEILING, renameRelease),
+    }
+
+
+def _seedCatalog(user, name, size):
+    application = synthetic.createApplication(user, name)
+    # The updated extensions must have a file
+    binary = synthetic.createDummyBinary(application, user, 16)
+    summary = synthetic.seedCatalog(application, user, binary=binary, **size)
+    draft = Folder().findOne({'parentId': application['_id'], 'name': constants.DRAFT_RELEASE_NAME})
+    release = Folder().findOne({'parentId': application['_id'], 'name': summary['releases'][-1]})
+    latestRevision = summary['draftRevisions'][-1]
+    extensions = list(Item().find({
+        'meta.app_id': str(application['_id']),
+        'meta.app_revision': latestRevision,
+        # The first extension has no dependency, the resolution of its dependencies does not
+        # depend on the randomly generated dependency graph
+        'meta.baseName': summary['baseNames'][0],
+    }, limit=3))
+    return {
+        'name': name,
+        'app_id': str(application['_id']),
+        'draft_id': str(draft['_id']),
+        'release': release,
+        'latestRevision': latestRevision,
+        'extension': extensions[0],
+        'deleted': extensions[1:],
+        'package': Item().findOne({'folderId': release['_id']}),
+    }
+
+
+@pytest.mark.plugin('slicer_package_manager')
+def testQueryCountsDoNotGrowWithCatalogSize(server, fsAssetstore):
+    # Fix warnings related to fixtures not explicitly used.
+    assert fsAssetstore
+
+    admin = User().createUser('admin', 'password', 'Admin', 'Admin', 'admin@email.com')
+    token = Token().createToken(admin)
+
+    counts = []
+    for index, size in enumerate(CATALOG_SIZES):
+        catalog = _seedCatalog(admin, 'application%d' % index, size)
+        sizeCounts = {}
+        for name, (ceiling, case) in _buildCases(catalog).items():
+            case(server, token, 0)
+            with countMongoCommands() as commands:
+                case(server, token, 1)
+            assert len(commands) <= ceiling, '%s issued %d MongoDB commands: %s' % (
+                name, len(commands), commands)
+            sizeCounts[name] = commands
+        counts.append(sizeCounts)
+
+    smallest = counts[0]
+    for size, sizeCounts in zip(CATALOG_SIZES[1:], counts[1:]):
+        for name, commands in sizeCounts.items():
+            assert len(commands) <= len(smallest[name]), \
+                '%s issued %d MongoDB commands with %s, %d with %s: %s' % (
+                    name, len(commands), size, len(smallest[name]), CATALOG_SIZES[0], commands)
+
+
+@pytest.mark.plugin('slicer_package_manager')
+def testRankingByDownloadsUsesIndex(server, fsAssetstore):
+    # Fix warnings related to fixtures not explicitly used.
+    assert fsAssetstore
+
+    admin = User().createUser('admin', 'password', 'Admin', 'Admin', 'admin@email.com')
+    catalog = _seedCatalog(admin, 'application', CATALOG_SIZES[-1])
+    extension = catalog['extension']
+    events.trigger('model.file.download.complete', {'file': {'itemId': extension['_id']}})
+
+    def _indexOperations():
+        return {
+            stats['name']: stats['accesses']['ops']
+            for stats in ExtensionDownloads().collection.aggregate([{'$indexStats': {}}])
+        }
+
+    before = _indexOperations()
+    with countMongoCommands() as commands:
+        resp = server.request(path='/app/%s/extension' % catalog['app_id'], token=Token().createToken(admin), params={
+            'app_revision': catalog['latestRevision'], 'sort': 'downloads', 'sortdir': -1})
+    assertStatusOk(resp)
+    assert resp.json[0]['_id'] == str(extension['_id'])
+    assert len(commands) <= READ_CEILING
+
+    # The downloads of each extension are looked up by the unique index, which is the only one
+    after = _indexOperations()
+    assert set(after) == {'_id_', 'baseName_1_app_id_1'}
+    assert after['baseName_1_app_id_1'] > before['baseName_1_app_id_1']
@@ -1,20 +1,44 @@
+import gzip
+import io
+import datetime
 import json
 import os
+import re
+import struct
+import threading
+import time
+from unittest import mock
 
+import cherrypy
 import pytest
 
 from bson.objectid import ObjectId
 
+from girder import events
+from girder.models.assetstore import Assetstore
 from girder.models.collection import Collection
 from girder.models.folder import Folder
 from girder.models.file import File
 from girder.models.item import Item
+from girder.models.setting import Setting
+from girder.models.upload import Upload
 from girder.models.user import User
+from girder.utility import assetstore_utilities
+from girder_jobs.constants import JobStatus
+from girder_jobs.models.job import Job
 
 from pytest_girder.assertions import assertStatus, assertStatusOk
 from pytest_girder.utils import getResponseBody
 
-from slicer_package_manager import constants, utilities
+from slicer_package_manager import (
+    _backfillDependencies, _backfillDownloadCounts, _backfillExtensionDownloads, constants, handlerqueue, metrics,
+    snapshot, utilities,
+)
+from slicer_package_manager.models.dependency import Dependency
+from slicer_package_manager.models.download_count import DownloadCount
+from slicer_package_manager.models.extension_downloads import ExtensionDownloads
+from slicer_package_manager.models import tombstone
+from slicer_package_manager.settings import PluginSettings
 
 from . import (
     computeFileChecksum,
@@ -479,6 +503,75 @@ def testGetAllDraftRelease(server, user, app_folder, draft_release_revision_fold
     assert len(resp.json) == 0
 
 
+@pytest.mark.plugin('slicer_package_manager')
+def testPruneDraftRevisions(server, user, app_folder, draft_release_folder, fsAssetstore):
+    assert fsAssetstore  # Fix warnings related to fixtures not explicitly used.
+
+    meta = {
+        'os': 'linux',
+        'arch': 'amd64',
+        'baseName': 'pkg',
+        'repository_type': 'git',
+        'repository_url': 'git://slicer4.com',
+        'version': '1.0',
+    }
+    packages = [
+        _createOrUpdatePackage(server, 'package', dict(meta, revision=revision), _user=user, _app=app_folder)
+        for revision in ['0001', '0002', '0003', '0004']
+    ]
+    server.uploadFile('pkg.tar.gz', b'package binary', user, packages[1], parentType='item')
+
+    def _request(path, method='GET', params=None, status_code=200):
+        resp = server.request(
+            path='/app/%s/draft/%s' % (app_folder['_id'], path),
+            method=method,
+            user=user,
+            params=params,
+        )
+        assertStatus(resp, status_code)
+        return resp.json
+
+    def _prune(dryRun):
+        job = _waitForJob(_request('prune', method='POST', params={'dry_run': dryRun}))
+        assert job['status'] == JobStatus.SUCCESS
+        return job['report']
+
+    def _revisions():
+        return sorted(folder['meta']['revision'] for folder in Folder().childFolders(
+            draft_release_folder, 'Folder', user=user))
+
+    # Pruning requires a retention policy
+    _request('prune', method='POST', status_code=400)
+    assert _request('retention') == {'keepRevisions': None, 'keepDays': None, 'keepDownloadedDays': None}
+
+    _request('retention', method='PUT', params={'keep_revisions': -1}, status_code=400)
+    policy = _request('retention', method='PUT', params={'keep_revisions': 2, 'keep_downloaded_days': 1})
+    assert policy == {'keepRevisions': 2, 'keepDays': None, 'keepDownloadedDays': 1}
+    assert _request('retention') == policy
+
+    # Recently downloaded revisions are kept
+    Folder().update(
+        {'_id': draft_release_folder['_id']},
+        {'$set': {
+            'meta.lastDownloaded.0001': datetime.datetime.utcnow(),
+            'meta.lastDownloaded.0002': datetime.datetime.utcnow() - datetime.timedelta(days=2),
+        }})
+
+    report = _prune(dryRun=True)
+    assert report['revisions'] == ['0002']
+    assert (report['items'], report['bytes']) == (1, len(b'package binary'))
+    assert _revisions() == ['0001', '0002', '0003', '0004']
+
+    report = _prune(dryRun=False)
+    assert report['revisions'] == ['0002']
+    assert (report['items'], report['bytes']) == (1, len(b'package binary'))
+    assert _revisions() == ['0001', '0003', '0004']
+    assert Item().load(packages[1]['_id'], force=True) is None
+    # The last download of the removed revision is forgotten
+    lastDownloaded = Folder().load(draft_release_folder['_id'], force=True)['meta']['lastDownloaded']
+    assert list(lastDownloaded) == ['0001']
+
+
 @pytest.mark.plugin('slicer_package_manager')
 def testDeleteReleaseByID(server, user, app_folder):
     _deleteRelease(server, '_id', _user=user, _app=app_folder)
@@ -489,6 +582,28 @@ def testDeleteReleaseByName(server, user, app_folder):
     _deleteRelease(server, 'name', _user=user, _app=app_folder)
 
 
+@pytest.mark.plugin('slicer_package_manager')
+def testDeleteReleaseInBackground(server, user, app_folder, release_folder, release_packages, release_extensions):
+    # Fix warnings related to fixtures not explicitly used.
+    assert release_packages
+    assert release_extensions
+
+    resp = server.request(
+        path='/app/%s/release/%s' % (app_folder['_id'], release_folder['_id']),
+        method='DELETE',
+        user=user,
+        params={'background': True},
+    )
+    assertStatusOk(resp)
+    assert resp.json['type'] == 'slicer_package_manager.delete_folder'
+
+    job = _waitForJob(resp.json)
+    assert job['status'] == JobStatus.SUCCESS
+    assert job['progress']['current'] == job['progress']['total'] == len(release_packages) + len(release_extensions)
+    assert Folder().load(release_folder['_id'], force=True) is None
+    assert all(Item().load(doc['_id'], force=True) is None for doc in release_packages + release_extensions)
+
+
 @pytest.mark.plugin('slicer_package_manager')
 def testDeleteRevisionRelease(server, user, app_folder, packages, extensions):
     # Fix warnings related to fixtures not explicitly used.
@@ -684,6 +799,196 @@ def testGetExtensionsDraftOffsetPagination(server, user, app_folder, extensions)
     )
 
 
+@pytest.mark.plugin('slicer_package_manager')
+def testGetExtensionSnapshot(server, user, app_folder, extensions):
+    def _getSnapshot(params):
+        resp = server.request(
+            path='/app/%s/extension/snapshot' % app_folder['_id'],
+            method='GET',
+            user=user,
+            params=params,
+            isJson=False,
+        )
+        assertStatusOk(resp)
+        data = gzip.decompress(getResponseBody(resp, text=False))
+        assert data[:8] == snapshot.MAGIC
+        rowCount, columnCount = struct.unpack_from('<2I', data, 8)
+        assert columnCount == len(snapshot.COLUMNS)
+        return data, rowCount
+
+    # All the revisions
+    data, rowCount = _getSnapshot({})
+    assert rowCount == len(extensions)
+
+    # Decode the "_id" column, the first one
+    values = struct.unpack_from('<%dI' % rowCount, data, 16 + 4 * len(snapshot.COLUMNS))
+    position = 16 + 4 * len(snapshot.COLUMNS) * (rowCount + 1)
+    stringCount = struct.unpack_from('<I', data, position)[0]
+    offsets = struct.unpack_from('<%dI' % (stringCount + 1), data, position + 4)
+    strings = data[position + 4 * (stringCount + 2):]
+    ids = [strings[offsets[value]:offsets[value + 1]].decode('utf8') for value in values]
+    assert sorted(ids) == sorted(ext['_id'] for ext in extensions)
+
+    # One revision
+    app_revision = extensions[0]['meta']['app_revision']
+    _, rowCount = _getSnapshot({'app_revision': app_revision})
+    assert rowCount == len([ext for ext in extensions if ext['meta']['app_revision'] == app_revision])
+
+
+@pytest.mark.plugin('slicer_package_manager')
+def testGetExtensionDependencies(server, user, app_folder, draft_release_folder):
+    # Fix warnings related to fixtures not explicitly used.
+    assert draft_release_folder
+
+    base_meta = {
+        'os': 'linux',
+        'arch': 'amd64',
+        'repository_type': 'git',
+        'repository_url': 'http://slicer.com/extension/Ext',
+        'revision': '001',
+        'app_revision': DRAFT_RELEASES[0]['revision'],
+        'description': 'Test extension',
+    }
+    for baseName, dependency in [
+        ('DepA', 'DepB DepC'),
+        ('DepB', 'DepC,DepMissing'),
+        ('DepC', 'NA'),
+        ('DepCycle1', 'DepCycle2'),
+        ('DepCycle2', 'DepCycle1'),
+    ]:
+        _createOrUpdatePackage(
+            server, 'extension', dict(base_meta, baseName=baseName, dependency=dependency),
+            _user=user, _app=app_folder)
+
+    def _getDependencies(baseName, **params):
+        resp = server.request(
+            path='/app/%s/extension/dependencies' % app_folder['_id'],
+            method='GET',
+            user=user,
+            params=dict({
+                'baseName': baseName,
+                'app_revision': base_meta['app_revision'],
+                'os': base_meta['os'],
+                'arch': base_meta['arch'],
+            }, **params),
+        )
+        assertStatusOk(resp)
+        return resp.json
+
+    # Dependencies are listed before the extensions requiring them
+    result = _getDependencies('DepA')
+    assert [ext['meta']['baseName'] for ext in result['extensions']] == ['DepC', 'DepB', 'DepA']
+    assert result['missing'] == [{'baseName': 'DepMissing', 'requiredBy': ['DepB']}]
+    assert result['cycles'] == []
+
+    result = _getDependencies('DepCycle1,Unknown')
+    assert [ext['meta']['baseName'] for ext in result['extensions']] == ['DepCycle2', 'DepCycle1']
+    assert result['missing'] == [{'baseName': 'Unknown', 'requiredBy': []}]
+    assert result['cycles'] == [['DepCycle1', 'DepCycle2', 'DepCycle1']]
+
+    # Extensions built for another platform are not resolved
+    result = _getDependencies('DepC', os='win')
+    assert result['extensions'] == []
+    assert result['missing'] == [{'baseName': 'DepC', 'requiredBy': []}]
+
+
+@pytest.mark.plugin('slicer_package_manager')
+def testGetDependencyEdges(server, user, app_folder, draft_release_folder, fsAssetstore):
+    # Fix warnings related to fixtures not explicitly used.
+    assert draft_release_folder
+    assert fsAssetstore
+
+    base_meta = {
+        'os': 'linux',
+        'arch': 'amd64',
+        'repository_type': 'git',
+        'repository_url': 'http://slicer.com/extension/Ext',
+        'revision': '001',
+        'app_revision': DRAFT_RELEASES[0]['revision'],
+        'description': 'Test extension',
+    }
+    extA = _createOrUpdatePackage(
+        server, 'extension', dict(base_meta, baseName='EdgeA', dependency='EdgeB EdgeC', recommends='EdgeD'),
+        _user=user, _app=app_folder)
+    _createOrUpdatePackage(
+        server, 'extension', dict(base_meta, baseName='EdgeB', dependency='EdgeC'),
+        _user=user, _app=app_folder)
+
+    def _getEdges(baseName, **params):
+        resp = server.request(
+            path='/app/%s/dependency' % app_folder['_id'],
+            method='GET',
+            user=user,
+            params=dict({'baseName': baseName, 'app_revision': base_meta['app_revision']}, **params),
+        )
+        assertStatusOk(resp)
+        return sorted((edge['from_baseName'], edge['to_baseName'], edge['kind']) for edge in resp.json)
+
+    assert _getEdges('EdgeA') == [
+        ('EdgeA', 'EdgeB', 'dependency'),
+        ('EdgeA', 'EdgeC', 'dependency'),
+        ('EdgeA', 'EdgeD', 'recommends'),
+    ]
+    assert _getEdges('EdgeA', kind='recommends') == [('EdgeA', 'EdgeD', 'recommends')]
+    assert _getEdges('EdgeC', direction='reverse') == [
+        ('EdgeA', 'EdgeC', 'dependency'),
+        ('EdgeB', 'EdgeC', 'dependency'),
+    ]
+    assert _getEdges('EdgeC', direction='reverse', os='win') == []
+
+    # Edges follow the updates of the extension metadata
+    server.uploadFile('EdgeA.tar.gz', b'extension binary', user, extA, parentType='item')
+    _createOrUpdatePackage(
+        server, 'extension', dict(base_meta, baseName='EdgeA', dependency='EdgeB', recommends='EdgeD'),
+        _user=user, _app=app_folder)
+    assert _getEdges('EdgeC', direction='reverse') == [('EdgeB', 'EdgeC', 'dependency')]
+
+    # Edges are removed with the extension
+    resp = server.request(
+        path='/app/%s/extension/%s' % (app_folder['_id'], extA['_id']),
+        method='DELETE',
+        user=user,
+    )
+    assertStatusOk(resp)
+    assert _getEdges('EdgeA') == []
+    assert _getEdges('EdgeB', direction='reverse') == []
+
+
+@pytest.mark.plugin('slicer_package_manager')
+def testBackfillDependencies(server, user, app_folder, draft_release_folder):
+    # Fix warnings related to fixtures not explicitly used.
+    assert server
+    assert draft_release_folder
+
+    # The backfill completed when the plugin was loaded, even without any extension
+    assert Setting().get(PluginSettings.DEPENDENCIES_BACKFILLED) is True
+
+    ext = _createOrUpdatePackage(server, 'extension', {
+        'os': 'linux',
+        'arch': 'amd64',
+        'baseName': 'BackfillA',
+        'repository_type': 'git',
+        'repository_url': 'http://slicer.com/extension/Ext',
+        'revision': '001',
+        'app_revision': DRAFT_RELEASES[0]['revision'],
+        'description': 'Test extension',
+        'dependency': 'BackfillB',
+    }, _user=user, _app=app_folder)
+
+    edges = {'itemId': ObjectId(ext['_id'])}
+    assert Dependency().findOne(edges) is not None
+
+    # Forget the edges, as for the extensions created before the edges were maintained
+    Dependency().removeWithQuery(edges)
+    _backfillDependencies()
+    assert Dependency().findOne(edges) is None
+
+    Setting().set(PluginSettings.DEPENDENCIES_BACKFILLED, False)
+    _backfillDependencies()
+    assert [edge['to_baseName'] for edge in Dependency().find(edges)] == ['BackfillB']
+    assert Setting().get(PluginSettings.DEPENDENCIES_BACKFILLED) is True
+
+
 @pytest.mark.plugin('slicer_package_manager')
 def testGetExtensionsByTier(server, user, app_folder, draft_release_folder):
     # Fix warnings related to fixtures not explicitly used.
@@ -869,6 +1174,97 @@ def testDeleteExtensionPackages(server, user, app_folder, release_folder):
     _deletePackages(server, 'extension', extension, _user=user, _app=app_folder)
 
 
+
+@pytest.mark.plugin('slicer_package_manager')
+def testBatchDeleteExtensions(server, user, app_folder, extensions):
+    def _batchDelete(params, _user=user):
+        return server.request(
+            path='/app/%s/extension' % app_folder['_id'],
+            method='DELETE',
+            user=_user,
+            params=params,
+        )
+
+    def _getChangesToken():
+        token = None
+        while True:
+            resp = server.request(
+                path='/app/%s/changes' % app_folder['_id'],
+                method='GET',
+                user=user,
+                params={'since': token} if token else {},
+            )
+            assertStatusOk(resp)
+            token = resp.json['token']
+            if not resp.json['hasMore']:
+                return token
+
+    token = _getChangesToken()
+    deleted = [extensions[3], extensions[4]]
+    extensions_folder = Folder().load(deleted[0]['folderId'], force=True)
+    deletedFiles = list(File().find({'itemId': {'$in': [ObjectId(ext['_id']) for ext in deleted]}}))
+    size = sum(file['size'] for file in deletedFiles)
+
+    resp = _batchDelete({'app_revision': DRAFT_RELEASES[1]['revision'], 'os': 'macosx'})
+    assertStatusOk(resp)
+    assert resp.json == {'items': 2, 'files': len(deletedFiles), 'bytes': size}
+    assert Item().find({'_id': {'$in': [ObjectId(ext['_id']) for ext in deleted]}}).count() == 0
+    assert File().find({'_id': {'$in': [file['_id'] for file in deletedFiles]}}).count() == 0
+    assert Folder().load(extensions_folder['_id'], force=True)['size'] == extensions_folder['size'] - size
+
+    resp = server.request(
+        path='/app/%s/changes' % app_folder['_id'], method='GET', user=user, params={'since': token})
+    assertStatusOk(resp)
+    assert sorted((change['_id'], change['action']) for change in resp.json['changes']) == sorted(
+        (ext['_id'], 'deleted') for ext in deleted)
+
+    resp = _batchDelete({'ids': json.dumps([extensions[0]['_id']]), 'baseName': json.dumps(['Ext0'])})
+    assertStatusOk(resp)
+    assert resp.json['items'] == 1
+
+    resp = server.request(path='/app/%s/extension' % app_folder['_id'], method='GET', user=user)
+    assertStatusOk(resp)
+    assert len(resp.json) == len(extensions) - 3
+
+    # Nothing matches
+    resp = _batchDelete({'baseName': json.dumps(['Unknown'])})
+    assertStatusOk(resp)
+    assert resp.json == {'items': 0, 'files': 0, 'bytes': 0}
+
+    # A filter is required, the IDs must be valid
+    assertStatus(_batchDelete({}), 400)
+    assertStatus(_batchDelete({'ids': json.dumps(['invalid'])}), 400)
+
+    # Write access to the application is required
+    other = User().createUser('usr1', 'passwd', 'tst', 'usr', 'u1@u.com')
+    assertStatus(_batchDelete({'os': 'win'}, _user=other), 403)
+
+
+@pytest.mark.plugin('slicer_package_manager')
+def testBatchDeletePackages(server, user, app_folder, packages, extensions):
+    resp = server.request(
+        path='/app/%s/package' % app_folder['_id'],
+        method='DELETE',
+        user=user,
+        params={'ids': json.dumps([packages[0]['_id'], extensions[0]['_id']])},
+    )
+    assertStatusOk(resp)
+    # Only the application packages are removed
+    assert resp.json['items'] == 1
+    assert Item().load(packages[0]['_id'], force=True) is None
+    assert Item().load(extensions[0]['_id'], force=True) is not None
+
+    resp = server.request(
+        path='/app/%s/package' % app_folder['_id'],
+        method='DELETE',
+        user=user,
+        params={'baseName': json.dumps([package['meta']['baseName'] for package in packages])},
+    )
+    assertStatusOk(resp)
+    assert resp.json['items'] == len(packages) - 1
+    # The extensions are not application packages
+    assert Item().load(extensions[0]['_id'], force=True) is not None
+
 @pytest.mark.external_data(
     os.path.join(FIXTURE_DIR, PACKAGES[2]['filepath']),
 )
@@ -967,6 +1363,23 @@ def testGetPackages(server, user, app_folder, release_folder, packages):
     assertStatusOk(resp)
     assert len(resp.json) == 2
 
+    # Page through the packages of the draft release one at a time
+    paged = []
+    for offset in range(3):
+        resp = server.request(
+            path='/app/%s/package' % app_folder['_id'],
+            method='GET',
+            user=user,
+            params={
+                'release_id_or_name': draftRelease[0]['_id'],
+                'limit': 1,
+                'offset': offset,
+            },
+        )
+        assertStatusOk(resp)
+        paged.extend(resp.json)
+    assert sorted(pkg['_id'] for pkg in paged) == sorted(pkg['_id'] for pkg in packages[1:])
+
     # Get a specific package by name
     resp = server.request(
         path='/app/%s/package' % app_folder['_id'],
@@ -990,6 +1403,486 @@ def testGetPackages(server, user, app_folder, release_folder, packages):
     assert resp.json == []
 
 
+@pytest.mark.parametrize(("packageType", "items"), [
+    ('package', pytest.lazy_fixture('packages')),
+    ('extension', pytest.lazy_fixture('extensions')),
+])
+@pytest.mark.plugin('slicer_package_manager')
+def testGetPackagesNdjson(server, user, app_folder, packageType, items):
+    # Fix warnings related to fixtures not explicitly used.
+    assert items
+
+    draftRelease = list(Folder().childFolders(
+        app_folder,
+        'Folder',
+        user=user,
+        filters={'name': constants.DRAFT_RELEASE_NAME}))
+    releaseParam = 'release_id' if packageType == 'extension' else 'release_id_or_name'
+    for params in [{'limit': 0}, {'limit': 0, releaseParam: draftRelease[0]['_id']}]:
+        resp = server.request(
+            path='/app/%s/%s' % (app_folder['_id'], packageType),
+            method='GET',
+            user=user,
+            params=params,
+        )
+        assertStatusOk(resp)
+        expected = resp.json
+
+        resp = server.request(
+            path='/app/%s/%s' % (app_folder['_id'], packageType),
+            method='GET',
+            user=user,
+            params=dict(params, format='ndjson'),
+            isJson=False,
+        )
+        assertStatusOk(resp)
+        assert resp.headers['Content-Type'] == 'application/x-ndjson'
+        lines = getResponseBody(resp).splitlines()
+        assert [json.loads(line) for line in lines] == expected
+    assert expected
+
+
+@pytest.mark.plugin('slicer_package_manager')
+def testGetMetrics(server, user, app_folder):
+    def _getMetrics(_user):
+        resp = server.request(path='/app/metrics', method='GET', user=_user, isJson=False)
+        assertStatusOk(resp)
+        assert resp.headers['Content-Type'].startswith('text/plain')
+        samples = {}
+        for line in getResponseBody(resp).splitlines():
+            if not line.startswith('#'):
+                name, value = line.rsplit(' ', 1)
+                samples[name] = float(value)
+        return samples
+
+    labels = '{method="GET",route="/app/:app_id/package"}'
+    before = _getMetrics(user)
+
+    Setting().set(PluginSettings.SLOW_REQUEST_THRESHOLD, 0.000001)
+    with mock.patch.object(metrics.logger, 'warning') as warning:
+        resp = server.request(path='/app/%s/package' % app_folder['_id'], method='GET', user=user)
+        assertStatusOk(resp)
+    assert warning.call_args[0][1:3] == ('GET', '/app/:app_id/package')
+
+    after = _getMetrics(user)
+    name = 'slicer_package_manager_%s' + labels
+    count = 'slicer_package_manager_request_duration_seconds_count' + labels
+    assert after[count] == before.get(count, 0) + 1
+    assert after[name % 'mongo_operations_total'] > before.get(name % 'mongo_operations_total', 0)
+    assert after[name % 'response_bytes_total'] == before.get(name % 'response_bytes_total', 0) + len(
+        getResponseBody(resp, text=False))
+    buckets = [value for key, value in after.items() if re.match(
+        r'slicer_package_manager_request_duration_seconds_bucket\{method="GET",route="/app/:app_id/package",', key)]
+    assert buckets == sorted(buckets)
+    assert buckets[-1] == after[count]
+
+    # Admin only
+    other = User().createUser('usr1', 'passwd', 'tst', 'usr', 'u1@u.com')
+    resp = server.request(path='/app/metrics', method='GET', user=other)
+    assertStatus(resp, 403)
+
+
+@pytest.mark.plugin('slicer_package_manager')
+def testGetEventHandlerMetrics(server, user, app_folder):
+    labels = '{handler="_onItemSavedOrCopied",event="model.item.save.after"}'
+    count = 'slicer_package_manager_event_handler_duration_seconds_count' + labels
+    skipped = 'slicer_package_manager_event_handler_skipped_total' + labels
+
+    def _getSample(name):
+        resp = server.request(path='/app/metrics', method='GET', user=user, isJson=False)
+        assertStatusOk(resp)
+        for line in getResponseBody(resp).splitlines():
+            if line.startswith(name + ' '):
+                return float(line.rsplit(' ', 1)[1])
+        return 0
+
+    before = (_getSample(count), _getSample(skipped))
+
+    # An item unrelated to the packages only counts as an early exit
+    Item().createItem('unrelated', creator=user, folder=app_folder)
+    assert (_getSample(count), _getSample(skipped)) == (before[0] + 1, before[1] + 1)
+
+    # The package is handled
+    _createOrUpdatePackage(server, 'package', PACKAGES[0]['meta'], _user=user, _app=app_folder)
+    after = (_getSample(count), _getSample(skipped))
+    assert after[0] - after[1] > before[0] - before[1]
+
+
+@pytest.mark.plugin('slicer_package_manager')
+def testMetricsOfAbandonedStream(server, user, app_folder, monkeypatch):
+    # The streamed response is never consumed to the end, the request is not recorded
+    requests = []
+    monkeypatch.setattr(metrics, '_recordStream', lambda request, stream: requests.append(request) or stream)
+    resp = server.request(
+        path='/app/%s/extension/snapshot' % app_folder['_id'], method='GET', user=user, isJson=False)
+    assertStatusOk(resp)
+    # End the request as the WSGI server does, the test server doesn't
+    cherrypy.tree.apps[''].release_serving()
+
+    # The next MongoDB commands of the thread are not attributed to the request
+    (request,) = requests
+    mongoOperations = request.mongoOperations
+    assert Folder().findOne({'_id': app_folder['_id']}) is not None
+    assert request.mongoOperations == mongoOperations
+
+
+@pytest.mark.plugin('slicer_package_manager')
+def testAsyncEventHandlers(server, user, app_folder, extensions):
+    def _getDownloads():
+        resp = server.request(
+            path='/app/%s/downloadstats' % app_folder['_id'], method='GET', user=user, params={'top': 1})
+        assertStatusOk(resp)
+        return resp.json['totals']['downloads']
+
+    before = _getDownloads()
+    handled = handlerqueue.handlerQueue.counts['handled']
+    Setting().set(PluginSettings.ASYNC_EVENT_HANDLERS, True)
+    ext_file = File().findOne({'itemId': ObjectId(extensions[3]['_id'])})
+    _downloadFile(server, ext_file['_id'], _user=user)
+    assert handlerqueue.handlerQueue.join(timeout=10)
+    assert _getDownloads() == before + 1
+    assert handlerqueue.handlerQueue.counts['handled'] == handled + 1
+
+    resp = server.request(path='/app/metrics', method='GET', user=user, isJson=False)
+    assertStatusOk(resp)
+    body = getResponseBody(resp)
+    assert 'slicer_package_manager_event_queue_pending 0\n' in body
+    assert 'slicer_package_manager_event_queue_events_total{outcome="handled"} %d\n' % (handled + 1) in body
+
+    resp = server.request(
+        path='/system/setting', method='PUT', user=user,
+        params={'key': PluginSettings.ASYNC_EVENT_HANDLERS, 'value': 'yes'})
+    assertStatus(resp, 400)
+
+
+@pytest.mark.plugin('slicer_package_manager')
+def testAsyncEventHandlersRetryFailedStep(server, user, extensions, monkeypatch):
+    monkeypatch.setattr(handlerqueue.handlerQueue, 'retryDelay', 0)
+    item = Item().load(ObjectId(extensions[3]['_id']), force=True)
+    meta = item['meta']
+    release = utilities.getReleaseFolder(item)
+
+    def _getCounts():
+        folder = Folder().load(release['_id'], force=True)
+        return (
+            folder['meta'].get('downloadStats', {}).get(meta['app_revision'], {}).get(
+                constants.EXTENSIONS_FOLDER_NAME, {}).get(meta['baseName'], {}).get(meta['os'], {}).get(
+                    meta['arch'], 0),
+            sum(count['count'] for count in DownloadCount().find({'baseName': meta['baseName']})),
+            sum(downloads['count'] for downloads in ExtensionDownloads().find({'baseName': meta['baseName']})),
+        )
+
+    # The download count of the day fails once, after the download statistics of the release
+    # folder are incremented
+    recordDownload = DownloadCount.recordDownload
+    failures = [RuntimeError('Injected failure')]
+
+    def _recordDownload(self, *args):
+        if failures:
+            raise failures.pop()
+        return recordDownload(self, *args)
+
+    monkeypatch.setattr(DownloadCount, 'recordDownload', _recordDownload)
+    before = _getCounts()
+    retried = handlerqueue.handlerQueue.counts['retried']
+    Setting().set(PluginSettings.ASYNC_EVENT_HANDLERS, True)
+    _downloadFile(server, File().findOne({'itemId': item['_id']})['_id'], _user=user)
+    assert handlerqueue.handlerQueue.join(timeout=10)
+    assert handlerqueue.handlerQueue.counts['retried'] == retried + 1
+    # Each counter is incremented once
+    assert _getCounts() == tuple(count + 1 for count in before)
+
+
+def testHandlerQueueRetry():
+    calls = []
+
+    def handler(event):
+        calls.append(event.info['attempt'])
+        event.info['attempt'] += 1
+        if event.info['attempt'] < event.info['succeedAt']:
+            raise RuntimeError
+
+    queue = handlerqueue.HandlerQueue(maxAttempts=3, retryDelay=0)
+    queue.put(handler, events.Event('test', {'attempt': 0, 'succeedAt': 2}))
+    assert queue.join(timeout=10)
+    assert calls == [0, 1]
+    assert queue.counts == {'handled': 1, 'retried': 1, 'failed': 0, 'overflowed': 0}
+
+    calls.clear()
+    with mock.patch.object(handlerqueue.logger, 'exception') as exception:
+        queue.put(handler, events.Event('test', {'attempt': 0, 'succeedAt': 5}))
+        assert queue.join(timeout=10)
+    assert calls == [0, 1, 2]
+    assert exception.called
+    assert queue.counts == {'handled': 1, 'retried': 3, 'failed': 1, 'overflowed': 0}
+
+
+def testHandlerQueueOverflow():
+    started = threading.Event()
+    release = threading.Event()
+    threads = []
+
+    def handler(event):
+        threads.append(threading.current_thread())
+        if event.info['block']:
+            started.set()
+            release.wait(10)
+
+    queue = handlerqueue.HandlerQueue(maxsize=1, retryDelay=0)
+    queue.put(handler, events.Event('test', {'block': True}))
+    assert started.wait(10)
+    queue.put(handler, events.Event('test', {'block': False}))
+    # The queue is full, the event is handled by the calling thread
+    queue.put(handler, events.Event('test', {'block': False}))
+    assert threads[-1] is threading.current_thread()
+    assert queue.pending == 2
+    release.set()
+    assert queue.join(timeout=10)
+    assert queue.counts == {'handled': 2, 'retried': 0, 'failed': 0, 'overflowed': 1}
+
+
+def testHandlerQueueRetrySteps():
+    calls = []
+    failures = {1: 2, 2: 1}
+
+    def _step(index):
+        def step():
+            calls.append(index)
+            if failures.get(index):
+                failures[index] -= 1
+                raise RuntimeError
+        return step
+
+    def handler(event):
+        handlerqueue.runSteps(event, [_step(index) for index in range(3)])
+
+    queue = handlerqueue.HandlerQueue(maxAttempts=4, retryDelay=0)
+    queue.put(handler, events.Event('test', {}))
+    assert queue.join(timeout=10)
+    # The completed steps are not run again
+    assert calls == [0, 1, 1, 1, 2, 2]
+    assert queue.counts == {'handled': 1, 'retried': 3, 'failed': 0, 'overflowed': 0}
+
+    # Outside of the queue, all the steps are run
+    calls.clear()
+    failures.clear()
+    handler(events.Event('test', {}))
+    assert calls == [0, 1, 2]
+
+
+@pytest.mark.plugin('slicer_package_manager')
+def testGetLatestPackages(server, user, app_folder, release_folder, draft_release_folder):
+    # Fix warnings related to fixtures not explicitly used.
+    assert release_folder
+    assert draft_release_folder
+
+    base_meta = {
+        'os': 'linux',
+        'arch': 'amd64',
+        'baseName': 'pkg',
+        'repository_type': 'git',
+        'repository_url': 'git://slicer4.com',
+        'version': DRAFT_RELEASES[0]['version'],
+    }
+    _createOrUpdatePackage(
+        server, 'package', dict(base_meta, revision='0001'), _user=user, _app=app_folder)
+    linux = _createOrUpdatePackage(
+        server, 'package', dict(base_meta, revision='0002'), _user=user, _app=app_folder)
+    linuxPreRelease = _createOrUpdatePackage(
+        server, 'package', dict(base_meta, revision='0003', pre_release=True), _user=user, _app=app_folder)
+    win = _createOrUpdatePackage(
+        server, 'package', dict(base_meta, os='win', revision='0001'), _user=user, _app=app_folder)
+
+    def _getLatestPackages():
+        resp = server.request(
+            path='/app/%s/package/latest' % app_folder['_id'],
+            method='GET',
+            user=user,
+        )
+        assertStatusOk(resp)
+        return [(latest['os'], latest['arch'], latest['pre_release'], latest['package']['_id']) for latest in resp.json]
+
+    assert _getLatestPackages() == [
+        ('linux', 'amd64', False, linux['_id']),
+        ('linux', 'amd64', True, linuxPreRelease['_id']),
+        ('win', 'amd64', False, win['_id']),
+    ]
+
+    # The latest packages are updated when a package is created or deleted
+    linux = _createOrUpdatePackage(
+        server, 'package', dict(base_meta, revision='0004'), _user=user, _app=app_folder)
+    resp = server.request(
+        path='/app/%s/package/%s' % (app_folder['_id'], win['_id']),
+        method='DELETE',
+        user=user,
+    )
+    assertStatusOk(resp)
+    assert _getLatestPackages() == [
+        ('linux', 'amd64', False, linux['_id']),
+        ('linux', 'amd64', True, linuxPreRelease['_id']),
+    ]
+
+
+@pytest.fixture(name='gridFsAssetstore')
+def fixture_gridfs_assetstore(server):
+    assert server  # Fix warnings related to fixtures not explicitly used.
+    assetstore = Assetstore().createGridFsAssetstore(name='GridFS', db='slicer_package_manager_test_gridfs')
+    adapter = assetstore_utilities.getAssetstoreAdapter(assetstore)
+    yield assetstore
+    Assetstore().collection.delete_one({'_id': assetstore['_id']})
+    adapter.chunkColl.database.client.drop_database(adapter.chunkColl.database.name)
+
+
+@pytest.mark.plugin('slicer_package_manager')
+def testDeduplicatePackageFiles(server, user, app_folder, release_folder, draft_release_folder, gridFsAssetstore):
+    # Fix warnings related to fixtures not explicitly used.
+    assert release_folder
+    assert draft_release_folder
+
+    assetstore = gridFsAssetstore
+    adapter = assetstore_utilities.getAssetstoreAdapter(assetstore)
+
+    meta = {
+        'os': 'linux',
+        'arch': 'amd64',
+        'baseName': 'pkg',
+        'repository_type': 'git',
+        'repository_url': 'git://slicer4.com',
+        'version': '1.0',
+    }
+    contents = b'package binary republished unchanged'
+    packages = []
+    files = []
+    for revision in ['0001', '0002']:
+        package = _createOrUpdatePackage(server, 'package', dict(meta, revision=revision), _user=user, _app=app_folder)
+        uploaded = server.uploadFile('pkg.tar.gz', contents, user, package, parentType='item')
+        packages.append(package)
+        files.append(File().load(uploaded['_id'], force=True))
+
+    # The second upload shares the chunks of the first one
+    assert files[0]['assetstoreId'] == assetstore['_id']
+    assert files[0]['chunkUuid'] == files[1]['chunkUuid']
+    assert adapter.chunkColl.count_documents({}) == 1
+
+    # The chunks are removed with the last file referencing them
+    for index, package in enumerate(packages):
+        assert _downloadFile(server, files[index]['_id'], _user=user) == contents
+        resp = server.request(
+            path='/app/%s/package/%s' % (app_folder['_id'], package['_id']),
+            method='DELETE',
+            user=user,
+        )
+        assertStatusOk(resp)
+        assert adapter.chunkColl.count_documents({}) == (1 if index == 0 else 0)
+
+
+@pytest.mark.plugin('slicer_package_manager')
+def testReuploadPackageFileContent(server, user, app_folder, draft_release_folder, gridFsAssetstore):
+    assert draft_release_folder  # Fix warnings related to fixtures not explicitly used.
+
+    adapter = assetstore_utilities.getAssetstoreAdapter(gridFsAssetstore)
+    package = _createOrUpdatePackage(server, 'package', {
+        'os': 'linux',
+        'arch': 'amd64',
+        'baseName': 'pkg',
+        'repository_type': 'git',
+        'repository_url': 'git://slicer4.com',
+        'version': '1.0',
+        'revision': '0001',
+    }, _user=user, _app=app_folder)
+    contents = b'package binary uploaded twice'
+    file = server.uploadFile('pkg.tar.gz', contents, user, package, parentType='item')
+
+    # Replacing the content of the file by the same content keeps it readable
+    resp = server.request(
+        path='/app/%s/package/%s/file' % (app_folder['_id'], package['_id']),
+        method='POST',
+        user=user,
+        params={'name': 'pkg.tar.gz', 'size': len(contents)},
+    )
+    assertStatusOk(resp)
+    upload = Upload().load(resp.json['_id'])
+    Upload().handleChunk(upload, io.BytesIO(contents))
+
+    assert _downloadFile(server, file['_id'], _user=user) == contents
+    assert adapter.chunkColl.count_documents({}) == 1
+
+
+@pytest.mark.plugin('slicer_package_manager')
+def testUploadEmptyPackageFile(server, user, app_folder, draft_release_folder, fsAssetstore):
+    # Fix warnings related to fixtures not explicitly used.
+    assert draft_release_folder
+    assert fsAssetstore
+
+    package = _createOrUpdatePackage(server, 'package', {
+        'os': 'linux',
+        'arch': 'amd64',
+        'baseName': 'pkg',
+        'repository_type': 'git',
+        'repository_url': 'git://slicer4.com',
+        'version': '1.0',
+        'revision': '0001',
+    }, _user=user, _app=app_folder)
+
+    # An empty file is created right away, without exposing where it is stored
+    resp = server.request(
+        path='/app/%s/package/%s/file' % (app_folder['_id'], package['_id']),
+        method='POST',
+        user=user,
+        params={'name': 'pkg.tar.gz', 'size': 0},
+    )
+    assertStatusOk(resp)
+    assert resp.json['_modelType'] == 'file'
+    assert resp.json['size'] == 0
+    assert 'path' not in resp.json
+    assert 'path' in File().load(resp.json['_id'], force=True)
+
+
+@pytest.mark.plugin('slicer_package_manager')
+def testBatchDeletePackagesSharingContent(server, user, app_folder, draft_release_folder, gridFsAssetstore):
+    assert draft_release_folder  # Fix warnings related to fixtures not explicitly used.
+
+    adapter = assetstore_utilities.getAssetstoreAdapter(gridFsAssetstore)
+    meta = {
+        'os': 'linux',
+        'arch': 'amd64',
+        'baseName': 'pkg',
+        'repository_type': 'git',
+        'repository_url': 'git://slicer4.com',
+        'version': '1.0',
+    }
+    packages = []
+    for revision, contents in [('0001', b'shared'), ('0002', b'shared'), ('0003', b'shared'), ('0004', b'other')]:
+        package = _createOrUpdatePackage(server, 'package', dict(meta, revision=revision), _user=user, _app=app_folder)
+        server.uploadFile('pkg.tar.gz', contents, user, package, parentType='item')
+        packages.append(package)
+    assert adapter.chunkColl.count_documents({}) == 2
+
+    def _deletePackageIds(packageIds):
+        resp = server.request(
+            path='/app/%s/package' % app_folder['_id'], method='DELETE', user=user,
+            params={'ids': json.dumps(packageIds)})
+        assertStatusOk(resp)
+        return resp.json
+
+    # The assetstore is called once per stored content, the shared content is kept
+    deleteFile = type(adapter).deleteFile
+    with mock.patch.object(type(adapter), 'deleteFile', autospec=True, side_effect=deleteFile) as deleteFile:
+        report = _deletePackageIds([package['_id'] for package in packages[:2] + packages[3:]])
+    assert report == {'items': 3, 'files': 3, 'bytes': 2 * len(b'shared') + len(b'other')}
+    assert deleteFile.call_count == 2
+    assert adapter.chunkColl.count_documents({}) == 1
+    assert File().find({'itemId': {'$in': [ObjectId(package['_id']) for package in packages]}}).count() == 1
+    assert _downloadFile(
+        server, File().findOne({'itemId': ObjectId(packages[2]['_id'])})['_id'], _user=user) == b'shared'
+
+    # The content is removed with the last file referencing it
+    assert _deletePackageIds([packages[2]['_id']]) == {'items': 1, 'files': 1, 'bytes': len(b'shared')}
+    assert adapter.chunkColl.count_documents({}) == 0
+    packageIds = [ObjectId(package['_id']) for package in packages]
+    assert tombstone.Tombstone().find({'itemId': {'$in': packageIds}}).count() == 4
+
+
 @pytest.mark.plugin('slicer_package_manager')
 def testDeleteApplicationPackages(server, user, app_folder, release_folder):
     package = _createOrUpdatePackage(
@@ -1006,6 +1899,99 @@ def testDeleteApplicationPackages(server, user, app_folder, release_folder):
     _deletePackages(server, 'package', package, _user=user, _app=app_folder)
 
 
+@pytest.mark.plugin('slicer_package_manager')
+def testGetChanges(server, user, app_folder, release_folder, draft_release_folder, fsAssetstore):
+    # Fix warnings related to fixtures not explicitly used.
+    assert release_folder
+    assert draft_release_folder
+    assert fsAssetstore
+
+    def _getChanges(params):
+        resp = server.request(
+            path='/app/%s/changes' % app_folder['_id'],
+            method='GET',
+            user=user,
+            params=params,
+        )
+        assertStatusOk(resp)
+        return resp.json
+
+    packages = [_createOrUpdatePackage(
+        server, 'package', package['meta'], _user=user, _app=app_folder) for package in PACKAGES[:3]]
+
+    # Page through all the changes
+    changes = []
+    token = None
+    while True:
+        result = _getChanges({'since': token, 'limit': 2} if token else {'limit': 2})
+        changes.extend(result['changes'])
+        token = result['token']
+        if not result['hasMore']:
+            break
+    assert [change['_id'] for change in changes] == [package['_id'] for package in packages]
+    assert all(change['action'] == 'created' and change['type'] == 'package' for change in changes)
+
+    # Nothing changed since the last token
+    result = _getChanges({'since': token})
+    assert result == {'changes': [], 'token': token, 'hasMore': False}
+
+    # Update and delete packages
+    server.uploadFile('pkg.tar.gz', b'package binary', user, packages[0], parentType='item')
+    resp = server.request(
+        path='/app/%s/package' % app_folder['_id'],
+        method='POST',
+        user=user,
+        params=dict(PACKAGES[0]['meta'], description='updated'),
+    )
+    assertStatusOk(resp)
+    resp = server.request(
+        path='/app/%s/package/%s' % (app_folder['_id'], packages[1]['_id']),
+        method='DELETE',
+        user=user,
+    )
+    assertStatusOk(resp)
+
+    result = _getChanges({'since': token})
+    assert [(change['_id'], change['action']) for change in result['changes']] == [
+        (packages[0]['_id'], 'updated'),
+        (packages[1]['_id'], 'deleted'),
+    ]
+    assert not result['hasMore']
+
+    # Invalid token
+    resp = server.request(
+        path='/app/%s/changes' % app_folder['_id'],
+        method='GET',
+        user=user,
+        params={'since': 'invalid'},
+    )
+    assertStatus(resp, 400)
+
+    # The deletions recorded before the retention period may have expired
+    expired = datetime.datetime.utcnow() - tombstone.RETENTION - datetime.timedelta(days=1)
+    resp = server.request(
+        path='/app/%s/changes' % app_folder['_id'],
+        method='GET',
+        user=user,
+        params={'since': expired.isoformat()},
+    )
+    assertStatus(resp, 410)
+    assert tombstone.RETENTION.total_seconds() in [
+        index.get('expireAfterSeconds') for index in tombstone.Tombstone().collection.index_information().values()]
+
+    # A quiet application is listed again once, then its token doesn't expire
+    Item().collection.update_many(
+        {'_id': {'$in': [ObjectId(package['_id']) for package in packages]}}, {'$set': {'updated': expired}})
+    tombstone.Tombstone().collection.update_many({}, {'$set': {'updated': expired}})
+    result = _getChanges({})
+    assert len(result['changes']) == 2
+    assert not result['hasMore']
+    assert result['token'] > (datetime.datetime.utcnow() - tombstone.RETENTION).isoformat()
+    result = _getChanges({'since': result['token']})
+    assert result['changes'] == []
+    assert _getChanges({'since': result['token']})['changes'] == []
+
+
 @pytest.mark.plugin('slicer_package_manager')
 def testDownloadStats(server, user, app_folder, draft_release_revision_folder, packages, extensions):
     # Fix warnings related to fixtures not explicitly used.
@@ -1082,6 +2068,191 @@ def testDownloadStats(server, user, app_folder, draft_release_revision_folder, p
     assert resp.json == expectedStats
 
 
+def _filterDownloadStats(stats, keep):
+    """Keep the counts of a download stats tree for which ``keep(revision, baseName, os, arch)``
+    is true, ``baseName`` being None for the application packages.
+    """
+    filtered = {}
+    for revision, revisionStats in stats.items():
+        platforms = [(None, revisionStats.get('applications', {}))]
+        platforms.extend(revisionStats.get('extensions', {}).items())
+        for baseName, oses in platforms:
+            for os_, arches in oses.items():
+                for arch, count in arches.items():
+                    if not keep(revision, baseName, os_, arch):
+                        continue
+                    node = filtered.setdefault(revision, {})
+                    if baseName is None:
+                        node = node.setdefault('applications', {})
+                    else:
+                        node = node.setdefault('extensions', {}).setdefault(baseName, {})
+                    node.setdefault(os_, {})[arch] = count
+    return filtered
+
+
+def _downloadStatsTotals(stats):
+    totals = {'applications': 0, 'extensions': 0}
+    for revisionStats in stats.values():
+        platforms = [('applications', revisionStats.get('applications', {}))]
+        platforms.extend(('extensions', oses) for oses in revisionStats.get('extensions', {}).values())
+        for kind, oses in platforms:
+            totals[kind] += sum(sum(arches.values()) for arches in oses.values())
+    totals['downloads'] = totals['applications'] + totals['extensions']
+    return totals
+
+
+@pytest.mark.plugin('slicer_package_manager')
+def testFilteredDownloadStats(server, user, app_folder, packages, extensions):
+    # Fix warnings related to fixtures not explicitly used.
+    assert packages
+
+    def _getDownloadStats(params=None):
+        resp = server.request(
+            path='/app/%s/downloadstats' % app_folder['_id'],
+            method='GET',
+            user=user,
+            params=params,
+        )
+        assertStatusOk(resp)
+        return resp.json
+
+    ext3_file = File().findOne({'itemId': ObjectId(extensions[3]['_id'])})
+    for _idx in range(3):
+        _downloadFile(server, ext3_file['_id'], _user=user)
+    allStats = _getDownloadStats()
+    today = datetime.datetime.utcnow().date()
+
+    def _expected(keep):
+        stats = _filterDownloadStats(allStats, keep)
+        return {'totals': _downloadStatsTotals(stats), 'downloadStats': stats}
+
+    # All the downloads happened today
+    assert _getDownloadStats({'since': today.isoformat()}) == _expected(lambda *_: True)
+    yesterday = (today - datetime.timedelta(days=1)).isoformat()
+    assert _getDownloadStats({'until': yesterday}) == {
+        'totals': {'applications': 0, 'extensions': 0, 'downloads': 0}, 'downloadStats': {}}
+
+    assert _getDownloadStats({'os': 'macosx'}) == _expected(lambda _r, _b, os_, _a: os_ == 'macosx')
+    assert _getDownloadStats({'os': 'linux', 'arch': 'amd64'}) == _expected(
+        lambda _r, _b, os_, arch: (os_, arch) == ('linux', 'amd64'))
+    assert _getDownloadStats({'baseName': 'Ext2'}) == _expected(lambda _r, baseName, _o, _a: baseName == 'Ext2')
+    assert _getDownloadStats({'release_id_or_name': RELEASES[0]['name']}) == _expected(
+        lambda revision, *_: revision == RELEASES[0]['revision'])
+    assert _getDownloadStats({'release_id_or_name': 'unknown'})['totals']['downloads'] == 0
+
+    # Most downloaded packages
+    result = _getDownloadStats({'top': 2})
+    assert result['totals'] == _downloadStatsTotals(allStats)
+    assert result['top'][0] == {
+        'type': 'extension',
+        'baseName': extensions[3]['meta']['baseName'],
+        'downloads': _downloadStatsTotals(_filterDownloadStats(
+            allStats, lambda _r, baseName, _o, _a: baseName == extensions[3]['meta']['baseName']))['extensions'],
+    }
+    assert len(result['top']) == 2
+    assert result['top'][0]['downloads'] >= result['top'][1]['downloads']
+
+    resp = server.request(
+        path='/app/%s/downloadstats' % app_folder['_id'],
+        method='GET',
+        user=user,
+        params={'top': 0},
+    )
+    assertStatus(resp, 400)
+
+
+@pytest.mark.plugin('slicer_package_manager')
+def testGetExtensionsSortedByDownloads(server, user, app_folder, extensions):
+    baseName = extensions[3]['meta']['baseName']
+    ext3_file = File().findOne({'itemId': ObjectId(extensions[3]['_id'])})
+    for _idx in range(3):
+        _downloadFile(server, ext3_file['_id'], _user=user)
+
+    resp = server.request(
+        path='/app/%s/downloadstats' % app_folder['_id'],
+        method='GET',
+        user=user,
+        params={'top': 100},
+    )
+    assertStatusOk(resp)
+    downloads = {entry['baseName']: entry['downloads'] for entry in resp.json['top']
+                 if entry['type'] == 'extension'}
+
+    def _getRanking(params):
+        resp = server.request(
+            path='/app/%s/extension' % app_folder['_id'],
+            method='GET',
+            user=user,
+            params=dict(params, sort='downloads'),
+        )
+        assertStatusOk(resp)
+        assert all('_downloads' not in extension for extension in resp.json)
+        return [downloads.get(extension['meta']['baseName'], 0) for extension in resp.json]
+
+    ranking = _getRanking({'sortdir': -1})
+    assert len(ranking) == len(extensions)
+    assert ranking == sorted(ranking, reverse=True)
+    assert ranking[0] == downloads[baseName]
+    ranking = _getRanking({'sortdir': 1})
+    assert ranking == sorted(ranking)
+
+    # Ranked within each revision of the draft release, the most recent revision first
+    draftRelease = Folder().findOne({'parentId': app_folder['_id'], 'name': constants.DRAFT_RELEASE_NAME})
+    ranking = _getRanking({'release_id': draftRelease['_id'], 'sortdir': -1})
+    assert len(ranking) == 4
+
+
+@pytest.mark.plugin('slicer_package_manager')
+def testBackfillDownloadCounts(server, release_folder):
+    assert server  # Fix warnings related to fixtures not explicitly used.
+
+    # The backfill completed when the plugin was loaded, even without any download
+    assert Setting().get(PluginSettings.DOWNLOAD_COUNTS_BACKFILLED) is True
+
+    # Downloads counted in the release folder before they were counted per day
+    Folder().setMetadata(release_folder, {'downloadStats': {
+        'applications': {'linux': {'amd64': 2}},
+        constants.EXTENSIONS_FOLDER_NAME: {'Backfilled': {'win': {'amd64': 3}}},
+    }})
+    _backfillDownloadCounts()
+    assert DownloadCount().findOne() is None
+
+    # A download counted before the backfill doesn't prevent it, nor does a previous
+    # interrupted backfill
+    DownloadCount().recordDownload(
+        {'meta': {'app_id': str(release_folder['parentId']), 'baseName': 'Backfilled', 'os': 'win', 'arch': 'amd64',
+                  'app_revision': release_folder['meta']['revision']}},
+        release_folder, datetime.datetime.utcnow())
+    Setting().set(PluginSettings.DOWNLOAD_COUNTS_BACKFILLED, False)
+    for _attempt in range(2):
+        _backfillDownloadCounts()
+        assert sorted((doc['type'], doc['os'], doc['day'] is None, doc['count']) for doc in DownloadCount().find()) == [
+            ('application', 'linux', True, 2), ('extension', 'win', False, 1), ('extension', 'win', True, 3)]
+        Setting().set(PluginSettings.DOWNLOAD_COUNTS_BACKFILLED, False)
+
+
+@pytest.mark.plugin('slicer_package_manager')
+def testBackfillExtensionDownloads(server, app_folder):
+    assert server  # Fix warnings related to fixtures not explicitly used.
+
+    # The backfill completed when the plugin was loaded, even without any download
+    assert Setting().get(PluginSettings.EXTENSION_DOWNLOADS_BACKFILLED) is True
+
+    # Downloads counted before the extensions were ranked by downloads
+    DownloadCount().collection.insert_many([
+        {'app_id': str(app_folder['_id']), 'type': 'extension', 'baseName': 'Backfilled', 'os': platform,
+         'count': count}
+        for platform, count in (('linux', 2), ('win', 3))
+    ])
+    _backfillExtensionDownloads()
+    assert ExtensionDownloads().findOne() is None
+
+    Setting().set(PluginSettings.EXTENSION_DOWNLOADS_BACKFILLED, False)
+    _backfillExtensionDownloads()
+    assert [(doc['baseName'], doc['count']) for doc in ExtensionDownloads().find()] == [('Backfilled', 5)]
+    assert Setting().get(PluginSettings.EXTENSION_DOWNLOADS_BACKFILLED) is True
+
+
 @pytest.mark.plugin('slicer_package_manager')
 def testGetReleaseFolder(server, user, release_folder, packages, extensions):
     # Fix warnings related to fixtures not explicitly used.
@@ -1344,6 +2515,109 @@ def testPackageMetadataChecksumUpdate_4(server, user, items):
     assert not item_after["meta"]["sha512"]
 
 
+@pytest.mark.parametrize(("packageType", "items"), [
+    ('package', pytest.lazy_fixture('packages')),
+    ('extension', pytest.lazy_fixture('extensions')),
+])
+@pytest.mark.plugin('slicer_package_manager')
+def testReplacePackageFile(server, user, app_folder, packageType, items):
+    """Replace the binary file of a package and verify it is swapped in place."""
+    item = Item().load(items[0]['_id'], force=True)
+    files = list(Item().childFiles(item))
+    assert len(files) == 1
+
+    updated_contents = b"you've changed!"
+    resp = server.request(
+        path='/app/%s/%s/%s/file' % (app_folder['_id'], packageType, item['_id']),
+        method='POST',
+        user=user,
+        params={
+            'name': 'updated.tar.gz',
+            'size': len(updated_contents),
+        },
+    )
+    assertStatusOk(resp)
+    assert ObjectId(resp.json['fileId']) == files[0]['_id']
+
+    resp = server.request(
+        path='/file/chunk',
+        method='POST',
+        user=user,
+        body=updated_contents,
+        params={
+            'uploadId': resp.json['_id'],
+            'offset': 0,
+        },
+        type='application/octet-stream')
+    assertStatusOk(resp)
+
+    # Confirm the file was replaced in place and renamed
+    item_after = Item().load(item['_id'], force=True)
+    files_after = list(Item().childFiles(item_after))
+    assert len(files_after) == 1
+    assert files_after[0]['_id'] == files[0]['_id']
+    assert files_after[0]['name'] == 'updated.tar.gz'
+    assert _downloadFile(server, files_after[0]['_id'], _user=user) == updated_contents
+
+    # Confirm the item checksum was updated
+    assert item_after["meta"]["sha512"] == computeContentChecksum("SHA512", updated_contents)
+
+
+@pytest.mark.parametrize(("packageType", "items"), [
+    ('package', pytest.lazy_fixture('packages')),
+    ('extension', pytest.lazy_fixture('extensions')),
+])
+@pytest.mark.plugin('slicer_package_manager')
+def testReplacePackageFileBySha512(server, user, app_folder, packageType, items):
+    """Attach the content of an identical file without uploading it."""
+    source = list(Item().childFiles(Item().load(items[0]['_id'], force=True)))[0]
+    contents = _downloadFile(server, source['_id'], _user=user)
+    item = Item().load(items[1]['_id'], force=True)
+    files = list(Item().childFiles(item))
+
+    def _initUpload(sha512):
+        return server.request(
+            path='/app/%s/%s/%s/file' % (app_folder['_id'], packageType, item['_id']),
+            method='POST',
+            user=user,
+            params={
+                'name': 'negotiated.tar.gz',
+                'size': len(contents),
+                'sha512': sha512,
+            },
+        )
+
+    # Invalid checksum
+    resp = _initUpload('not-a-checksum')
+    assertStatus(resp, 400)
+
+    # Unknown content, an upload is returned
+    resp = _initUpload(computeContentChecksum('SHA512', b'unknown content'))
+    assertStatusOk(resp)
+    assert resp.json.get('_modelType') != 'file'
+    assert ObjectId(resp.json['fileId']) == files[0]['_id']
+    Upload().remove(Upload().load(resp.json['_id']))
+
+    # Known content, the file is attached right away
+    resp = _initUpload(computeContentChecksum('SHA512', contents).upper())
+    assertStatusOk(resp)
+    assert resp.json['_modelType'] == 'file'
+    assert ObjectId(resp.json['_id']) == files[0]['_id']
+    assert resp.json['name'] == 'negotiated.tar.gz'
+    item_after = Item().load(item['_id'], force=True)
+    assert Item().childFiles(item_after).count() == 1
+    assert item_after['meta']['sha512'] == source['sha512']
+
+    # The shared content outlives the source file
+    resp = server.request(
+        path='/app/%s/%s/%s' % (app_folder['_id'], packageType, items[0]['_id']),
+        method='DELETE',
+        user=user,
+    )
+    assertStatusOk(resp)
+    assert _downloadFile(server, files[0]['_id'], _user=user) == contents
+
+
 @pytest.mark.parametrize(
     ('build_date', 'expected_build_date', 'status_code'), [
         (None, None, 200),
@@ -1435,6 +2709,15 @@ def _createApplicationCheck(server, appName, appDescription, collId=None,
     return resp.json
 
 
+def _waitForJob(job, timeout=10):
+    job = Job().load(job['_id'], force=True)
+    deadline = time.time() + timeout
+    while job['status'] not in (JobStatus.SUCCESS, JobStatus.ERROR, JobStatus.CANCELED) and time.time() < deadline:
+        time.sleep(0.1)
+        job = Job().load(job['_id'], force=True)
+    return job
+
+
 def _createReleaseCheck(server, name, app_id, app_revision, desc='', _user=None):
     resp = server.request(
         path='/app/%s/release' % app_id,
@@ -0,0 +1,141 @@
+import cherrypy
+import pytest
+
+from click.testing import CliRunner
+from girder.models.collection import Collection
+from girder.models.file import File
+from girder.models.folder import Folder
+from girder.models.item import Item
+from girder.models.user import User
+
+from slicer_package_manager import constants, synthetic
+from slicer_package_manager.models.dependency import Dependency
+
+BINARY_SIZE = 32
+
+
+@pytest.mark.plugin('slicer_package_manager')
+def testSeedCatalog(server, fsAssetstore):
+    # Fix warnings related to fixtures not explicitly used.
+    assert server
+    assert fsAssetstore
+
+    admin = User().createUser('admin', 'password', 'Admin', 'Admin', 'admin@email.com')
+    application = synthetic.createApplication(admin, 'Slicer')
+    binary = synthetic.createDummyBinary(application, admin, BINARY_SIZE)
+    assert binary['size'] == BINARY_SIZE
+
+    progress = []
+    summary = synthetic.seedCatalog(
+        application, admin, draftRevisions=3, releases=2, extensions=4, operatingSystems=('linux', 'win'),
+        architectures=('amd64',), binary=binary, batchSize=5,
+        progress=lambda done, total: progress.append((done, total)))
+    assert progress == [(done, 5) for done in range(1, 6)]
+    assert summary['releases'] == ['5.0.0', '5.1.0']
+    assert summary['draftRevisions'] == ['30002', '30003', '30004']
+    assert summary['baseNames'] == ['SyntheticExtension%04d' % index for index in range(4)]
+
+    # One release or revision folder and its extensions folder per revision
+    draft = Folder().findOne({'parentId': application['_id'], 'name': constants.DRAFT_RELEASE_NAME})
+    releases = list(Folder().find({'parentId': application['_id'], 'name': {'$ne': constants.DRAFT_RELEASE_NAME}}))
+    revisions = list(Folder().find({'parentId': draft['_id']}))
+    assert sorted(folder['name'] for folder in releases) == summary['releases']
+    assert sorted(folder['name'] for folder in revisions) == summary['draftRevisions']
+    for index, folder in enumerate(sorted(releases + revisions, key=lambda folder: folder['meta']['revision'])):
+        assert folder['meta'] == {'revision': str(synthetic.FIRST_REVISION + index)}
+        assert folder['size'] == 2 * BINARY_SIZE
+        (extensionsFolder,) = Folder().find({'parentId': folder['_id']})
+        assert extensionsFolder['name'] == constants.EXTENSIONS_FOLDER_NAME
+        assert extensionsFolder['size'] == 2 * 4 * BINARY_SIZE
+
+        packages = list(Item().find({'folderId': folder['_id']}))
+        assert sorted((item['meta']['os'], item['meta']['arch']) for item in packages) == [
+            ('linux', 'amd64'), ('win', 'amd64')]
+        for item in packages:
+            assert item['meta']['app_id'] == str(application['_id'])
+            assert item['meta']['revision'] == folder['meta']['revision']
+            assert item['meta'].get('release') == (folder['name'] if folder in releases else None)
+            assert item['name'] == constants.APPLICATION_PACKAGE_TEMPLATE_NAME.format(**item['meta'])
+
+        extensions = list(Item().find({'folderId': extensionsFolder['_id']}))
+        assert len(extensions) == 2 * 4
+        for item in extensions:
+            assert item['meta']['app_revision'] == folder['meta']['revision']
+            assert item['meta']['baseName'] in summary['baseNames']
+            assert item['name'] == constants.EXTENSION_PACKAGE_TEMPLATE_NAME.format(**item['meta'])
+
+    # The first extension has no dependency, the extensions only depend on lower indices
+    extensionMetas = {
+        item['meta']['baseName']: item['meta'] for item in Item().find({'meta.app_revision': '30000'})}
+    assert extensionMetas['SyntheticExtension0000']['dependency'] == 'NA'
+    for baseName, meta in extensionMetas.items():
+        assert all(dependency < baseName for dependency in meta['dependency'].split() if dependency != 'NA')
+    edges = Dependency().find({'app_revision': '30000', 'os': 'linux'})
+    assert sorted((edge['from_baseName'], edge['to_baseName'], edge['kind']) for edge in edges) == sorted(
+        (baseName, name, kind)
+        for baseName, meta in extensionMetas.items()
+        for kind in ('dependency', 'recommends')
+        for name in meta.get(kind, 'NA').split() if name != 'NA')
+
+    # Every package has a file sharing the stored content of the dummy binary
+    itemCount = 5 * 2 * (1 + 4)
+    assert summary['counts'] == {
+        'folder': 5 * 2, 'item': itemCount, 'file': itemCount, Dependency().name: Dependency().find().count()}
+    packageIds = [item['_id'] for item in Item().find({'name': {'$ne': synthetic.BINARY_ITEM_NAME}})]
+    assert len(packageIds) == itemCount
+    files = list(File().find({'itemId': {'$in': packageIds}}))
+    assert len(files) == itemCount
+    assert {(file['path'], file['size'], file['sha512']) for file in files} == {
+        (binary['path'], BINARY_SIZE, binary['sha512'])}
+    assert all(item['size'] == BINARY_SIZE for item in Item().find({'_id': {'$in': packageIds}}))
+    collection = Collection().load(application['baseParentId'], force=True)
+    assert collection['size'] == (itemCount + 1) * BINARY_SIZE
+
+
+@pytest.mark.plugin('slicer_package_manager')
+def testSeedCatalogIsReproducible(server):
+    assert server  # Fix warnings related to fixtures not explicitly used.
+
+    admin = User().createUser('admin', 'password', 'Admin', 'Admin', 'admin@email.com')
+    applications = [synthetic.createApplication(admin, name) for name in ('Slicer', 'Other')]
+    for application in applications:
+        synthetic.seedCatalog(application, admin, draftRevisions=3, releases=2, extensions=4, seed=1)
+
+    def _metas(application):
+        return [
+            {key: value for key, value in item['meta'].items() if key not in ('app_id', 'build_date')}
+            for item in Item().find({'meta.app_id': str(application['_id'])})]
+
+    assert _metas(applications[0]) == _metas(applications[1])
+    # Without binary, the packages have no file
+    assert Item().find({'size': {'$ne': 0}}).count() == 0
+    assert File().find().count() == 0
+
+
+@pytest.mark.plugin('slicer_package_manager')
+def testSyntheticCatalogCommand(server, fsAssetstore, monkeypatch):
+    # Fix warnings related to fixtures not explicitly used.
+    assert server
+    assert fsAssetstore
+
+    # The models are already connected to the test database, the command doesn't reconnect them
+    database = 'mongodb://localhost:27017/girder'
+    monkeypatch.setitem(cherrypy.config, 'database', {})
+    result = CliRunner().invoke(synthetic.main, ['--database', database])
+    assert result.exit_code == 1
+    assert 'No user found to create the catalog' in result.output
+
+    User().createUser('admin', 'password', 'Admin', 'Admin', 'admin@email.com')
+    result = CliRunner().invoke(synthetic.main, [
+        '--database', database, '--applications', '2', '--draft-revisions', '2',
+        '--releases', '1', '--extensions', '2', '--os', 'linux', '--arch', 'amd64', '--binary-size', '0'])
+    assert result.exit_code == 0, result.output
+    assert 'Slicer1: ' in result.output
+    assert 'Slicer2: ' in result.output
+
+    applications = list(Folder().find({'name': {'$in': ['Slicer1', 'Slicer2']}}))
+    assert len(applications) == 2
+    for application in applications:
+        assert Item().find({'meta.app_id': str(application['_id'])}).count() == 3 * (1 + 2)
+        assert Item().find({'folderId': application['_id']}).count() == 0
+    assert File().find().count() == 0